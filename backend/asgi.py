@@ -0,0 +1,610 @@
+"""ASGI entry point serving the trivia API with an async database driver.
+
+The routes, payloads and error messages are the ones of flaskr, built on
+the same Question and Category tables, validation and search. Run it with
+any ASGI server, for example:
+
+    uvicorn asgi:app --workers 2
+
+On PostgreSQL the queries run on an asyncpg pool when asyncpg is
+installed (see requirements-asgi.txt), otherwise the blocking SQLAlchemy
+engine runs in a small thread pool so the mode also works against SQLite.
+The driver picked is logged on startup.
+"""
+import asyncio
+import importlib.util
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql.expression import Insert
+from models import (
+    CATEGORY_CACHE_TTL,
+    DB_POOL_SIZE,
+    Category,
+    Question,
+    get_database_path,
+    validate_question,
+    )
+from category_decks import CategoryDecks
+from request_utils import MAX_QUESTIONS_PER_PAGE, QUESTIONS_PER_PAGE, encode_cursor, parse_cursor, parse_question_count
+from search import InvertedIndex, SearchResults, postgres_search_clauses, tokenize
+from serialization import QUESTION_FIELDS, RESPONSE_FORMATS, dumps_json, format_question_rows, parse_fields, selected_fields
+
+ASYNC_DB_DRIVER = os.environ.get('TRIVIA_ASYNC_DB_DRIVER', 'auto')
+
+questions = Question.__table__
+categories = Category.__table__
+
+ERROR_MESSAGES = {
+    400: 'Bad request',
+    404: 'Not found',
+    405: 'Method not allowed',
+    422: 'Unprocessable Content',
+    500: 'Internal Server Error',
+    }
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type, Authorization'),
+    (b'access-control-allow-methods', b'GET, POST, PATCH, DELETE, OPTIONS'),
+    ]
+
+
+class HTTPError(Exception):
+    """Aborts the request with the JSON error payload of the status"""
+
+    def __init__(self, status):
+        Exception.__init__(self, status)
+        self.status = status
+
+
+class ThreadedDatabase:
+    """Runs the blocking SQLAlchemy engine in a bounded thread pool"""
+
+    name = 'threaded'
+
+    def __init__(self, url, max_workers=DB_POOL_SIZE):
+        self.url = url
+        self.is_postgres = make_url(url).get_backend_name() == 'postgresql'
+        self.max_workers = max_workers
+        self.engine = None
+        self.executor = None
+
+    async def connect(self):
+        self.engine = create_engine(self.url)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+    async def disconnect(self):
+        self.executor.shutdown(wait=True)
+        self.engine.dispose()
+
+    def _run(self, function):
+        return asyncio.get_event_loop().run_in_executor(self.executor, function)
+
+    async def fetch_all(self, query):
+        return await self._run(lambda: [tuple(row) for row in self.engine.execute(query)])
+
+    async def fetch_val(self, query):
+        return await self._run(lambda: self.engine.execute(query).scalar())
+
+    async def execute(self, query):
+        """Executes a statement, returning the new primary key of inserts or the row count"""
+        def run():
+            result = self.engine.execute(query)
+            if result.is_insert:
+                return result.inserted_primary_key[0]
+            return result.rowcount
+
+        return await self._run(run)
+
+
+class AsyncpgDatabase:
+    """Runs the queries on an asyncpg connection pool"""
+
+    name = 'asyncpg'
+    is_postgres = True
+    dialect = postgresql.dialect(paramstyle='numeric')
+    PARAMETER_PATTERN = re.compile(r'(?<!:):(\d+)')
+
+    def __init__(self, url, max_size=DB_POOL_SIZE):
+        url = make_url(url)
+        url.drivername = 'postgresql'
+        self.url = str(url)
+        self.max_size = max_size
+        self.pool = None
+
+    async def connect(self):
+        import asyncpg
+        self.pool = await asyncpg.create_pool(self.url, min_size=1, max_size=self.max_size)
+
+    async def disconnect(self):
+        await self.pool.close()
+
+    def compile(self, query):
+        compiled = query.compile(dialect=self.dialect)
+        sql = self.PARAMETER_PATTERN.sub(r'$\1', compiled.string)
+        return sql, [compiled.params[name] for name in compiled.positiontup]
+
+    async def fetch_all(self, query):
+        sql, args = self.compile(query)
+        return [tuple(record) for record in await self.pool.fetch(sql, *args)]
+
+    async def fetch_val(self, query):
+        sql, args = self.compile(query)
+        return await self.pool.fetchval(sql, *args)
+
+    async def execute(self, query):
+        """Executes a statement, returning the new primary key of inserts or the row count"""
+        if isinstance(query, Insert):
+            sql, args = self.compile(query.returning(questions.c.id))
+            return await self.pool.fetchval(sql, *args)
+
+        sql, args = self.compile(query)
+        status = await self.pool.execute(sql, *args)
+        return int(status.split()[-1])
+
+
+def create_database(url, driver=ASYNC_DB_DRIVER):
+    is_postgres = make_url(url).get_backend_name() == 'postgresql'
+
+    if driver == 'auto':
+        has_asyncpg = importlib.util.find_spec('asyncpg') is not None
+        driver = 'asyncpg' if is_postgres and has_asyncpg else 'threaded'
+
+    if driver == 'asyncpg':
+        database = AsyncpgDatabase(url)
+    else:
+        database = ThreadedDatabase(url)
+
+    if is_postgres and database.name != 'asyncpg':
+        print(f"🐢 asgi database driver: {database.name}, asyncpg is not installed")
+
+    return database
+
+
+def format_question(row):
+    return dict(zip(QUESTION_FIELDS, row))
+
+
+class TriviaASGI:
+    """ASGI application serving the trivia routes"""
+
+    def __init__(self, database):
+        self.database = database
+        self.search_index = None
+        self.decks = CategoryDecks()
+        self._categories = None
+        self._routes = [
+            ('GET', re.compile(r'^/categories$'), self.get_categories),
+            ('GET', re.compile(r'^/questions$'), self.get_questions),
+            ('POST', re.compile(r'^/questions$'), self.add_or_search_questions),
+            ('DELETE', re.compile(r'^/questions/(\d+)$'), self.delete_question_by_id),
+            ('GET', re.compile(r'^/categories/(\d+)/questions$'), self.get_questions_by_category),
+            ('POST', re.compile(r'^/quizzes$'), self.random_question),
+            ]
+
+    async def startup(self):
+        await self.database.connect()
+
+        if not self.database.is_postgres:
+            rows = await self.database.fetch_all(select([questions.c.id, questions.c.question, questions.c.answer]))
+            self.search_index = InvertedIndex()
+            self.search_index.build(rows)
+
+    async def shutdown(self):
+        await self.database.disconnect()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, scope, receive, send):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        request = Request(scope, body)
+
+        try:
+            if request.method == 'OPTIONS':
+                status, payload = 200, None
+            else:
+                status, payload = await self.dispatch(request)
+        except HTTPError as e:
+            status, payload = e.status, error_payload(e.status)
+        except Exception as e:
+            print(f"🧨 asgi {request.method} {request.path} error: {e}")
+            status, payload = 500, error_payload(500)
+
+        await send_json(send, status, payload)
+
+    async def dispatch(self, request):
+        path_matches = False
+
+        for method, pattern, handler in self._routes:
+            match = pattern.match(request.path)
+            if match is None:
+                continue
+            path_matches = True
+            if method == request.method:
+                return 200, await handler(request, *(int(group) for group in match.groups()))
+
+        raise HTTPError(405 if path_matches else 404)
+
+    async def categories_or_none(self, category_id=None):
+        """Returns the categories map, reloaded every CATEGORY_CACHE_TTL seconds"""
+        entry = self._categories
+
+        if entry is None or entry[2] < time.monotonic():
+            rows = await self.database.fetch_all(select([categories.c.id, categories.c.type]))
+            entry = (
+                { str(category_id): type for category_id, type in rows },
+                frozenset(category_id for category_id, _ in rows),
+                time.monotonic() + CATEGORY_CACHE_TTL,
+                )
+            self._categories = entry
+
+        if category_id and category_id not in entry[1]:
+            return None
+
+        return entry[0]
+
+    async def get_decks(self):
+        """Returns the category decks, rebuilt once expired like get_category_decks"""
+        if not self.decks.ready or self.decks.expires_at < time.monotonic():
+            self.decks.build(await self.database.fetch_all(select([questions.c.id, questions.c.category]).order_by(questions.c.id)))
+
+        return self.decks
+
+    async def rows_by_id(self, question_ids, fields=QUESTION_FIELDS):
+        """Returns the rows of the selected fields of the questions, in the order of question_ids"""
+        if not question_ids:
+            return []
+
+        query = select([questions.c[column] for column in selected_fields(fields)]).where(questions.c.id.in_(question_ids))
+        rows = { row[0]: row for row in await self.database.fetch_all(query) }
+
+        return [rows[question_id] for question_id in question_ids if question_id in rows]
+
+    async def paginate_questions(self, request, where=None, order_by=None, category_id=None, results=None):
+        """Same pages as request_utils.paginate_questions_or_none, keyset pages with cursor or after_id.
+
+        results, the SearchResults of an in-memory search, give the ids of
+        the page and the total instead of the where clause.
+        """
+        response_format = request.args.get('format', 'objects')
+
+        categories_map = await self.categories_or_none(category_id)
+
+        if categories_map is None:
+            raise HTTPError(400)
+
+        if response_format not in RESPONSE_FORMATS:
+            raise HTTPError(400)
+
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError:
+            raise HTTPError(400)
+
+        if 'cursor' in request.args or 'after_id' in request.args:
+            response = await self.seek_questions(request, where, category_id, fields, results)
+        else:
+            page = max(request.arg_int('page', 1), 1)
+            offset = (page - 1) * QUESTIONS_PER_PAGE
+
+            if results is not None:
+                page_ids, total_questions = results.page(category_id, offset, QUESTIONS_PER_PAGE)
+                rows = await self.rows_by_id(page_ids, fields)
+            else:
+                query = select([questions.c[column] for column in selected_fields(fields)])
+                count = select([func.count()]).select_from(questions)
+
+                if where is not None:
+                    query = query.where(where)
+                    count = count.where(where)
+
+                query = query.order_by(*(order_by or [questions.c.id]))
+                query = query.limit(QUESTIONS_PER_PAGE).offset(offset)
+
+                rows, total_questions = await asyncio.gather(
+                    self.database.fetch_all(query),
+                    self.database.fetch_val(count),
+                    )
+
+            response = {'rows': rows, 'total_questions': total_questions}
+
+        rows = response.pop('rows')
+
+        if len(rows) == 0:
+            raise HTTPError(404)
+
+        response.update({
+            'success': True,
+            'questions': format_question_rows(rows, response_format, fields),
+            'current_category': category_id if category_id else 0
+            })
+
+        if request.args.get('include_categories', 'true').lower() != 'false':
+            response['categories'] = categories_map
+
+        return response
+
+    async def seek_questions(self, request, where, category_id, fields, results):
+        """Same keyset page as request_utils.seek_questions_or_none, the rows under the key rows"""
+        try:
+            after_id = parse_cursor(request.args['cursor']) if 'cursor' in request.args else request.arg_int('after_id', 0)
+        except ValueError:
+            raise HTTPError(400)
+
+        limit = request.arg_int('limit', QUESTIONS_PER_PAGE)
+
+        if limit < 1 or limit > MAX_QUESTIONS_PER_PAGE:
+            raise HTTPError(400)
+
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
+        total_questions = None
+
+        if results is not None:
+            page_ids, total_questions = results.after(category_id, after_id, limit + 1)
+            rows = await self.rows_by_id(page_ids, fields)
+        else:
+            query = select([questions.c[column] for column in selected_fields(fields)]).where(questions.c.id > after_id)
+
+            if where is not None:
+                query = query.where(where)
+
+            rows = await self.database.fetch_all(query.order_by(questions.c.id).limit(limit + 1))
+
+            if include_total:
+                count = select([func.count()]).select_from(questions)
+                total_questions = await self.database.fetch_val(count.where(where) if where is not None else count)
+
+        response = {
+            'rows': rows[:limit],
+            'next_cursor': encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None,
+            }
+
+        if include_total:
+            response['total_questions'] = total_questions
+
+        return response
+
+    async def get_categories(self, request):
+        categories_map = await self.categories_or_none()
+
+        if categories_map is None:
+            raise HTTPError(400)
+
+        return {
+            'categories': categories_map,
+            'success': True
+            }
+
+    async def get_questions(self, request):
+        return await self.paginate_questions(request)
+
+    async def get_questions_by_category(self, request, id):
+        return await self.paginate_questions(request, where=questions.c.category == id, category_id=id)
+
+    async def add_or_search_questions(self, request):
+        body = request.json()
+        search = body.get('searchTerm')
+
+        if isinstance(search, str):
+            return await self.search_questions(request, search, body.get('searchAnswers') is True)
+
+        try:
+            fields = validate_question(body)
+        except ValueError as e:
+            print(f"🧨 add_or_search_questions error: {e}")
+            raise HTTPError(422)
+
+        question_id = await self.database.execute(questions.insert().values(**fields))
+
+        if self.search_index is not None:
+            self.search_index.add(question_id, fields['question'], fields['answer'])
+
+        if self.decks.ready:
+            self.decks.add(question_id, fields['category'])
+
+        return {"success": True}
+
+    async def search_questions(self, request, search, include_answers):
+        tokens = tokenize(search)
+
+        if not tokens:
+            return await self.paginate_questions(request)
+
+        if self.search_index is None:
+            match, rank = postgres_search_clauses(tokens, include_answers)
+            return await self.paginate_questions(request, where=match, order_by=[rank.desc(), questions.c.id])
+
+        results = SearchResults(self.search_index.search(search, include_answers))
+
+        return await self.paginate_questions(request, results=results)
+
+    async def delete_question_by_id(self, request, id):
+        deleted = await self.database.execute(questions.delete().where(questions.c.id == id))
+
+        if deleted == 0:
+            raise HTTPError(404)
+
+        if self.search_index is not None:
+            self.search_index.remove(id)
+
+        self.decks.remove(id)
+
+        return {"success": True}
+
+    async def random_question(self, request):
+        body = request.json()
+
+        previous_questions = body.get('previous_questions')
+
+        if previous_questions is None:
+            raise HTTPError(422)
+
+        category = body.get('quiz_category')
+
+        if category is None:
+            raise HTTPError(422)
+
+        category_id = int(category.get('id'))
+
+        if body.get('count') is not None:
+            try:
+                count = parse_question_count(body['count'])
+            except ValueError:
+                raise HTTPError(422)
+
+            round_questions = await self.random_questions(previous_questions, count, category_id)
+
+            return {
+                "previousQuestions": body['previous_questions'],
+                "question": round_questions[0] if round_questions else None,
+                "questions": round_questions,
+                "success": True
+                }
+
+        question = await self.random_question_or_none(previous_questions, category_id)
+
+        return {
+            "previousQuestions": body['previous_questions'],
+            "question": question,
+            "success": True
+            }
+
+    async def random_question_or_none(self, previous_questions, category_id=None):
+        """Draws a question from the category decks, like request_utils.random_question_or_none"""
+        round_questions = await self.random_questions(previous_questions, 1, category_id)
+        return round_questions[0] if round_questions else None
+
+    async def random_questions(self, previous_questions, count, category_id=None):
+        """Draws count eligible ids from the category decks and reads them with one IN query.
+
+        The ids of questions deleted by another process since the decks
+        were built are dropped, and drawn again from what is left.
+        """
+        decks = await self.get_decks()
+        excluded = set(previous_questions or ())
+        picked = []
+
+        while len(picked) < count:
+            question_ids = decks.random_ids(category_id, excluded, count - len(picked))
+
+            if not question_ids:
+                break
+
+            rows = await self.rows_by_id(question_ids)
+            picked.extend(format_question(row) for row in rows)
+            excluded.update(question_ids)
+
+        return picked
+
+
+class Request:
+    """The parts of an ASGI http scope used by the routes"""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.headers = { name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', []) }
+        self.body = body
+
+    def arg_int(self, name, default):
+        try:
+            return int(self.args.get(name, default))
+        except ValueError:
+            return default
+
+    @property
+    def is_json(self):
+        mimetype = self.headers.get('content-type', '').split(';')[0].strip()
+        return mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))
+
+    def json(self):
+        """Returns the JSON object of the body, aborting with 400 like flask does"""
+        if not self.is_json:
+            raise HTTPError(400)
+
+        try:
+            body = json.loads(self.body.decode('utf-8'))
+        except ValueError:
+            raise HTTPError(400)
+
+        if not isinstance(body, dict):
+            raise HTTPError(400)
+
+        return body
+
+
+def error_payload(status):
+    return {
+        "success": False,
+        "error": status,
+        "message": ERROR_MESSAGES[status],
+        }
+
+async def send_json(send, status, payload):
+    # Same bytes as flask.jsonify, so both modes are interchangeable.
+    body = b'' if payload is None else dumps_json(payload)
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode()),
+        ] + CORS_HEADERS
+
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def create_asgi_app(test_config=None):
+    """Create and configure the ASGI app"""
+    config = dict(test_config or {})
+    url = str(config.get('SQLALCHEMY_DATABASE_URI') or get_database_path())
+
+    return TriviaASGI(create_database(url, config.get('ASYNC_DB_DRIVER', ASYNC_DB_DRIVER)))
+
+
+_app = None
+_app_lock = threading.Lock()
+
+async def app(scope, receive, send):
+    """Module level application for ASGI servers, created on first use"""
+    global _app
+
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_asgi_app()
+
+    await _app(scope, receive, send)
@@ -0,0 +1 @@
+"""Benchmarks of the trivia API, run from the backend folder with python -m benchmarks.<script>"""
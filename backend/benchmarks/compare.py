@@ -0,0 +1,37 @@
+"""Compares two result files of benchmarks.run.
+
+    python -m benchmarks.compare results/abc1234-100000.json results/def5678-100000.json
+"""
+import argparse
+import json
+
+METRICS = ('requests_per_second', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def change(old, new):
+    if old in (None, 0) or new is None:
+        return ''
+    return '{:+.1f}%'.format((new - old) / old * 100)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args()
+
+    with open(args.baseline) as baseline_file, open(args.candidate) as candidate_file:
+        baseline = json.load(baseline_file)
+        candidate = json.load(candidate_file)
+
+    print('{} -> {}'.format(baseline['meta']['commit'], candidate['meta']['commit']))
+
+    for name in sorted(set(baseline['results']) | set(candidate['results'])):
+        old = baseline['results'].get(name, {})
+        new = candidate['results'].get(name, {})
+        print(name)
+        for metric in METRICS:
+            print('  {:<20} {:>10} {:>10} {:>9}'.format(metric, str(old.get(metric)), str(new.get(metric)), change(old.get(metric), new.get(metric))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""Measures the latency and throughput of every API endpoint.
+
+    python -m benchmarks.run --database sqlite:////tmp/trivia_bench.db --mode both --requests 1000 --concurrency 8
+
+The requests go through the Flask test client (mode client), through a
+threaded WSGI server started on a free local port (mode wsgi) or through an
+already running server (--url). The results are written as sorted JSON so
+that two runs can be compared with python -m benchmarks.compare.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socketserver
+import subprocess
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), 'results')
+PERCENTILES = (50, 95, 99)
+
+# Every request comes from one client address, which the rate limits of
+# the write and quiz endpoints would answer with 429s.
+DEFAULT_CONFIG = {'RATE_LIMIT_BACKEND': 'none'}
+
+
+class BenchmarkContext:
+    """What the scenarios need to know about the seeded data"""
+
+    def __init__(self, app, delete_count):
+        from models import Category, Question, db
+        from search import tokenize
+
+        with app.app_context():
+            self.min_id, self.max_id = db.session.query(db.func.min(Question.id), db.func.max(Question.id)).one()
+            self.question_count = Question.query.count()
+            self.category_ids = [category_id for category_id, in db.session.query(Category.id)]
+
+            sample = db.session.query(Question.question).order_by(Question.id).limit(200).all()
+            self.search_words = sorted({word for question, in sample for word in tokenize(question) if len(word) > 3})[:100]
+
+            # Sacrificial questions for the DELETE scenario, so that the seeded ones are kept.
+            rows = [
+                {'question': 'Benchmark delete?', 'answer': 'benchmark', 'category': self.category_ids[0], 'difficulty': 1}
+                for _ in range(delete_count)
+                ]
+            if rows:
+                db.session.execute(Question.__table__.insert(), rows)
+                db.session.commit()
+            self.delete_ids = deque(
+                question_id for question_id, in db.session.query(Question.id).filter(Question.answer == 'benchmark')
+                )
+
+        self.pages = max(1, (self.question_count + 9) // 10)
+
+    def cleanup(self, app):
+        from models import Question, db
+
+        with app.app_context():
+            Question.query.filter(Question.answer == 'benchmark').delete(synchronize_session=False)
+            db.session.commit()
+
+
+def scenario_questions_page(context, rng):
+    return 'GET', '/questions?page={}'.format(rng.randint(1, min(context.pages, 10))), None, (200,)
+
+def scenario_questions_deep_page(context, rng):
+    return 'GET', '/questions?page={}'.format(rng.randint(max(1, context.pages - 10), context.pages)), None, (200,)
+
+def scenario_questions_cursor(context, rng):
+    return 'GET', '/questions?after_id={}'.format(rng.randint(context.min_id, context.max_id - 20)), None, (200,)
+
+def scenario_category_questions(context, rng):
+    return 'GET', '/categories/{}/questions'.format(rng.choice(context.category_ids)), None, (200, 404)
+
+def scenario_search(context, rng):
+    body = {'searchTerm': rng.choice(context.search_words)}
+    return 'POST', '/questions', body, (200, 404)
+
+def scenario_quizzes(context, rng):
+    previous = [rng.randint(context.min_id, context.max_id) for _ in range(5)]
+    body = {'previous_questions': previous, 'quiz_category': {'id': rng.choice([0] + context.category_ids)}}
+    return 'POST', '/quizzes', body, (200,)
+
+def scenario_delete(context, rng):
+    try:
+        question_id = context.delete_ids.popleft()
+    except IndexError:
+        question_id = context.max_id + 1
+    return 'DELETE', '/questions/{}'.format(question_id), None, (200,)
+
+SCENARIOS = {
+    'questions_page': scenario_questions_page,
+    'questions_deep_page': scenario_questions_deep_page,
+    'questions_cursor': scenario_questions_cursor,
+    'category_questions': scenario_category_questions,
+    'search': scenario_search,
+    'quizzes': scenario_quizzes,
+    'delete': scenario_delete,
+    }
+
+
+class FlaskClientDriver:
+    """Sends the requests through the Flask test client, without any network"""
+
+    name = 'client'
+
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, state, method, path, body):
+        client = state.get('client')
+        if client is None:
+            client = state['client'] = self.app.test_client()
+
+        data = json.dumps(body) if body is not None else None
+        return client.open(path, method=method, data=data, content_type='application/json').status_code
+
+
+class HttpDriver:
+    """Sends the requests to an HTTP server, keeping one connection per worker when allowed"""
+
+    name = 'http'
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+
+    def request(self, state, method, path, body):
+        data = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data is not None else {}
+
+        for attempt in range(2):
+            connection = state.get('connection')
+            if connection is None:
+                connection = state['connection'] = http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+            try:
+                connection.request(method, path, body=data, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                state['connection'] = None
+                if attempt == 1:
+                    raise
+                continue
+
+            if response.will_close:
+                connection.close()
+                state['connection'] = None
+
+            return response.status
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_wsgi_server(app):
+    server = make_server('127.0.0.1', 0, app, server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
+
+def percentile(sorted_values, rank):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(rank / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def run_scenario(driver, context, scenario, requests, concurrency, warmup, seed):
+    """Runs requests of the scenario spread over concurrency threads"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(worker_id, count, record):
+        rng = random.Random(seed * 1000 + worker_id)
+        state = {}
+        for _ in range(count):
+            method, path, body, expected = scenario(context, rng)
+            start = time.perf_counter()
+            try:
+                status = driver.request(state, method, path, body)
+            except Exception as e:
+                status = str(e)
+            elapsed = time.perf_counter() - start
+            if record:
+                with lock:
+                    latencies.append(elapsed)
+                    if status not in expected:
+                        errors.append(status)
+
+    def run(total, record):
+        threads = [
+            threading.Thread(target=worker, args=(worker_id, total // concurrency + (worker_id < total % concurrency), record))
+            for worker_id in range(concurrency)
+            ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    run(warmup, record=False)
+    elapsed = run(requests, record=True)
+
+    latencies.sort()
+    result = {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        }
+    for rank in PERCENTILES:
+        value = percentile(latencies, rank)
+        result['p{}_ms'.format(rank)] = round(value * 1000, 3) if value is not None else None
+
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def parse_config(values):
+    """Parses KEY=VALUE pairs, VALUE being JSON when it can be parsed as such"""
+    config = {}
+    for value in values:
+        key, _, raw = value.partition('=')
+        try:
+            config[key] = json.loads(raw)
+        except ValueError:
+            config[key] = raw
+    return config
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the trivia API')
+    parser.add_argument('--database', required=True, help='SQLAlchemy URI of a database seeded with benchmarks.seed')
+    parser.add_argument('--mode', choices=('client', 'wsgi', 'both'), default='both')
+    parser.add_argument('--url', help='benchmark an already running server instead of starting one')
+    parser.add_argument('--requests', type=int, default=500, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='defaults to every scenario')
+    parser.add_argument('--config', action='append', default=[], help='KEY=VALUE app config, for example RESPONSE_CACHE_BACKEND=none. Rate limiting is off unless RATE_LIMIT_BACKEND is given')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='result file, by default results/<commit>-<questions>.json')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TRIVIA_DB_NAME', 'trivia_bench')
+    os.environ.setdefault('TRIVIA_DB_PATH', args.database)
+
+    from flaskr import create_app
+
+    config = dict(DEFAULT_CONFIG, **parse_config(args.config), SQLALCHEMY_DATABASE_URI=args.database)
+    app = create_app(config)
+
+    scenarios = args.scenario or sorted(SCENARIOS)
+    drivers = []
+    server = None
+
+    if args.url:
+        drivers.append(('http', HttpDriver(args.url)))
+    else:
+        if args.mode in ('client', 'both'):
+            drivers.append(('client', FlaskClientDriver(app)))
+        if args.mode in ('wsgi', 'both'):
+            server, url = start_wsgi_server(app)
+            drivers.append(('wsgi', HttpDriver(url)))
+
+    delete_count = (args.requests + args.warmup) * len(drivers) if 'delete' in scenarios else 0
+    context = BenchmarkContext(app, delete_count)
+
+    results = {}
+    try:
+        for driver_name, driver in drivers:
+            for name in scenarios:
+                result = run_scenario(driver, context, SCENARIOS[name], args.requests, args.concurrency, args.warmup, args.seed)
+                results['{}/{}'.format(driver_name, name)] = result
+                print('{:<32} {:>9} req/s  p50 {:>8} ms  p95 {:>8} ms  p99 {:>8} ms  errors {}'.format(
+                    '{}/{}'.format(driver_name, name), result['requests_per_second'],
+                    result['p50_ms'], result['p95_ms'], result['p99_ms'], result['errors']))
+    finally:
+        if server is not None:
+            server.shutdown()
+        context.cleanup(app)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'database': app.extensions['sqlalchemy'].db.get_engine(app).dialect.name,
+            'questions': context.question_count,
+            'categories': len(context.category_ids),
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'config': {key: value for key, value in config.items() if key != 'SQLALCHEMY_DATABASE_URI'},
+            },
+        'results': results,
+        }
+
+    output = args.output or os.path.join(RESULTS_FOLDER, '{}-{}.json'.format(report['meta']['commit'], context.question_count))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as result_file:
+        json.dump(report, result_file, indent=2, sort_keys=True)
+        result_file.write('\n')
+    print('results written to {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Seeds a synthetic question bank for the benchmarks.
+
+    python -m benchmarks.seed --database sqlite:////tmp/trivia_bench.db --questions 100000 --categories 50
+"""
+import argparse
+import os
+import random
+import time
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa', 'qui', 'dor', 'fen', 'gal', 'hul', 'jor']
+
+BATCH_SIZE = 10000
+
+
+def vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def seed(database, questions, categories, seed=42, echo=print):
+    """Replaces the categories and questions of the database with synthetic ones"""
+    os.environ.setdefault('TRIVIA_DB_NAME', 'trivia_bench')
+    os.environ.setdefault('TRIVIA_DB_PATH', database)
+
+    from sqlalchemy import create_engine
+    from models import Category, Question, db
+
+    rng = random.Random(seed)
+    words = vocabulary(2000, rng)
+    engine = create_engine(database)
+    db.Model.metadata.create_all(engine, tables=[Category.__table__, Question.__table__])
+
+    started = time.perf_counter()
+
+    with engine.begin() as connection:
+        connection.execute(Question.__table__.delete())
+        connection.execute(Category.__table__.delete())
+        connection.execute(Category.__table__.insert(), [
+            {'id': category_id, 'type': 'Category {}'.format(category_id)}
+            for category_id in range(1, categories + 1)
+            ])
+
+    for start in range(0, questions, BATCH_SIZE):
+        rows = []
+        for question_id in range(start + 1, min(start + BATCH_SIZE, questions) + 1):
+            rows.append({
+                'id': question_id,
+                'question': ' '.join(rng.choice(words) for _ in range(rng.randint(6, 12))).capitalize() + '?',
+                'answer': ' '.join(rng.choice(words) for _ in range(rng.randint(1, 3))).capitalize(),
+                'category': rng.randint(1, categories),
+                'difficulty': rng.randint(1, 5),
+                })
+        with engine.begin() as connection:
+            connection.execute(Question.__table__.insert(), rows)
+        echo('seeded {} questions'.format(start + len(rows)))
+
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as connection:
+            connection.execute("SELECT setval('questions_id_seq', (SELECT max(id) FROM questions))")
+            connection.execute("SELECT setval('categories_id_seq', (SELECT max(id) FROM categories))")
+
+    engine.dispose()
+    echo('seeded {} questions in {} categories in {:.1f}s'.format(questions, categories, time.perf_counter() - started))
+
+def main():
+    parser = argparse.ArgumentParser(description='Seeds a synthetic question bank')
+    parser.add_argument('--database', required=True, help='SQLAlchemy URI, the data is replaced')
+    parser.add_argument('--questions', type=int, default=10000, help='10000, 100000 or 1000000 for the standard sizes')
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    seed(args.database, args.questions, args.categories, args.seed)
+
+
+if __name__ == '__main__':
+    main()
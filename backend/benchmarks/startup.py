@@ -0,0 +1,118 @@
+"""Measures the cold start of a worker.
+
+    python -m benchmarks.startup --database sqlite:////tmp/trivia_bench.db --runs 10
+
+Every run starts a fresh interpreter, which imports flaskr, creates the app
+and serves a first and a second GET /questions through the test client,
+once per configuration: the default lazy start, WARM_UP and
+DB_AUTO_MIGRATE. The results are written like the ones of benchmarks.run.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from benchmarks.run import RESULTS_FOLDER, git_commit, parse_config, percentile
+
+BACKEND_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGURATIONS = {
+    'lazy': {},
+    'warm_up': {'WARM_UP': True},
+    'auto_migrate': {'DB_AUTO_MIGRATE': True},
+    }
+
+PHASES = ('import', 'create_app', 'first_request', 'second_request', 'total')
+
+
+def measure(config):
+    """Runs in the child interpreter, returns the milliseconds of every phase"""
+    timings = {}
+    start = time.perf_counter()
+
+    from flaskr import create_app
+    timings['import'] = time.perf_counter() - start
+
+    phase_start = time.perf_counter()
+    app = create_app(config)
+    timings['create_app'] = time.perf_counter() - phase_start
+
+    client = app.test_client()
+    for phase in ('first_request', 'second_request'):
+        phase_start = time.perf_counter()
+        status = client.get('/questions?page=1').status_code
+        timings[phase] = time.perf_counter() - phase_start
+        if status != 200:
+            raise RuntimeError('GET /questions answered {}'.format(status))
+
+    timings['total'] = time.perf_counter() - start
+
+    return { phase: seconds * 1000 for phase, seconds in timings.items() }
+
+def run_child(config):
+    env = dict(os.environ, TRIVIA_DB_PATH=config['SQLALCHEMY_DATABASE_URI'])
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.startup', '--child', json.dumps(config)],
+        cwd=BACKEND_FOLDER, env=env,
+        )
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+def summarize(samples):
+    result = {}
+
+    for phase in PHASES:
+        values = sorted(sample[phase] for sample in samples)
+        result['{}_p50_ms'.format(phase)] = round(percentile(values, 50), 3)
+        result['{}_max_ms'.format(phase)] = round(values[-1], 3)
+
+    result['p50_ms'] = result['total_p50_ms']
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the cold start of the trivia app')
+    parser.add_argument('--database', help='SQLAlchemy URI of a database seeded with benchmarks.seed')
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters per configuration')
+    parser.add_argument('--configuration', action='append', choices=sorted(CONFIGURATIONS), help='defaults to every configuration')
+    parser.add_argument('--config', action='append', default=[], help='KEY=VALUE app config added to every configuration')
+    parser.add_argument('--output', help='result file, by default results/<commit>-startup.json')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(measure(json.loads(args.child))))
+        return
+
+    if not args.database:
+        parser.error('--database is required')
+
+    base = dict(parse_config(args.config), SQLALCHEMY_DATABASE_URI=args.database)
+    results = {}
+
+    for name in args.configuration or sorted(CONFIGURATIONS):
+        samples = [run_child(dict(base, **CONFIGURATIONS[name])) for _ in range(args.runs)]
+        result = results['startup/{}'.format(name)] = summarize(samples)
+        print('{:<24} {}'.format(name, '  '.join('{} {:>8} ms'.format(phase, result['{}_p50_ms'.format(phase)]) for phase in PHASES)))
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'runs': args.runs,
+            'config': {key: value for key, value in base.items() if key != 'SQLALCHEMY_DATABASE_URI'},
+            },
+        'results': results,
+        }
+
+    output = args.output or os.path.join(RESULTS_FOLDER, '{}-startup.json'.format(report['meta']['commit']))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as result_file:
+        json.dump(report, result_file, indent=2, sort_keys=True)
+        result_file.write('\n')
+    print('results written to {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
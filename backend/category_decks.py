@@ -0,0 +1,237 @@
+"""In-process sorted id arrays of the questions of every category"""
+import bisect
+import os
+import random
+import threading
+import time
+from array import array
+from flask import current_app
+from models import Question, db, on_questions_changed, on_remote_questions_changed, primary_reads
+
+CATEGORY_DECKS_TTL = float(os.environ.get('TRIVIA_CATEGORY_DECKS_TTL', 300))
+
+CATEGORY_DECKS = 'trivia_category_decks'
+
+NO_CATEGORY = -1
+
+
+class CategoryDecks:
+    """Sorted arrays of question ids, for every question and per category.
+
+    The ids are kept in array('q') buffers, 8 bytes per question and deck,
+    and the category of every question sits in a second array aligned with
+    the sorted ids, so an update moving a question between categories finds
+    its previous deck with a binary search. Writes of this process are
+    applied as they are committed. The arrays are expired whenever the data
+    version moves, so the writes of other processes are picked up on the
+    next request, and rebuilt every ttl seconds at the latest.
+    """
+
+    def __init__(self, ttl=CATEGORY_DECKS_TTL):
+        self.ttl = ttl
+        self.ready = False
+        self.expires_at = 0.0
+        self._ids = array('q')
+        self._categories = array('q')
+        self._decks = {}
+        self._pending = None
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+
+    @property
+    def tracking(self):
+        """Whether writes have to be applied, the decks being current or being built"""
+        return self.ready or self._pending is not None
+
+    def build(self, rows):
+        """Indexes (id, category) rows ordered by id, replacing the current content.
+
+        The rows are indexed into new arrays without holding the lock, so
+        reads and writes go on against the current arrays meanwhile. The
+        writes applied during the build are recorded and replayed on the new
+        arrays once they are swapped in, as the rows may predate them.
+        """
+        with self._lock:
+            self._pending = []
+
+        try:
+            ids = array('q')
+            categories = array('q')
+            decks = {}
+
+            for question_id, category_id in rows:
+                category_id = NO_CATEGORY if category_id is None else category_id
+                ids.append(question_id)
+                categories.append(category_id)
+                deck_of(decks, category_id).append(question_id)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            self._ids, self._categories, self._decks = ids, categories, decks
+            pending, self._pending = self._pending, None
+
+            for question_id, category_id, removed in pending:
+                if removed:
+                    self.remove(question_id)
+                else:
+                    self.add(question_id, category_id)
+
+            self.ready = True
+            self.expires_at = time.monotonic() + self.ttl
+
+    def build_once(self, load_rows):
+        """Builds the decks from load_rows() unless they are current.
+
+        A single thread loads the rows. While it does, the other threads
+        keep reading the expired decks, or wait for the first build.
+        """
+        if self.ready and self.expires_at >= time.monotonic():
+            return
+
+        if not self._build_lock.acquire(blocking=not self.ready):
+            return
+
+        try:
+            if not self.ready or self.expires_at < time.monotonic():
+                self.build(load_rows())
+        finally:
+            self._build_lock.release()
+
+    def expire(self):
+        """Rebuilds the decks on their next use"""
+        self.expires_at = 0.0
+
+    def _ids_of(self, category_id):
+        return self._decks.get(category_id, array('q')) if category_id else self._ids
+
+    def add(self, question_id, category_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((question_id, category_id, False))
+
+            self._remove(question_id)
+            category_id = NO_CATEGORY if category_id is None else category_id
+
+            position = bisect.bisect_left(self._ids, question_id)
+            self._ids.insert(position, question_id)
+            self._categories.insert(position, category_id)
+
+            deck = deck_of(self._decks, category_id)
+            deck.insert(bisect.bisect_left(deck, question_id), question_id)
+
+    def remove(self, question_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((question_id, None, True))
+
+            self._remove(question_id)
+
+    def _remove(self, question_id):
+        position = bisect.bisect_left(self._ids, question_id)
+
+        if position == len(self._ids) or self._ids[position] != question_id:
+            return
+
+        category_id = self._categories[position]
+        del self._ids[position]
+        del self._categories[position]
+
+        deck = self._decks[category_id]
+        del deck[bisect.bisect_left(deck, question_id)]
+
+    def count(self, category_id=None):
+        with self._lock:
+            return len(self._ids_of(category_id))
+
+    def page(self, category_id, offset, limit):
+        """Returns the ids of a page and the number of questions of the category"""
+        with self._lock:
+            ids = self._ids_of(category_id)
+            return ids[offset:offset + limit].tolist(), len(ids)
+
+    def after(self, category_id, after_id, limit):
+        """Returns at most limit ids greater than after_id and the number of questions of the category"""
+        with self._lock:
+            ids = self._ids_of(category_id)
+            position = bisect.bisect_right(ids, after_id)
+            return ids[position:position + limit].tolist(), len(ids)
+
+    def ids(self, category_id=None):
+        with self._lock:
+            return self._ids_of(category_id).tolist()
+
+    def random_id(self, category_id=None, excluded=()):
+        """Returns a random id of the category which is not in excluded, or None.
+
+        Every eligible id is equally likely, whatever the ids excluded
+        around it.
+        """
+        picked = self.random_ids(category_id, excluded)
+        return picked[0] if picked else None
+
+    def random_ids(self, category_id=None, excluded=(), count=1):
+        """Returns at most count distinct random ids of the category which are not in excluded.
+
+        count plus len(excluded) distinct positions are drawn, so at least
+        count of them are eligible whenever the deck has that many, and the
+        cost does not depend on the size of the deck.
+        """
+        with self._lock:
+            ids = self._ids_of(category_id)
+            positions = random.sample(range(len(ids)), min(len(ids), count + len(excluded)))
+            picked = [ids[position] for position in positions if ids[position] not in excluded]
+
+        return picked[:count]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'questions': len(self._ids),
+                'categories': { str(category_id): len(deck) for category_id, deck in self._decks.items() if category_id != NO_CATEGORY },
+                'bytes': (len(self._ids) * 3) * self._ids.itemsize,
+                }
+
+
+def deck_of(decks, category_id):
+    deck = decks.get(category_id)
+    if deck is None:
+        deck = decks[category_id] = array('q')
+    return deck
+
+def init_category_decks(app):
+    """Creates the decks of the app, built on first use, and keeps them in sync with the question writes"""
+    app.config.setdefault('CATEGORY_DECKS_TTL', CATEGORY_DECKS_TTL)
+
+    decks = CategoryDecks(app.config['CATEGORY_DECKS_TTL'])
+    app.extensions[CATEGORY_DECKS] = decks
+    on_questions_changed(app, lambda action, rows: update_category_decks(decks, action, rows))
+    on_remote_questions_changed(app, decks.expire)
+
+def load_deck_rows():
+    return db.session.query(Question.id, Question.category).order_by(Question.id).yield_per(10000)
+
+def update_category_decks(decks, action, rows):
+    if not decks.tracking:
+        return
+
+    for row in rows:
+        if action == 'delete':
+            decks.remove(row['id'])
+        else:
+            decks.add(row['id'], row.get('category'))
+
+def get_category_decks():
+    """Returns the decks of the app, rebuilding them once expired.
+
+    The rows are always loaded from the primary: the decks follow the data
+    version of the primary, which a replica or a snapshot lags.
+    """
+    decks = current_app.extensions[CATEGORY_DECKS]
+
+    with primary_reads():
+        decks.build_once(load_deck_rows)
+
+    return decks
@@ -0,0 +1,83 @@
+"""Flask CLI commands for the trivia app"""
+import time
+import click
+from flask import current_app
+from models import migrate_db
+from question_export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_query, export_questions
+from question_import import (
+    IMPORT_BATCH_SIZE,
+    IMPORT_FORMATS,
+    import_questions,
+    read_records,
+    )
+from snapshot import build_snapshot
+from warm_up import warm_up
+
+
+def init_commands(app):
+    """Registers the CLI commands of the app"""
+
+    @app.cli.command('import-questions')
+    @click.argument('source', type=click.File('rb'))
+    @click.option('--format', 'format', type=click.Choice(IMPORT_FORMATS), default=None,
+        help='Format of the source, guessed from the file extension by default.')
+    @click.option('--batch-size', type=click.IntRange(min=1), default=IMPORT_BATCH_SIZE, show_default=True,
+        help='Number of rows written per INSERT and commit.')
+    def import_questions_command(source, format, batch_size):
+        """Imports questions from an NDJSON or CSV file, - for stdin"""
+        if format is None:
+            format = 'csv' if source.name.endswith('.csv') else 'ndjson'
+
+        report = import_questions(read_records(source, format), batch_size)
+
+        for error in report['errors']:
+            click.echo('line {}: {}'.format(error['line'], error['error']), err=True)
+
+        click.echo('Imported {} questions, {} failed'.format(report['imported'], report['failed']))
+
+    @app.cli.command('export-questions')
+    @click.argument('destination', type=click.File('wb'), default='-')
+    @click.option('--format', 'format', type=click.Choice(EXPORT_FORMATS), default=None,
+        help='Format of the destination, guessed from the file extension by default.')
+    @click.option('--category', type=int, default=None, help='Only export the questions of this category.')
+    @click.option('--after-id', type=click.IntRange(min=0), default=0,
+        help='Only export the questions of a greater id, the last id of a previous export.')
+    @click.option('--chunk-size', type=click.IntRange(min=1), default=EXPORT_CHUNK_SIZE, show_default=True,
+        help='Number of rows read and written at a time.')
+    def export_questions_command(destination, format, category, after_id, chunk_size):
+        """Exports the questions as NDJSON or CSV to a file, - for stdout"""
+        if format is None:
+            format = 'csv' if destination.name.endswith('.csv') else 'ndjson'
+
+        for chunk in export_questions(export_query(category, after_id), format, chunk_size=chunk_size):
+            destination.write(chunk)
+
+    @app.cli.command('migrate-db')
+    @click.option('--revision', default='head', show_default=True, help='Migration to upgrade the schema to.')
+    def migrate_db_command(revision):
+        """Creates or upgrades the schema of the database"""
+        migrate_db(current_app._get_current_object(), revision)
+        click.echo('Database upgraded to {}'.format(revision))
+
+    @app.cli.command('warm-up')
+    def warm_up_command():
+        """Opens the pool connections and fills the caches, printing the time of every step"""
+        for name, milliseconds in warm_up(current_app._get_current_object()).items():
+            click.echo('{:<14} {:>10.1f} ms'.format(name, milliseconds))
+
+    @app.cli.command('build-snapshot')
+    @click.argument('path', required=False)
+    def build_snapshot_command(path):
+        """Copies the questions and categories to the SQLite snapshot file, TRIVIA_SNAPSHOT_PATH by default"""
+        app = current_app._get_current_object()
+        path = path or app.config.get('SNAPSHOT_PATH')
+
+        if not path:
+            raise click.UsageError('give the snapshot path or set TRIVIA_SNAPSHOT_PATH')
+
+        start = time.perf_counter()
+        counts = build_snapshot(app, path)
+        click.echo('Snapshot {} written in {:.1f} ms: {}'.format(
+            path, (time.perf_counter() - start) * 1000,
+            ', '.join('{} {}'.format(count, table) for table, count in counts.items())
+            ))
@@ -0,0 +1,59 @@
+"""gzip and brotli compression of the responses, negotiated with Accept-Encoding"""
+import gzip
+import os
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.environ.get('TRIVIA_COMPRESSION_MIN_BYTES', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('TRIVIA_COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('TRIVIA_COMPRESSION_BROTLI_QUALITY', 4))
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/csv', 'application/x-ndjson')
+
+
+def compress(body, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(body, quality=config['COMPRESSION_BROTLI_QUALITY'])
+    else:
+        return gzip.compress(body, compresslevel=config['COMPRESSION_GZIP_LEVEL'])
+
+def negotiate_encoding(accept_encodings):
+    """Returns 'br' or 'gzip' as accepted by the client, brotli first when installed, or None"""
+    encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+    accepted = [encoding for encoding in encodings if accept_encodings[encoding] > 0]
+    return max(accepted, key=lambda encoding: accept_encodings[encoding]) if accepted else None
+
+def init_compression(app):
+    """Compresses the responses of at least COMPRESSION_MIN_BYTES bytes, 0 disabling the compression"""
+    app.config.setdefault('COMPRESSION_MIN_BYTES', COMPRESSION_MIN_BYTES)
+    app.config.setdefault('COMPRESSION_GZIP_LEVEL', COMPRESSION_GZIP_LEVEL)
+    app.config.setdefault('COMPRESSION_BROTLI_QUALITY', COMPRESSION_BROTLI_QUALITY)
+
+    @app.after_request
+    def compress_response(response):
+        min_bytes = app.config['COMPRESSION_MIN_BYTES']
+
+        if min_bytes <= 0 or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+            return response
+
+        if 'Content-Encoding' in response.headers or response.content_length is None or response.content_length < min_bytes:
+            return response
+
+        encoding = negotiate_encoding(request.accept_encodings)
+
+        if encoding is None:
+            return response
+
+        response.set_data(compress(response.get_data(), encoding, app.config))
+        response.headers['Content-Encoding'] = encoding
+
+        return response
@@ -0,0 +1,105 @@
+"""Per-process view of the data_versions row, which the database bumps on every write"""
+import os
+import threading
+import time
+from flask import current_app, g
+from sqlalchemy import select
+from models import (
+    data_versions,
+    db,
+    get_read_bind,
+    notify_remote_questions_changed,
+    on_categories_changed,
+    on_questions_changed,
+    primary_reads,
+    )
+
+DATA_VERSION_TTL = float(os.environ.get('TRIVIA_DATA_VERSION_TTL', 1))
+
+DATA_VERSION = 'trivia_data_version'
+
+
+class DataVersion:
+    """Last (version, changed_at) read from every bind, kept for ttl seconds.
+
+    The writes of the process expire it, so they show at once, and the
+    writes of other processes show within ttl seconds, while a busy worker
+    reads the row at most once per bind and ttl.
+    """
+
+    def __init__(self, ttl=DATA_VERSION_TTL):
+        self.ttl = ttl
+        self.reads = 0
+        self.seen_version = None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, bind=None):
+        entry = self._entries.get(bind)
+
+        if entry is not None and time.monotonic() < entry[2]:
+            return entry[0], entry[1]
+
+        version, changed_at = db.session.execute(
+            select([data_versions.c.version, data_versions.c.changed_at]).where(data_versions.c.id == 1)
+            ).first() or (0, 0.0)
+
+        with self._lock:
+            self._entries[bind] = (version, changed_at, time.monotonic() + self.ttl)
+            self.reads += 1
+
+        return version, changed_at
+
+    def expire(self):
+        with self._lock:
+            self._entries = {}
+
+    def stats(self):
+        return {
+            'reads': self.reads,
+            'ttl': self.ttl,
+            }
+
+
+def init_data_version(app):
+    """Creates the data version of the app, expired by the writes of the app.
+
+    Every request compares the version of the primary with the last one the
+    worker saw. When it moved, whoever wrote, the on_remote_questions_changed
+    listeners drop what the worker derived from the questions, such as the
+    category decks and the in-memory indexes, which are rebuilt on their
+    next use.
+    """
+    app.config.setdefault('DATA_VERSION_TTL', DATA_VERSION_TTL)
+
+    version = DataVersion(app.config['DATA_VERSION_TTL'])
+    app.extensions[DATA_VERSION] = version
+    on_questions_changed(app, lambda action, rows: version.expire())
+    on_categories_changed(app, version.expire)
+
+    @app.before_request
+    def follow_data_version():
+        try:
+            with primary_reads():
+                current = version.get()[0]
+        except Exception as e:
+            print(f"🧨 data version error: {e}")
+            return
+
+        if version.seen_version is not None and current != version.seen_version:
+            notify_remote_questions_changed(app)
+
+        version.seen_version = current
+
+def current_data_version():
+    """Returns (version, changed_at) of the data the current request reads.
+
+    The row is read where the request reads, the replica or the snapshot
+    included, so it follows the data actually served. It is kept for the
+    rest of the request, so the validators and the response cache key of a
+    request always name the same version.
+    """
+    if 'trivia_data_version' not in g:
+        g.trivia_data_version = current_app.extensions[DATA_VERSION].get(get_read_bind())
+
+    return g.trivia_data_version
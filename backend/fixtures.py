@@ -0,0 +1,178 @@
+"""Test databases: one per test process, every test rolled back.
+
+Each process of a parallel run (pytest -n auto) gets its own database. With
+TRIVIA_TEST_DB_PATH set, a SQLite file is copied and a PostgreSQL database
+is cloned from it as a template; without it a SQLite file is seeded from
+trivia.psql. TransactionalTestCase then runs every test in a transaction
+which is rolled back, the commits of the app only releasing savepoints.
+"""
+import atexit
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from flask import _app_ctx_stack
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+from models import RoutingSession, db, migrate_db
+
+TRIVIA_PSQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trivia.psql')
+
+COPY_PATTERN = re.compile(r'^COPY public\.(\w+) \(([^)]*)\) FROM stdin;\n(.*?)^\\\.$', re.MULTILINE | re.DOTALL)
+COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '\\': '\\'}
+
+_database_uri = None
+_engines = {}
+
+
+def read_psql(path=TRIVIA_PSQL):
+    """Yields (table, rows) for every COPY block of a pg_dump file, rows being dicts"""
+    with open(path, encoding='utf-8') as psql_file:
+        dump = psql_file.read()
+
+    for table, columns, body in COPY_PATTERN.findall(dump):
+        columns = [column.strip() for column in columns.split(',')]
+        rows = [dict(zip(columns, map(copy_value, line.split('\t')))) for line in body.splitlines()]
+        yield table, rows
+
+def copy_value(value):
+    if value == '\\N':
+        return None
+    return re.sub(r'\\(.)', lambda match: COPY_ESCAPES.get(match.group(1), match.group(1)), value)
+
+def load_psql(connection, path=TRIVIA_PSQL):
+    """Inserts the rows of a pg_dump file into the migrated tables of connection"""
+    for table, rows in read_psql(path):
+        if rows:
+            connection.execute(db.Model.metadata.tables[table].insert(), rows)
+
+def migrate(database_uri):
+    # Imported here since flaskr is what the tests exercise.
+    from flaskr import create_app
+
+    migrate_db(create_app({'SQLALCHEMY_DATABASE_URI': database_uri}))
+    db.session.remove()
+
+def create_sqlite_database(worker):
+    """Creates a SQLite file of the trivia.psql rows, removed when the process exits"""
+    path = os.path.join(tempfile.gettempdir(), 'trivia_test_{}_{}.db'.format(worker or 'main', os.getpid()))
+    database_uri = 'sqlite:///' + path
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    atexit.register(lambda: os.path.exists(path) and os.remove(path))
+
+    migrate(database_uri)
+
+    engine = create_engine(database_uri)
+    with engine.begin() as connection:
+        load_psql(connection)
+    engine.dispose()
+
+    return database_uri
+
+def clone_database(database_uri, worker):
+    """Copies the database of database_uri for a worker and returns the URI of the copy"""
+    url = make_url(database_uri)
+    clone = make_url(database_uri)
+
+    if url.get_backend_name() == 'sqlite':
+        root, extension = os.path.splitext(url.database)
+        clone.database = '{}_{}{}'.format(root, worker, extension)
+        shutil.copyfile(url.database, clone.database)
+        atexit.register(lambda: os.path.exists(clone.database) and os.remove(clone.database))
+    elif url.get_backend_name() == 'postgresql':
+        clone.database = '{}_{}'.format(url.database, worker)
+        server = make_url(database_uri)
+        server.database = 'postgres'
+        engine = create_engine(server, isolation_level='AUTOCOMMIT')
+        with engine.connect() as connection:
+            connection.execute('DROP DATABASE IF EXISTS "{}"'.format(clone.database))
+            connection.execute('CREATE DATABASE "{}" TEMPLATE "{}"'.format(clone.database, url.database))
+        engine.dispose()
+    else:
+        raise RuntimeError('cannot copy a {} test database'.format(url.get_backend_name()))
+
+    return str(clone)
+
+def get_test_database_uri():
+    """Returns the migrated database of this test process, created on first call"""
+    global _database_uri
+
+    if _database_uri is None:
+        database_uri = os.environ.get('TRIVIA_TEST_DB_PATH')
+        worker = os.environ.get('PYTEST_XDIST_WORKER')
+
+        if not database_uri:
+            database_uri = create_sqlite_database(worker)
+        else:
+            if worker:
+                database_uri = clone_database(database_uri, worker)
+            migrate(database_uri)
+
+        _database_uri = database_uri
+
+    return _database_uri
+
+def transaction_engine(database_uri):
+    """Returns the engine of the test transactions, with working savepoints on SQLite"""
+    engine = _engines.get(database_uri)
+
+    if engine is None:
+        engine = _engines[database_uri] = create_engine(database_uri)
+
+        # pysqlite starts its transactions itself and ignores savepoints,
+        # so the transactions are started by SQLAlchemy instead.
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', lambda dbapi_connection, record: setattr(dbapi_connection, 'isolation_level', None))
+            event.listen(engine, 'begin', lambda connection: connection.execute('BEGIN'))
+
+    return engine
+
+
+class SavepointSession(RoutingSession):
+    """Session of the tests: everything it does sits in a savepoint of the test transaction"""
+
+    def __init__(self, *args, **kwargs):
+        RoutingSession.__init__(self, *args, **kwargs)
+        self.begin_nested()
+
+
+@event.listens_for(SavepointSession, 'after_transaction_end')
+def restart_savepoint(session, transaction):
+    """Starts a new savepoint once the app committed or rolled back the previous one"""
+    if transaction.nested and not transaction._parent.nested:
+        session.expire_all()
+        session.begin_nested()
+
+
+class TransactionalTestCase(unittest.TestCase):
+    """Test case whose database writes are rolled back after every test.
+
+    The scoped session of db is replaced for the duration of the test by
+    one bound to a connection in a transaction, so every app created by
+    the test shares it. Apps reading from other engines, such as the ASGI
+    app, only see what was there before the test.
+    """
+
+    database_path = None
+
+    def setUp(self):
+        if self.database_path is None:
+            self.database_path = get_test_database_uri()
+
+        self.connection = transaction_engine(self.database_path).connect()
+        self.transaction = self.connection.begin()
+        self.session = db.session
+
+        session_factory = sessionmaker(class_=SavepointSession, db=db, bind=self.connection, binds={})
+        db.session = scoped_session(session_factory, scopefunc=_app_ctx_stack.__ident_func__)
+
+    def tearDown(self):
+        db.session.remove()
+        db.session = self.session
+        self.transaction.rollback()
+        self.connection.close()
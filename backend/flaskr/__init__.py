@@ -1,21 +1,56 @@
 """Flask app for the trivia game"""
-import random
-import json
 from flask import (
     Flask,
     request,
     abort,
     jsonify,
+    stream_with_context,
     )
 from flask_cors import CORS
+from sqlalchemy.exc import IntegrityError
 from models import (
     Question,
-    QuestionDecoder,
+    REPLICA_BIND,
     db,
+    delete_questions_by_id,
+    get_category_cache,
+    pool_stats,
+    read_only,
     setup_db,
+    validate_question,
     )
 
 from request_utils import *
+from category_decks import get_category_decks, init_category_decks
+from commands import init_commands
+from compression import init_compression
+from data_version import DATA_VERSION, init_data_version
+from http_cache import conditional_get, init_http_cache
+from instrumentation import init_instrumentation, render_metrics
+from response_cache import RESPONSE_CACHE, cached_response, init_response_cache
+from question_export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, EXPORT_MIMETYPES, export_query, export_questions
+from question_import import (
+    CONTENT_TYPE_FORMATS,
+    IMPORT_BATCH_SIZE,
+    IMPORT_FORMATS,
+    import_questions,
+    read_records,
+    )
+from rate_limit import init_rate_limit, set_retry_after
+from snapshot import SNAPSHOT, init_snapshot
+from quiz_sessions import end_quiz_session, init_quiz_sessions, next_session_question, start_quiz_session
+from search import (
+    AUTOCOMPLETE_LIMIT,
+    MAX_AUTOCOMPLETE_LIMIT,
+    autocomplete_questions,
+    init_search,
+    search_questions_query,
+    search_results,
+    )
+from warm_up import init_warm_up
+
+
+MUTABLE_QUESTION_FIELDS = {'id', 'question', 'answer', 'category', 'difficulty'}
 
 
 def create_app(test_config=None):
@@ -25,8 +60,25 @@ def create_app(test_config=None):
     if test_config is None:
         setup_db(app)
     else:
-        database_path = str(test_config.get('SQLALCHEMY_DATABASE_URI'))
-        setup_db(app, database_path=database_path)
+        app.config.from_mapping(test_config)
+        database_path = test_config.get('SQLALCHEMY_DATABASE_URI')
+        setup_db(app, database_path=str(database_path) if database_path else None)
+
+    app.config.setdefault('IMPORT_BATCH_SIZE', IMPORT_BATCH_SIZE)
+    app.config.setdefault('EXPORT_CHUNK_SIZE', EXPORT_CHUNK_SIZE)
+
+    init_instrumentation(app)
+    init_compression(app)
+    init_rate_limit(app)
+    init_snapshot(app)
+    init_search(app)
+    init_category_decks(app)
+    init_data_version(app)
+    init_http_cache(app)
+    init_response_cache(app)
+    init_quiz_sessions(app)
+    init_commands(app)
+    init_warm_up(app)
 
     # Set up CORS. Allow '*' for origins.
     # Delete the sample route after completing the TODOs
@@ -42,6 +94,7 @@ def create_app(test_config=None):
     # Create an endpoint to handle GET requests
     # for all available categories.
     @app.route('/categories')
+    @conditional_get
     def get_categories():
         categories = get_categories_or_none()
         if categories is None:
@@ -62,9 +115,11 @@ def create_app(test_config=None):
     #ten questions per page and pagination at the bottom of the screen for three pages.
     #Clicking on the page numbers should update the questions.
     @app.route('/questions')
+    @conditional_get
+    @cached_response
     def get_questions():
         query=Question.query.order_by(Question.id)
-        questions = paginate_questions_or_none(request, query)
+        questions = paginate_questions_or_none(request, query, decks=get_category_decks())
 
         if questions is None:
             abort(404)
@@ -81,22 +136,90 @@ def create_app(test_config=None):
     def delete_question_by_id(id: int):
         error = None
         try:
-            question = Question.query.filter(Question.id == id).one_or_none()
-            if question is None:
+            if len(delete_questions_by_id([id])) == 0:
                 error = 404
             else:
-                question.delete()
+                db.session.commit()
         except Exception as e:
             print(f"🧨 delete question {id} error: {e}")
             error = 500
             db.session.rollback()
         finally:
-            db.session.close()
             if isinstance(error, int):
                 abort(error)
             else:
                 return jsonify({"success": True})
 
+    # Create a PATCH endpoint to delete and update many questions at once.
+    # The deletes run as one DELETE statement and everything is committed
+    # in a single transaction, the affected ids are returned.
+    @app.route('/questions', methods=['PATCH'])
+    def mutate_questions():
+        if not request.is_json:
+            abort(400)
+
+        body = request.get_json()
+
+        if not isinstance(body, dict):
+            abort(400)
+
+        delete_ids = body.get('delete', [])
+        updates = body.get('update', [])
+
+        if not isinstance(delete_ids, list) or not isinstance(updates, list):
+            abort(422)
+
+        if not all(is_question_id(id) for id in delete_ids):
+            abort(422)
+
+        if not all(isinstance(changes, dict) and is_question_id(changes.get('id')) for changes in updates):
+            abort(422)
+
+        if any(set(changes) - MUTABLE_QUESTION_FIELDS for changes in updates):
+            abort(422)
+
+        error = None
+        deleted = []
+        updated = []
+        try:
+            deleted = delete_questions_by_id(delete_ids)
+
+            update_ids = [changes['id'] for changes in updates]
+            questions = { question.id: question for question in Question.query.filter(Question.id.in_(update_ids)) } if update_ids else {}
+            _, category_ids = get_category_cache().get()
+
+            for changes in updates:
+                question = questions.get(changes['id'])
+                if question is not None:
+                    fields = dict(question.format(), **changes)
+                    del fields['id']
+                    fields = validate_question(fields)
+                    # SQLite does not enforce the foreign key, so the category is checked here.
+                    if fields['category'] not in category_ids:
+                        raise ValueError('category {} does not exist'.format(fields['category']))
+                    question.update(fields, commit=False)
+                    updated.append(question.id)
+
+            db.session.commit()
+        except (ValueError, IntegrityError) as e:
+            # An IntegrityError is a category deleted since it was checked.
+            print(f"🧨 mutate questions error: {e}")
+            error = 422
+            db.session.rollback()
+        except Exception as e:
+            print(f"🧨 mutate questions error: {e}")
+            error = 500
+            db.session.rollback()
+        finally:
+            if isinstance(error, int):
+                abort(error)
+            else:
+                return jsonify({
+                    "deleted": deleted,
+                    "updated": updated,
+                    "success": True
+                    })
+
     # Create an endpoint to POST a new question,
     # which will require the question and answer text,
     # category, and difficulty score.
@@ -107,49 +230,122 @@ def create_app(test_config=None):
 
 
     # Create a POST endpoint to get questions based on a search term.
-    # It should return any questions for whom the search term
-    # is a substring of the question.
+    # It should return any questions containing words which start with
+    # every word of the search term, best matches first.
 
     # TEST: Search by any phrase. The questions list will update to include
-    # only question that include that string within their question.
+    # only question that include words starting with that phrase.
     # Try using the word "title" to start.
     @app.route('/questions', methods=['POST'])
+    @cached_response
     def add_or_search_questions():
         if (request.is_json):
             body = request.get_json()
             search = body.get('searchTerm')
 
             if isinstance(search, str):
-                query = Question.query.filter(Question.question.ilike('%{}%'.format(search))).order_by(Question.id)
-                questions = paginate_questions_or_none(request, query)
+                include_answers = body.get('searchAnswers') is True
+                results = search_results(search, include_answers)
+
+                if results is not None:
+                    questions = paginate_questions_or_none(request, Question.query.order_by(Question.id), decks=results)
+                else:
+                    query = search_questions_query(search, include_answers, ranked=not is_cursor_request(request))
+                    questions = paginate_questions_or_none(request, query)
                 if questions is None:
                     abort(404)
                 else:
                     return questions
             else:
                 try:
-                    question : Question = json.loads(json.dumps(body), cls=QuestionDecoder)
+                    question = Question(**validate_question(body))
                     question.insert()
                     return jsonify({"success": True})
                 except Exception as e:
                     print(f"🧨 add_or_search_questions error: {e}")
                     db.session.rollback()
                     abort(422)
-                finally:
-                    db.session.close()
         else:
             abort(400)
 
 
+    # Create a GET endpoint to suggest questions while the search term is typed.
+    # The last word is completed as a prefix from the in-memory index and
+    # the ids are returned with a snippet of the matched text.
+    @app.route('/questions/autocomplete')
+    def autocomplete():
+        term = request.args.get('q', '')
+        limit = request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int)
+        include_answers = request.args.get('answers', 'false').lower() == 'true'
+
+        if not 1 <= limit <= MAX_AUTOCOMPLETE_LIMIT:
+            abort(400)
+
+        return jsonify({
+            "suggestions": autocomplete_questions(term, limit, include_answers),
+            "success": True
+            })
+
+    # Create a GET endpoint to export the questions as NDJSON or CSV.
+    # The rows are streamed in chunks, optionally of one category and
+    # after the last id of a previous export.
+    @app.route('/questions/export')
+    def export_questions_in_bulk():
+        format = request.args.get('format', 'ndjson')
+        category_id = request.args.get('category', 0, type=int)
+        after_id = request.args.get('after_id', 0, type=int)
+        chunk_size = request.args.get('chunk_size', app.config['EXPORT_CHUNK_SIZE'], type=int)
+        fields = get_response_fields(request)
+
+        if format not in EXPORT_FORMATS or chunk_size < 1 or after_id < 0:
+            abort(400)
+
+        if category_id and get_categories_or_none(category_id) is None:
+            abort(400)
+
+        query = export_query(category_id, after_id, fields)
+        body = export_questions(query, format, fields, chunk_size, app.config['JSON_AS_ASCII'])
+
+        return app.response_class(stream_with_context(body), mimetype=EXPORT_MIMETYPES[format], headers={
+            'Content-Disposition': 'attachment; filename=questions.{}'.format(format)
+            })
+
+    # Create a POST endpoint to import questions in bulk.
+    # The body is streamed as NDJSON or CSV and the questions are
+    # validated like the single POST and inserted in batches.
+    @app.route('/questions/import', methods=['POST'])
+    def import_questions_in_bulk():
+        format = request.args.get('format') or CONTENT_TYPE_FORMATS.get(request.mimetype)
+
+        if format not in IMPORT_FORMATS:
+            abort(400)
+
+        batch_size = request.args.get('batch_size', app.config['IMPORT_BATCH_SIZE'], type=int)
+
+        if batch_size < 1:
+            abort(400)
+
+        report = import_questions(read_records(request.stream, format), batch_size)
+
+        return jsonify({
+            'success': True,
+            'imported': report['imported'],
+            'failed': report['failed'],
+            'errors': report['errors']
+            })
+
+
     # Create a GET endpoint to get questions based on category.
 
     # TEST: In the "List" tab / main screen, clicking on one of the
     # categories in the left column will cause only questions of that
     # category to be shown.
     @app.route('/categories/<int:id>/questions')
+    @conditional_get
+    @cached_response
     def get_questions_by_category(id: int):
         query = Question.query.filter(Question.category == id).order_by(Question.id)
-        questions = paginate_questions_or_none(request, category_id=id, query=query)
+        questions = paginate_questions_or_none(request, category_id=id, query=query, decks=get_category_decks())
     
         if questions is None:
             abort(404)
@@ -165,10 +361,16 @@ def create_app(test_config=None):
     # one question at a time is displayed, the user is allowed to answer
     # and shown whether they were correct or not.
     @app.route('/quizzes', methods=['POST'])
+    @read_only
     def random_question():
         if (request.is_json):
             body = request.get_json()
 
+            session_id = body.get('session_id')
+
+            if session_id is not None:
+                return next_quiz_session_question(session_id)
+
             previous_questions = body.get('previous_questions')
 
             if previous_questions is None:
@@ -184,24 +386,13 @@ def create_app(test_config=None):
             if category_id is None:
                 abort(422)
 
-            query = None
-            if int(category_id) > 0:
-                query = db.session.query(Question).filter(
-                    Question.id.notin_(previous_questions)
-                    ).filter(
-                        Question.category == category_id
-                        ).order_by(Question.id)
-                db.session.close()
-            else:
-                query = Question.query.order_by(Question.id)
-
-            questions = query.all()
+            if body.get('count') is not None:
+                return random_quiz_round(body, category_id)
 
-            question = None
-
-            if len(questions) > 0:
-                question = random.choice(questions).format()
+            question = random_question_or_none(previous_questions, category_id, get_category_decks())
 
+            if question is not None:
+                question = question.format()
 
             return jsonify({
                 "previousQuestions": body['previous_questions'],
@@ -211,6 +402,110 @@ def create_app(test_config=None):
         else:
             abort(400)
 
+    def random_quiz_round(body, category_id):
+        try:
+            count = parse_question_count(body['count'])
+        except ValueError:
+            abort(422)
+
+        questions = [question.format() for question in random_questions(body['previous_questions'], count, category_id, get_category_decks())]
+
+        return jsonify({
+            "previousQuestions": body['previous_questions'],
+            "question": questions[0] if questions else None,
+            "questions": questions,
+            "success": True
+            })
+
+    def next_quiz_session_question(session_id):
+        if not isinstance(session_id, str):
+            abort(422)
+
+        result = next_session_question(session_id)
+
+        if result is None:
+            abort(404)
+
+        question, remaining = result
+
+        return jsonify({
+            "question": question.format() if question is not None else None,
+            "remaining": remaining,
+            "session_id": session_id,
+            "success": True
+            })
+
+    # Create a POST endpoint to start a quiz session. The server keeps a
+    # shuffled deck of question ids, so the following POST '/quizzes' only
+    # send the session id instead of every previous question.
+    @app.route('/quizzes/sessions', methods=['POST'])
+    @read_only
+    def start_quiz():
+        if not request.is_json:
+            abort(400)
+
+        body = request.get_json()
+        category = body.get('quiz_category')
+        previous_questions = body.get('previous_questions', [])
+
+        if not isinstance(category, dict) or not isinstance(previous_questions, list):
+            abort(422)
+
+        try:
+            category_id = int(category.get('id'))
+        except (TypeError, ValueError):
+            abort(422)
+
+        if get_categories_or_none(category_id) is None:
+            abort(400)
+
+        session_id, total_questions = start_quiz_session(category_id, previous_questions)
+
+        return jsonify({
+            "session_id": session_id,
+            "total_questions": total_questions,
+            "success": True
+            })
+
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def end_quiz(session_id):
+        if not end_quiz_session(session_id):
+            abort(404)
+
+        return jsonify({"success": True})
+
+    # Create a GET endpoint exposing the hit ratio and memory use of the caches.
+    @app.route('/cache/stats')
+    def get_cache_stats():
+        response_cache = app.extensions.get(RESPONSE_CACHE)
+        return jsonify({
+            'categories': get_category_cache().stats(),
+            'data_version': app.extensions[DATA_VERSION].stats(),
+            'decks': get_category_decks().stats(),
+            'responses': response_cache.stats() if response_cache is not None else None,
+            'success': True
+            })
+
+    # Create a GET endpoint exposing the connection pool statistics,
+    # to size the workers against the database max_connections,
+    # and the age of the local snapshot.
+    @app.route('/db/stats')
+    def get_db_stats():
+        has_replica = REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {})
+        snapshot = app.extensions[SNAPSHOT]
+        return jsonify({
+            'primary': pool_stats(app),
+            'replica': pool_stats(app, bind=REPLICA_BIND) if has_replica else None,
+            'snapshot': snapshot.stats() if snapshot is not None else None,
+            'success': True
+            })
+
+    # Create a GET endpoint exposing the request, query and cache metrics
+    # in the Prometheus text format.
+    @app.route('/metrics')
+    def get_metrics():
+        return app.response_class(render_metrics(app), mimetype='text/plain; version=0.0.4')
+
     # Create error handlers for all expected errors
     # including 404 and 422.
     @app.errorhandler(400)
@@ -237,6 +532,14 @@ def create_app(test_config=None):
             "message": "Unprocessable Content",
             }), 422
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        return set_retry_after(jsonify({
+            "success": False, 
+            "error": 429,
+            "message": "Too many requests",
+            })), 429
+
     @app.errorhandler(500)
     def internal_error(error):
         return jsonify({
@@ -245,4 +548,12 @@ def create_app(test_config=None):
             "message": "Internal Server Error",
             }), 500
 
+    @app.errorhandler(503)
+    def unavailable(error):
+        return set_retry_after(jsonify({
+            "success": False, 
+            "error": 503,
+            "message": "Service unavailable",
+            })), 503
+
     return app
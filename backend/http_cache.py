@@ -0,0 +1,67 @@
+"""HTTP cache validation for the read endpoints"""
+import hashlib
+import math
+import os
+from datetime import datetime, timezone
+from functools import wraps
+from flask import current_app, request
+from data_version import current_data_version
+
+HTTP_CACHE_MAX_AGE = int(os.environ.get('TRIVIA_HTTP_CACHE_MAX_AGE', 0))
+
+
+def init_http_cache(app):
+    """Configures the validators of the app"""
+    app.config.setdefault('HTTP_CACHE_MAX_AGE', HTTP_CACHE_MAX_AGE)
+
+def current_validators():
+    """Returns the ETag and the Last-Modified time of the current request.
+
+    Both are derived from the data version, which the database bumps on
+    every write of a question or a category, and the query string, so every
+    worker of every host gives the same validators for the same data.
+    """
+    version, changed_at = current_data_version()
+
+    key = '{}:{}'.format(version, request.full_path)
+    etag = hashlib.sha1(key.encode()).hexdigest()[:20]
+
+    return etag, datetime.fromtimestamp(math.floor(changed_at), timezone.utc)
+
+def is_not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    if request.if_modified_since is not None:
+        if_modified_since = request.if_modified_since
+        if if_modified_since.tzinfo is None:
+            if_modified_since = if_modified_since.replace(tzinfo=timezone.utc)
+        return last_modified <= if_modified_since
+
+    return False
+
+def set_cache_headers(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['HTTP_CACHE_MAX_AGE']
+    return response
+
+def conditional_get(view):
+    """Answers 304 Not Modified before running the view when the client copy is current"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag, last_modified = current_validators()
+
+        if is_not_modified(etag, last_modified):
+            return set_cache_headers(current_app.response_class(status=304), etag, last_modified)
+
+        response = current_app.make_response(view(*args, **kwargs))
+
+        if response.status_code == 200:
+            set_cache_headers(response, etag, last_modified)
+
+        return response
+
+    return wrapper
@@ -0,0 +1,305 @@
+"""Per-request timings, Prometheus metrics and a sampling profiler for slow requests"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from models import REPLICA_BIND, get_category_cache, pool_stats
+from rate_limit import RATE_LIMITER
+from response_cache import RESPONSE_CACHE
+
+SERVER_TIMING = os.environ.get('TRIVIA_SERVER_TIMING', 'true').lower() == 'true'
+SLOW_REQUEST_MS = float(os.environ.get('TRIVIA_SLOW_REQUEST_MS', 0))
+PROFILE_SLOW_REQUESTS = os.environ.get('TRIVIA_PROFILE_SLOW_REQUESTS', 'false').lower() == 'true'
+PROFILE_INTERVAL_MS = float(os.environ.get('TRIVIA_PROFILE_INTERVAL_MS', 5))
+
+INSTRUMENTATION = 'trivia_instrumentation'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROFILE_STACKS_REPORTED = 10
+
+
+class RequestTimings:
+    """Queries and phases of the current request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.phases = {}
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def server_timing(self, total):
+        """Returns the value of the Server-Timing header, durations in milliseconds"""
+        metrics = ['db;dur={:.3f};desc="{} queries"'.format(self.query_seconds * 1000, self.query_count)]
+        metrics.extend('{};dur={:.3f}'.format(name, seconds * 1000) for name, seconds in self.phases.items())
+        metrics.append('total;dur={:.3f}'.format(total * 1000))
+        return ', '.join(metrics)
+
+
+def current_timings():
+    return g.get('trivia_timings') if has_app_context() else None
+
+@contextmanager
+def timed_phase(name):
+    """Adds the time spent in the block to the named phase of the current request"""
+    timings = current_timings()
+
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add_phase(name, time.perf_counter() - start)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.trivia_query_start = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    timings = current_timings()
+    start = getattr(context, 'trivia_query_start', None)
+
+    if timings is not None and start is not None:
+        timings.query_count += 1
+        timings.query_seconds += time.perf_counter() - start
+
+
+class Metrics:
+    """Request counters and histograms rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.requests = Counter()
+        self.durations = {}
+        self.queries = Counter()
+        self.query_seconds = Counter()
+        self.phase_seconds = Counter()
+        self._lock = threading.Lock()
+
+    def observe(self, method, endpoint, status, timings, duration):
+        with self._lock:
+            self.requests[(method, endpoint, str(status))] += 1
+            self.queries[endpoint] += timings.query_count
+            self.query_seconds[endpoint] += timings.query_seconds
+
+            for name, seconds in timings.phases.items():
+                self.phase_seconds[(endpoint, name)] += seconds
+
+            histogram = self.durations.get(endpoint)
+            if histogram is None:
+                histogram = self.durations[endpoint] = {'buckets': [0] * len(DURATION_BUCKETS), 'sum': 0.0, 'count': 0}
+
+            for position, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    histogram['buckets'][position] += 1
+            histogram['sum'] += duration
+            histogram['count'] += 1
+
+    def render(self, gauges=()):
+        """Returns the metrics, followed by the (name, help, type, labels, value) gauges"""
+        lines = []
+
+        def family(name, help, type):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, type))
+
+        with self._lock:
+            family('trivia_requests_total', 'Requests by method, endpoint and status.', 'counter')
+            for (method, endpoint, status), count in sorted(self.requests.items()):
+                lines.append(sample('trivia_requests_total', {'method': method, 'endpoint': endpoint, 'status': status}, count))
+
+            family('trivia_request_duration_seconds', 'Request duration by endpoint.', 'histogram')
+            for endpoint, histogram in sorted(self.durations.items()):
+                for bound, count in zip(DURATION_BUCKETS, histogram['buckets']):
+                    lines.append(sample('trivia_request_duration_seconds_bucket', {'endpoint': endpoint, 'le': str(bound)}, count))
+                lines.append(sample('trivia_request_duration_seconds_bucket', {'endpoint': endpoint, 'le': '+Inf'}, histogram['count']))
+                lines.append(sample('trivia_request_duration_seconds_sum', {'endpoint': endpoint}, histogram['sum']))
+                lines.append(sample('trivia_request_duration_seconds_count', {'endpoint': endpoint}, histogram['count']))
+
+            family('trivia_db_queries_total', 'Database queries by endpoint.', 'counter')
+            for endpoint, count in sorted(self.queries.items()):
+                lines.append(sample('trivia_db_queries_total', {'endpoint': endpoint}, count))
+
+            family('trivia_db_query_seconds_total', 'Time spent in database queries by endpoint.', 'counter')
+            for endpoint, seconds in sorted(self.query_seconds.items()):
+                lines.append(sample('trivia_db_query_seconds_total', {'endpoint': endpoint}, seconds))
+
+            family('trivia_phase_seconds_total', 'Time spent in the instrumented phases by endpoint.', 'counter')
+            for (endpoint, name), seconds in sorted(self.phase_seconds.items()):
+                lines.append(sample('trivia_phase_seconds_total', {'endpoint': endpoint, 'phase': name}, seconds))
+
+        described = set()
+        for name, help, type, labels, value in sorted(gauges, key=lambda gauge: gauge[0]):
+            if name not in described:
+                family(name, help, type)
+                described.add(name)
+            lines.append(sample(name, labels, value))
+
+        return '\n'.join(lines) + '\n'
+
+
+def sample(name, labels, value):
+    if labels:
+        rendered = ','.join('{}="{}"'.format(key, escape_label(str(labels[key]))) for key in sorted(labels))
+        name = '{}{{{}}}'.format(name, rendered)
+    return '{} {}'.format(name, float(value) if isinstance(value, float) else value)
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class SamplingProfiler:
+    """Samples the stacks of the threads serving requests every interval.
+
+    A single daemon thread reads sys._current_frames() while at least one
+    request is being profiled, so the cost is one stack walk per request per
+    interval and nothing when the app is idle.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            self._samples[threading.get_ident()] = Counter()
+            self._active.set()
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trivia-profiler', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Returns the collapsed stacks sampled for the current thread"""
+        with self._lock:
+            samples = self._samples.pop(threading.get_ident(), Counter())
+            if not self._samples:
+                self._active.clear()
+        return samples
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+
+            with self._lock:
+                for ident, samples in self._samples.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[collapse_stack(frame)] += 1
+
+
+def collapse_stack(frame):
+    """Formats a stack root first, as expected by flame graph tools"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}:{}'.format(os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def init_instrumentation(app):
+    """Times the queries and phases of every request and records them as metrics"""
+    app.config.setdefault('SERVER_TIMING', SERVER_TIMING)
+    app.config.setdefault('SLOW_REQUEST_MS', SLOW_REQUEST_MS)
+    app.config.setdefault('PROFILE_SLOW_REQUESTS', PROFILE_SLOW_REQUESTS)
+    app.config.setdefault('PROFILE_INTERVAL_MS', PROFILE_INTERVAL_MS)
+
+    metrics = Metrics()
+    app.extensions[INSTRUMENTATION] = metrics
+
+    profiler = None
+    if app.config['PROFILE_SLOW_REQUESTS'] and app.config['SLOW_REQUEST_MS'] > 0:
+        profiler = SamplingProfiler(app.config['PROFILE_INTERVAL_MS'] / 1000)
+
+    @app.before_request
+    def start_request_timings():
+        g.trivia_timings = RequestTimings()
+        if profiler is not None:
+            profiler.start()
+
+    @app.after_request
+    def record_request_timings(response):
+        timings = current_timings()
+        if timings is None:
+            return response
+
+        duration = time.perf_counter() - timings.start
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe(request.method, endpoint, response.status_code, timings, duration)
+
+        if app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = timings.server_timing(duration)
+
+        return response
+
+    @app.teardown_request
+    def report_slow_request(exception=None):
+        timings = current_timings()
+        if timings is None:
+            return
+
+        samples = profiler.stop() if profiler is not None else None
+        duration = time.perf_counter() - timings.start
+        threshold = app.config['SLOW_REQUEST_MS']
+
+        if threshold > 0 and duration * 1000 >= threshold:
+            print(f"🐢 slow request {request.method} {request.full_path} {duration * 1000:.1f}ms: {timings.server_timing(duration)}")
+            if samples:
+                for stack, count in samples.most_common(PROFILE_STACKS_REPORTED):
+                    print(f"🐢 {stack} {count}")
+
+def collect_gauges(app):
+    """Returns the cache and pool statistics as (name, help, type, labels, value) gauges"""
+    gauges = []
+
+    category_stats = get_category_cache(app).stats()
+    gauges.append(('trivia_cache_hits_total', 'Cache hits.', 'counter', {'cache': 'categories'}, category_stats['hits']))
+    gauges.append(('trivia_cache_misses_total', 'Cache misses.', 'counter', {'cache': 'categories'}, category_stats['misses']))
+
+    response_cache = app.extensions.get(RESPONSE_CACHE)
+    if response_cache is not None:
+        response_stats = response_cache.stats()
+        gauges.append(('trivia_cache_hits_total', 'Cache hits.', 'counter', {'cache': 'responses'}, response_stats['hits']))
+        gauges.append(('trivia_cache_misses_total', 'Cache misses.', 'counter', {'cache': 'responses'}, response_stats['misses']))
+        gauges.append(('trivia_cache_bytes', 'Bytes used by the cache.', 'gauge', {'cache': 'responses'}, response_stats['bytes']))
+
+    rate_limiter = app.extensions.get(RATE_LIMITER)
+    if rate_limiter is not None:
+        for route, count in rate_limiter.limited.items():
+            gauges.append(('trivia_rate_limited_total', 'Requests answered 429 by the rate limiter.', 'counter', {'route': route}, count))
+        for route, count in rate_limiter.shed.items():
+            gauges.append(('trivia_requests_shed_total', 'Requests answered 503 while the pool was overloaded.', 'counter', {'route': route}, count))
+
+    binds = [('primary', None)]
+    if REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {}):
+        binds.append(('replica', REPLICA_BIND))
+
+    for name, bind in binds:
+        stats = pool_stats(app, bind=bind)
+        if 'checked_out' in stats:
+            gauges.append(('trivia_db_pool_checked_out', 'Connections in use.', 'gauge', {'bind': name}, stats['checked_out']))
+            gauges.append(('trivia_db_pool_overflow', 'Connections opened above the pool size.', 'gauge', {'bind': name}, stats['overflow']))
+            gauges.append(('trivia_db_pool_wait_seconds_total', 'Time spent waiting for a connection.', 'counter', {'bind': name}, stats['wait_seconds_total']))
+
+    return gauges
+
+def render_metrics(app):
+    return app.extensions[INSTRUMENTATION].render(collect_gauges(app))
@@ -0,0 +1,39 @@
+"""Alembic environment of the trivia database.
+
+migrate_db passes its connection in config.attributes['connection'], the
+alembic command line connects to TRIVIA_DB_PATH.
+"""
+import os
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import create_engine
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+
+def run_migrations(connection):
+    context.configure(connection=connection, render_as_batch=connection.dialect.name == 'sqlite')
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    connection = config.attributes.get('connection')
+
+    if connection is not None:
+        run_migrations(connection)
+        return
+
+    engine = create_engine(os.environ['TRIVIA_DB_PATH'])
+    with engine.connect() as connection:
+        run_migrations(connection)
+    engine.dispose()
+
+
+if context.is_offline_mode():
+    raise RuntimeError('the migrations inspect the database, they cannot generate offline SQL')
+
+run_migrations_online()
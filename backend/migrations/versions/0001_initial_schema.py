@@ -0,0 +1,42 @@
+"""Initial schema, as shipped in trivia.psql
+
+Databases restored from trivia.psql already have the tables, so they are
+only created when missing.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if 'categories' not in tables:
+        op.create_table(
+            'categories',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('type', sa.String),
+            )
+
+    if 'questions' not in tables:
+        op.create_table(
+            'questions',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('question', sa.String),
+            sa.Column('answer', sa.String),
+            sa.Column('category', sa.String),
+            sa.Column('difficulty', sa.Integer),
+            )
+
+
+def downgrade():
+    op.drop_table('questions')
+    op.drop_table('categories')
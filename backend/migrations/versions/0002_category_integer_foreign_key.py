@@ -0,0 +1,75 @@
+"""Make questions.category an indexed integer foreign key to categories
+
+The (category, id) index serves both the listing of a category ordered by id
+and the quiz lookups of the first question of a category after a random id.
+Categories that are not numeric or do not exist any more become NULL, as
+the ON DELETE SET NULL of trivia.psql would have done.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+FOREIGN_KEY = 'category'
+INDEX = 'ix_questions_category_id'
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    category = next(column for column in inspector.get_columns('questions') if column['name'] == 'category')
+    is_integer = isinstance(category['type'], sa.Integer)
+    has_foreign_key = any(
+        foreign_key['referred_table'] == 'categories' and foreign_key['constrained_columns'] == ['category']
+        for foreign_key in inspector.get_foreign_keys('questions')
+        )
+    has_index = any(index['name'] == INDEX for index in inspector.get_indexes('questions'))
+
+    if bind.dialect.name == 'sqlite':
+        # SQLite can neither change a column type nor add a constraint, the
+        # table is copied into a new one with CAST(category AS INTEGER).
+        if not is_integer or not has_foreign_key:
+            with op.batch_alter_table('questions', recreate='always') as batch:
+                batch.alter_column('category', type_=sa.Integer, existing_type=category['type'])
+                batch.create_foreign_key(
+                    FOREIGN_KEY, 'categories', ['category'], ['id'], onupdate='CASCADE', ondelete='SET NULL'
+                    )
+        clear_missing_categories()
+    else:
+        if not is_integer:
+            op.execute("UPDATE questions SET category = NULL WHERE category !~ '^[0-9]+$'")
+            op.alter_column(
+                'questions', 'category', type_=sa.Integer, existing_type=category['type'],
+                postgresql_using='category::integer',
+                )
+        if not has_foreign_key:
+            clear_missing_categories()
+            op.create_foreign_key(
+                FOREIGN_KEY, 'questions', 'categories', ['category'], ['id'], onupdate='CASCADE', ondelete='SET NULL'
+                )
+
+    if not has_index:
+        op.create_index(INDEX, 'questions', ['category', 'id'])
+
+
+def clear_missing_categories():
+    op.execute(
+        'UPDATE questions SET category = NULL '
+        'WHERE category IS NOT NULL AND category NOT IN (SELECT id FROM categories)'
+        )
+
+
+def downgrade():
+    op.drop_index(INDEX, 'questions')
+
+    with op.batch_alter_table('questions') as batch:
+        batch.drop_constraint(FOREIGN_KEY, type_='foreignkey')
+        batch.alter_column('category', type_=sa.String, existing_type=sa.Integer)
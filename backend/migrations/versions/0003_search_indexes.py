@@ -0,0 +1,37 @@
+"""Create the full-text search indexes of PostgreSQL
+
+They were created by every app start before, they are now part of the
+schema. Other databases search with the in-memory index and get nothing.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+# Replaced by the simple configuration indexes of migration 0004.
+INDEXES = {
+    'ix_questions_question_tsv': "coalesce(question, '')",
+    'ix_questions_question_answer_tsv': "coalesce(question, '') || ' ' || coalesce(answer, '')",
+    }
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for index, document in INDEXES.items():
+        op.execute("CREATE INDEX IF NOT EXISTS {} ON questions USING gin (to_tsvector('english', {}))".format(index, document))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for index in INDEXES:
+        op.execute('DROP INDEX IF EXISTS {}'.format(index))
@@ -0,0 +1,38 @@
+"""Rebuild the full-text search indexes with the simple configuration
+
+The english configuration drops stop words such as "who" or "the" from the
+documents and from the queries, so searching for them found nothing on
+PostgreSQL while the in-memory index matches them.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+# The expressions must stay the ones of search.postgres_search_clauses.
+INDEXES = {
+    'ix_questions_question_tsv': "coalesce(question, '')",
+    'ix_questions_question_answer_tsv': "coalesce(question, '') || ' ' || coalesce(answer, '')",
+    }
+
+
+def create_indexes(configuration):
+    for index, document in INDEXES.items():
+        op.execute('DROP INDEX IF EXISTS {}'.format(index))
+        op.execute("CREATE INDEX {} ON questions USING gin (to_tsvector('{}', {}))".format(index, configuration, document))
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        create_indexes('simple')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        create_indexes('english')
@@ -0,0 +1,73 @@
+"""Count the writes of the questions and categories in the database
+
+data_versions holds a single row whose version is bumped by triggers on
+every insert, update and delete of a question or a category, whoever
+writes them, so every worker derives the same HTTP validators from it.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+TABLES = ('questions', 'categories')
+EVENTS = ('insert', 'update', 'delete')
+
+POSTGRES_FUNCTION = """
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE data_versions SET version = version + 1, changed_at = extract(epoch FROM clock_timestamp()) WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+SQLITE_BUMP = "UPDATE data_versions SET version = version + 1, changed_at = (julianday('now') - 2440587.5) * 86400.0 WHERE id = 1;"
+
+
+def upgrade():
+    op.create_table(
+        'data_versions',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('version', sa.BigInteger, nullable=False),
+        sa.Column('changed_at', sa.Float, nullable=False),
+        )
+    op.execute("INSERT INTO data_versions (id, version, changed_at) VALUES (1, 0, 0)")
+
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute(POSTGRES_FUNCTION)
+
+    for table in TABLES:
+        for event in EVENTS:
+            trigger = 'bump_data_version_{}_{}'.format(table, event)
+
+            if dialect == 'postgresql':
+                op.execute('CREATE TRIGGER {} AFTER {} ON {} FOR EACH STATEMENT EXECUTE PROCEDURE bump_data_version()'.format(
+                    trigger, event.upper(), table
+                    ))
+            else:
+                op.execute('CREATE TRIGGER {} AFTER {} ON {} FOR EACH ROW BEGIN {} END'.format(
+                    trigger, event.upper(), table, SQLITE_BUMP
+                    ))
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    for table in TABLES:
+        for event in EVENTS:
+            trigger = 'bump_data_version_{}_{}'.format(table, event)
+            op.execute('DROP TRIGGER IF EXISTS {}{}'.format(trigger, ' ON {}'.format(table) if dialect == 'postgresql' else ''))
+
+    if dialect == 'postgresql':
+        op.execute('DROP FUNCTION IF EXISTS bump_data_version()')
+
+    op.drop_table('data_versions')
@@ -1,32 +1,276 @@
 """Models for the trivia app"""
+from contextlib import contextmanager
 from itertools import tee
-import json
-from sqlalchemy import Column, String, Integer
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from sqlalchemy import BigInteger, Column, Float, ForeignKey, Index, String, Integer, Table, event
+from sqlalchemy.orm import Session, object_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
 
 import os
-database_name = os.environ['TRIVIA_DB_NAME']
-database_path = os.environ['TRIVIA_DB_PATH']
 
-db = SQLAlchemy()
+CATEGORY_CACHE_TTL = float(os.environ.get('TRIVIA_CATEGORY_CACHE_TTL', 300))
 
+DB_POOL_SIZE = int(os.environ.get('TRIVIA_DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('TRIVIA_DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('TRIVIA_DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('TRIVIA_DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('TRIVIA_DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_POOL_WAIT_HALF_LIFE = float(os.environ.get('TRIVIA_DB_POOL_WAIT_HALF_LIFE', 1))
+DB_REPLICA_URI = os.environ.get('TRIVIA_DB_REPLICA_PATH')
+DB_AUTO_MIGRATE = os.environ.get('TRIVIA_DB_AUTO_MIGRATE', 'false').lower() == 'true'
 
-def setup_db(app, database_path=database_path):
-    """Binds a flask application and a SQLAlchemy service"""
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+REPLICA_BIND = 'replica'
+SNAPSHOT_BIND = 'snapshot'
+
+MIGRATIONS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+QUESTION_LISTENERS = 'trivia_question_listeners'
+REMOTE_QUESTION_LISTENERS = 'trivia_remote_question_listeners'
+PENDING_QUESTION_CHANGES = 'trivia_pending_question_changes'
+CATEGORY_CACHE = 'trivia_category_cache'
+CATEGORY_LISTENERS = 'trivia_category_listeners'
+PENDING_CATEGORY_CHANGES = 'trivia_pending_category_changes'
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long the checkouts wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.recent_wait_time = 0.0
+        self.recent_wait_at = time.perf_counter()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return QueuePool._do_get(self)
+        finally:
+            now = time.perf_counter()
+            waited = now - start
+            self.checkouts += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            # Exponentially weighted so that it reflects the last checkouts.
+            recent = self.recent_wait(start)
+            self.recent_wait_time = recent + (waited - recent) * 0.2
+            self.recent_wait_at = now
+
+    def recent_wait(self, now=None):
+        """Recent checkout wait, halved every DB_POOL_WAIT_HALF_LIFE seconds without checkouts.
+
+        Otherwise an idle pool would keep the wait of its last busy checkouts
+        and the requests shed for it would never check out to lower it.
+        """
+        now = time.perf_counter() if now is None else now
+        elapsed = max(now - self.recent_wait_at, 0.0)
+        return self.recent_wait_time * 0.5 ** (elapsed / DB_POOL_WAIT_HALF_LIFE)
+
+    def stats(self):
+        return {
+            'size': self.size(),
+            'checked_in': self.checkedin(),
+            'checked_out': self.checkedout(),
+            'overflow': self.overflow(),
+            'checkouts': self.checkouts,
+            'wait_seconds_total': self.wait_time,
+            'wait_seconds_max': self.max_wait_time,
+            'wait_seconds_recent': self.recent_wait(),
+            }
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the reads of read-only requests to the replica or the snapshot, when one is configured"""
+
+    def get_bind(self, mapper=None, clause=None):
+        read_bind = get_read_bind()
+
+        if not self._flushing and read_bind is not None:
+            return get_state(self.app).db.get_engine(self.app, bind=read_bind)
+
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class TriviaSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy service with a tunable and observable pool and read replica routing"""
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        SQLAlchemy.apply_driver_hacks(self, app, sa_url, options)
+
+        # SQLite uses its own single connection pools.
+        if sa_url.drivername.startswith('sqlite'):
+            return
+
+        options.setdefault('poolclass', TimedQueuePool)
+        options.setdefault('pool_size', app.config['DB_POOL_SIZE'])
+        options.setdefault('max_overflow', app.config['DB_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', app.config['DB_POOL_TIMEOUT'])
+        options.setdefault('pool_recycle', app.config['DB_POOL_RECYCLE'])
+        options.setdefault('pool_pre_ping', app.config['DB_POOL_PRE_PING'])
+
+
+db = TriviaSQLAlchemy()
+
+
+def get_database_path():
+    """Returns the SQLAlchemy URI of TRIVIA_DB_PATH, read when the first app is set up"""
+    try:
+        return os.environ['TRIVIA_DB_PATH']
+    except KeyError:
+        raise RuntimeError('TRIVIA_DB_PATH must be set to the SQLAlchemy URI of the database') from None
+
+def setup_db(app, database_path=None):
+    """Binds a flask application and a SQLAlchemy service.
+
+    The session is request scoped: Flask-SQLAlchemy removes it when the
+    application context is torn down, so handlers only commit or roll back.
+    No connection is opened here: the schema is upgraded by the migrate-db
+    command, or on start when DB_AUTO_MIGRATE is set.
+    """
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_path or get_database_path()
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config.setdefault("CATEGORY_CACHE_TTL", CATEGORY_CACHE_TTL)
+    app.config.setdefault("DB_POOL_SIZE", DB_POOL_SIZE)
+    app.config.setdefault("DB_MAX_OVERFLOW", DB_MAX_OVERFLOW)
+    app.config.setdefault("DB_POOL_TIMEOUT", DB_POOL_TIMEOUT)
+    app.config.setdefault("DB_POOL_RECYCLE", DB_POOL_RECYCLE)
+    app.config.setdefault("DB_POOL_PRE_PING", DB_POOL_PRE_PING)
+    app.config.setdefault("DB_REPLICA_URI", DB_REPLICA_URI)
+    app.config.setdefault("DB_AUTO_MIGRATE", DB_AUTO_MIGRATE)
+
+    if app.config["DB_REPLICA_URI"]:
+        app.config.setdefault("SQLALCHEMY_BINDS", {})[REPLICA_BIND] = app.config["DB_REPLICA_URI"]
+
     db.app = app
     db.init_app(app)
-    db.create_all()
+
+    if app.config["DB_AUTO_MIGRATE"]:
+        migrate_db(app)
+
+    # Every app caches the categories of its own database, dropped after the
+    # category writes of the app and when the data version moves.
+    category_cache = CategoryCache(app.config["CATEGORY_CACHE_TTL"])
+    app.extensions[CATEGORY_CACHE] = category_cache
+    on_categories_changed(app, category_cache.invalidate)
+    on_remote_questions_changed(app, category_cache.invalidate)
+
+    @app.before_request
+    def route_reads_to_replica():
+        has_replica = REPLICA_BIND in (app.config.get("SQLALCHEMY_BINDS") or {})
+        g.trivia_read_bind = REPLICA_BIND if has_replica and is_read_only_request() else None
+
+def migrate_db(app, revision='head'):
+    """Upgrades the schema of the app database to revision, the latest migration by default"""
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option('script_location', MIGRATIONS_FOLDER)
+
+    with db.get_engine(app).begin() as connection:
+        config.attributes['connection'] = connection
+        command.upgrade(config, revision)
+
+def read_only(view):
+    """Marks a view which only reads, like the GET ones, so its reads may go to the replica or the snapshot"""
+    view.trivia_read_only = True
+    return view
+
+def is_read_only_request():
+    """Returns whether the current request is a GET or goes to a view marked read_only"""
+    view = current_app.view_functions.get(request.endpoint)
+    return request.method in ('GET', 'HEAD') or getattr(view, 'trivia_read_only', False)
+
+def get_read_bind():
+    """Returns the bind the reads of the current request go to, None for the primary"""
+    return g.get('trivia_read_bind') if has_request_context() else None
+
+@contextmanager
+def primary_reads():
+    """Sends the reads of the block to the primary, even in a read-only request"""
+    read_bind = get_read_bind()
+
+    if read_bind is None:
+        yield
+        return
+
+    g.trivia_read_bind = None
+    try:
+        yield
+    finally:
+        g.trivia_read_bind = read_bind
+
+def pool_stats(app, bind=None):
+    """Returns the statistics of the connection pool of the bind"""
+    pool = db.get_engine(app, bind=bind).pool
+
+    if isinstance(pool, TimedQueuePool):
+        return pool.stats()
+    else:
+        return {'pool': type(pool).__name__}
+
+def on_questions_changed(app, listener):
+    """Registers listener(action, rows) to be called after questions are written.
+
+    action is one of 'insert', 'update' or 'delete' and rows is a list of
+    formatted questions. For deletes only the 'id' key is guaranteed.
+    """
+    app.extensions.setdefault(QUESTION_LISTENERS, []).append(listener)
+    return listener
+
+def on_remote_questions_changed(app, listener):
+    """Registers listener() to be called when another process wrote questions.
+
+    The rows written are unknown, so listeners drop what they derived from
+    the questions rather than patch it.
+    """
+    app.extensions.setdefault(REMOTE_QUESTION_LISTENERS, []).append(listener)
+    return listener
+
+def notify_remote_questions_changed(app):
+    """Calls the listeners registered for app with on_remote_questions_changed"""
+    for listener in app.extensions.get(REMOTE_QUESTION_LISTENERS, ()):
+        try:
+            listener()
+        except Exception as e:
+            print(f"🧨 remote question listener error: {e}")
+
+def on_categories_changed(app, listener):
+    """Registers listener() to be called after categories are written"""
+    app.extensions.setdefault(CATEGORY_LISTENERS, []).append(listener)
+    return listener
+
+def notify_questions_changed(action, rows):
+    """Calls the listeners registered for the current app"""
+    if not rows:
+        return
+
+    for listener in db.get_app().extensions.get(QUESTION_LISTENERS, ()):
+        try:
+            listener(action, rows)
+        except Exception as e:
+            print(f"🧨 question listener error: {e}")
 
 class Question(db.Model):
     """Question"""
     __tablename__ = 'questions'
+    __table_args__ = (
+        # Serves the listing of a category and the quiz lookups, both ordered by id.
+        Index('ix_questions_category_id', 'category', 'id'),
+        )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id', name='category', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -39,8 +283,13 @@ class Question(db.Model):
         db.session.add(self)
         db.session.commit()
 
-    def update(self):
-        db.session.commit()
+    def update(self, changes=None, commit=True):
+        """Applies the validated changes and commits, unless commit is False"""
+        for key, value in (changes or {}).items():
+            setattr(self, key, value)
+
+        if commit:
+            db.session.commit()
 
     def delete(self):
         db.session.delete(self)
@@ -55,6 +304,86 @@ class Question(db.Model):
             'difficulty': self.difficulty
             }
 
+def queue_question_change(action, question):
+    """Keeps the change on the session until it is committed"""
+    queue_question_changes(object_session(question), action, [question.format()])
+
+def queue_question_changes(session, action, rows):
+    session.info.setdefault(PENDING_QUESTION_CHANGES, []).extend((action, row) for row in rows)
+
+def delete_questions_by_id(question_ids):
+    """Deletes the questions with one DELETE statement and returns the deleted ids.
+
+    The caller owns the transaction, nothing is committed here. On PostgreSQL
+    the ids come back through RETURNING, for a single id the row count is
+    enough and otherwise the existing ids are selected first.
+    """
+    question_ids = sorted(set(question_ids))
+
+    if not question_ids:
+        return []
+
+    table = Question.__table__
+    statement = table.delete().where(table.c.id.in_(question_ids))
+
+    if db.engine.dialect.name == 'postgresql':
+        deleted = [row[0] for row in db.session.execute(statement.returning(table.c.id))]
+    elif len(question_ids) == 1:
+        deleted = question_ids if db.session.execute(statement).rowcount > 0 else []
+    else:
+        deleted = [row[0] for row in db.session.query(Question.id).filter(Question.id.in_(question_ids))]
+        db.session.execute(statement)
+
+    queue_question_changes(db.session, 'delete', [{'id': question_id} for question_id in deleted])
+
+    return deleted
+
+@event.listens_for(Question, 'after_insert')
+def queue_question_insert(mapper, connection, target):
+    queue_question_change('insert', target)
+
+@event.listens_for(Question, 'after_update')
+def queue_question_update(mapper, connection, target):
+    queue_question_change('update', target)
+
+@event.listens_for(Question, 'after_delete')
+def queue_question_delete(mapper, connection, target):
+    queue_question_change('delete', target)
+
+@event.listens_for(Session, 'after_commit')
+def dispatch_question_changes(session):
+    """Notifies the listeners once the questions written by the session are committed"""
+    changes = session.info.pop(PENDING_QUESTION_CHANGES, None)
+
+    if not changes:
+        return
+
+    action, rows = changes[0][0], []
+    for change_action, row in changes:
+        if change_action != action:
+            notify_questions_changed(action, rows)
+            action, rows = change_action, []
+        rows.append(row)
+    notify_questions_changed(action, rows)
+
+@event.listens_for(Session, 'after_commit')
+def dispatch_category_changes(session):
+    """Notifies the listeners once the categories written by the session are committed"""
+    if not session.info.pop(PENDING_CATEGORY_CHANGES, False):
+        return
+
+    for listener in db.get_app().extensions.get(CATEGORY_LISTENERS, ()):
+        try:
+            listener()
+        except Exception as e:
+            print(f"🧨 category listener error: {e}")
+
+@event.listens_for(Session, 'after_rollback')
+def discard_question_changes(session):
+    session.info.pop(PENDING_QUESTION_CHANGES, None)
+    session.info.pop(PENDING_CATEGORY_CHANGES, None)
+
+
 class Category(db.Model):
     """Category"""
     __tablename__ = 'categories'
@@ -70,49 +399,114 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
             }
-    
 
-class QuestionDecoder(json.JSONDecoder):
-    """QuestionDecoder"""
 
-    def __init__(self, *args, **kwargs):
-        json.JSONDecoder.__init__(self, object_hook=self.object_hook, *args, **kwargs)
+# Single row bumped by the triggers of migration 0005 on every write of a
+# question or a category, by this app or any other writer.
+data_versions = Table(
+    'data_versions', db.Model.metadata,
+    Column('id', Integer, primary_key=True),
+    Column('version', BigInteger, nullable=False),
+    Column('changed_at', Float, nullable=False),
+    )
 
-    def object_hook(self, dct):
-        question = dct.get('question')
 
-        if question is None or question == '':
-            raise ValueError('question is required')
+class CategoryCache:
+    """In-process cache of the categories map and the set of valid category ids"""
 
-        answer = dct.get('answer')
+    def __init__(self, ttl=CATEGORY_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entry = None
+        self._lock = threading.Lock()
 
-        if answer is None or answer == '':
-            raise ValueError('answer is required')
+    def get(self):
+        """Returns the categories map and the valid ids, loading them when expired"""
+        entry = self._entry
 
-        category = -1
+        if entry is not None and time.monotonic() < entry[2]:
+            self.hits += 1
+            return entry[0], entry[1]
 
-        try:
-            category = int(dct.get('category'))
-        except Exception as exc:
-            raise ValueError('category is required') from exc
-        
-        if category == -1:
-            raise ValueError('category is required')
+        with self._lock:
+            entry = self._entry
 
-        difficulty = -1
+            if entry is not None and time.monotonic() < entry[2]:
+                self.hits += 1
+                return entry[0], entry[1]
 
-        try:
-            difficulty = int(dct.get('difficulty'))
-        except Exception as exc:
-            raise ValueError('difficulty is required') from exc
-
-        if difficulty < 1 or difficulty > 5:
-            raise ValueError('difficulty is required')
-
-        return Question(
-            question= question,
-            answer= answer,
-            category= category,
-            difficulty= difficulty
-            )
-  
\ No newline at end of file
+            self.misses += 1
+            categories = Category.query.all()
+            entry = (
+                { str(category.id): category.type for category in categories },
+                frozenset(category.id for category in categories),
+                time.monotonic() + self.ttl,
+                )
+            self._entry = entry
+
+        return entry[0], entry[1]
+
+    def invalidate(self):
+        """Drops the cached categories so the next read goes to the database"""
+        self._entry = None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'ttl': self.ttl,
+            }
+
+
+def get_category_cache(app=None):
+    """Returns the category cache of app, the current app by default"""
+    return (app or current_app).extensions[CATEGORY_CACHE]
+
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def queue_category_change(mapper, connection, target):
+    """Keeps the change on the session, so the category caches are invalidated once it is committed"""
+    object_session(target).info[PENDING_CATEGORY_CHANGES] = True
+
+
+def validate_question(dct):
+    """Validates the fields of a question, raising ValueError when one is invalid"""
+    question = dct.get('question')
+
+    if question is None or question == '':
+        raise ValueError('question is required')
+
+    answer = dct.get('answer')
+
+    if answer is None or answer == '':
+        raise ValueError('answer is required')
+
+    category = -1
+
+    try:
+        category = int(dct.get('category'))
+    except Exception as exc:
+        raise ValueError('category is required') from exc
+
+    if category == -1:
+        raise ValueError('category is required')
+
+    difficulty = -1
+
+    try:
+        difficulty = int(dct.get('difficulty'))
+    except Exception as exc:
+        raise ValueError('difficulty is required') from exc
+
+    if difficulty < 1 or difficulty > 5:
+        raise ValueError('difficulty is required')
+
+    return {
+        'question': question,
+        'answer': answer,
+        'category': category,
+        'difficulty': difficulty
+        }
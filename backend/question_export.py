@@ -0,0 +1,59 @@
+"""Streaming export of questions as NDJSON or CSV"""
+import csv
+import io
+import os
+from itertools import islice
+from models import Question
+from serialization import QUESTION_FIELDS, dumps_json, format_question_rows, question_rows
+
+EXPORT_CHUNK_SIZE = int(os.environ.get('TRIVIA_EXPORT_CHUNK_SIZE', 1000))
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    }
+
+
+def export_query(category_id=None, after_id=None, fields=QUESTION_FIELDS):
+    """Returns the rows of the questions to export ordered by id, after_id being the watermark of a previous export"""
+    query = Question.query
+
+    if category_id:
+        query = query.filter(Question.category == category_id)
+
+    if after_id:
+        query = query.filter(Question.id > after_id)
+
+    return question_rows(query.order_by(Question.id), fields)
+
+def export_questions(query, format='ndjson', fields=QUESTION_FIELDS, chunk_size=EXPORT_CHUNK_SIZE, as_ascii=True):
+    """Yields the rows of query encoded as NDJSON or CSV, chunk_size rows at a time.
+
+    The rows are fetched with yield_per, which reads them through a server
+    side cursor on PostgreSQL, so only one chunk is held in memory whatever
+    the size of the bank. The output can be imported again as is.
+    """
+    rows = iter(query.yield_per(chunk_size))
+    header_written = False
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+
+        if format == 'csv':
+            table = format_question_rows(chunk, 'columns', fields)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator='\n')
+
+            if not header_written:
+                writer.writerow(table['columns'])
+                header_written = True
+
+            writer.writerows(table['rows'])
+            yield buffer.getvalue().encode('utf-8')
+        else:
+            yield b''.join(dumps_json(question, as_ascii) for question in format_question_rows(chunk, 'objects', fields))
+
+        if len(chunk) < chunk_size:
+            return
@@ -0,0 +1,138 @@
+"""Bulk import of questions from NDJSON or CSV"""
+import csv
+import json
+import os
+from models import Question, db, notify_questions_changed, validate_question
+
+IMPORT_BATCH_SIZE = int(os.environ.get('TRIVIA_IMPORT_BATCH_SIZE', 1000))
+MAX_REPORTED_ERRORS = 1000
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+
+QUESTION_COLUMNS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+CONTENT_TYPE_FORMATS = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+    }
+
+
+def read_ndjson(lines):
+    """Yields (line number, record) for each line, record being the error when the line is not valid JSON"""
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError('invalid json: {}'.format(e))
+        else:
+            if isinstance(record, dict):
+                yield line_number, record
+            else:
+                yield line_number, ValueError('a question object is required')
+
+def read_csv(lines):
+    """Yields (line number, record) for each row of a CSV file with a header line"""
+    lines = (line.decode('utf-8') if isinstance(line, bytes) else line for line in lines)
+    reader = csv.DictReader(lines)
+
+    for record in reader:
+        yield reader.line_num, record
+
+def read_records(lines, format):
+    if format == 'csv':
+        return read_csv(lines)
+    else:
+        return read_ndjson(lines)
+
+def import_questions(records, batch_size=IMPORT_BATCH_SIZE):
+    """Validates and inserts the records in batches of batch_size rows.
+
+    Each batch is written with one executemany INSERT and one commit. Invalid
+    rows are skipped and reported, and when the database rejects a batch its
+    rows are inserted one by one so that only the offending rows are lost.
+    Returns the number of imported and failed rows and the errors by line
+    number, of which at most MAX_REPORTED_ERRORS are kept.
+    """
+    report = {'imported': 0, 'failed': 0, 'errors': []}
+    batch = []
+
+    for line_number, record in records:
+        if isinstance(record, Exception):
+            add_import_error(report, line_number, record)
+            continue
+
+        try:
+            batch.append((line_number, validate_question(record)))
+        except ValueError as e:
+            add_import_error(report, line_number, e)
+            continue
+
+        if len(batch) >= batch_size:
+            insert_batch(batch, report)
+            batch = []
+
+    if batch:
+        insert_batch(batch, report)
+
+    return report
+
+def add_import_error(report, line_number, error):
+    report['failed'] += 1
+
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+        report['errors'].append({'line': line_number, 'error': str(error)})
+
+def insert_rows(rows):
+    """Inserts the rows and returns them with their ids, without committing.
+
+    On PostgreSQL the rows come back through RETURNING. On SQLite the first
+    row is inserted alone: its INSERT takes the write lock, held until the
+    commit, so the rows inserted after it in the same transaction get the
+    next rowids and nothing is read back.
+    """
+    table = Question.__table__
+
+    if db.engine.dialect.name == 'postgresql':
+        columns = [table.c[name] for name in QUESTION_COLUMNS]
+        inserted = db.session.execute(table.insert().values(rows).returning(*columns))
+        return [dict(zip(QUESTION_COLUMNS, row)) for row in inserted]
+
+    first_id = db.session.execute(table.insert(), rows[0]).inserted_primary_key[0]
+
+    if len(rows) > 1:
+        db.session.execute(table.insert(), rows[1:])
+
+    return [dict(row, id=first_id + offset) for offset, row in enumerate(rows)]
+
+def insert_batch(batch, report):
+    inserted = []
+
+    try:
+        inserted = insert_rows([row for _, row in batch])
+        db.session.commit()
+        report['imported'] += len(batch)
+    except Exception as e:
+        print(f"🧨 import batch error: {e}")
+        db.session.rollback()
+        inserted = []
+
+        for line_number, row in batch:
+            try:
+                rows = insert_rows([row])
+                db.session.commit()
+                inserted.extend(rows)
+                report['imported'] += 1
+            except Exception as row_error:
+                db.session.rollback()
+                add_import_error(report, line_number, row_error)
+
+    # Core inserts do not go through the ORM events, so the listeners are
+    # told about the new rows explicitly.
+    notify_questions_changed('insert', inserted)
@@ -0,0 +1,197 @@
+"""Server-side quiz sessions holding a pre-shuffled deck of question ids"""
+import os
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+from flask import current_app
+from category_decks import get_category_decks
+from models import Question
+
+QUIZ_SESSION_BACKEND = os.environ.get('TRIVIA_QUIZ_SESSION_BACKEND', 'memory')
+QUIZ_SESSION_URL = os.environ.get('TRIVIA_QUIZ_SESSION_URL', 'redis://localhost:6379/0')
+QUIZ_SESSION_TTL = int(os.environ.get('TRIVIA_QUIZ_SESSION_TTL', 3600))
+QUIZ_SESSION_MAX = int(os.environ.get('TRIVIA_QUIZ_SESSION_MAX', 10000))
+QUIZ_DECK_SIZE = int(os.environ.get('TRIVIA_QUIZ_DECK_SIZE', 1000))
+
+QUIZ_SESSIONS = 'trivia_quiz_sessions'
+
+
+class MemoryQuizStore:
+    """Decks kept in process, evicted when idle for ttl seconds or when max_sessions is exceeded.
+
+    A deck is an array of 8 byte ids drawn from its end, so a session costs
+    8 bytes per question and drawing the next id is O(1).
+    """
+
+    name = 'memory'
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL, max_sessions=QUIZ_SESSION_MAX):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._decks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session_id, deck):
+        with self._lock:
+            self._evict()
+            self._decks[session_id] = (array('q', deck), time.monotonic() + self.ttl)
+
+            while len(self._decks) > self.max_sessions:
+                self._decks.popitem(last=False)
+
+    def draw(self, session_id):
+        """Returns the next id of the deck, 0 when the deck is empty and None when the session is unknown"""
+        with self._lock:
+            entry = self._decks.get(session_id)
+
+            if entry is None or entry[1] < time.monotonic():
+                self._decks.pop(session_id, None)
+                return None
+
+            deck = entry[0]
+            self._decks[session_id] = (deck, time.monotonic() + self.ttl)
+            self._decks.move_to_end(session_id)
+
+            return deck.pop() if deck else 0
+
+    def remaining(self, session_id):
+        entry = self._decks.get(session_id)
+        return len(entry[0]) if entry is not None else 0
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._decks.pop(session_id, None) is not None
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._decks:
+            session_id, (deck, expires_at) = next(iter(self._decks.items()))
+            if expires_at >= now:
+                break
+            del self._decks[session_id]
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'sessions': len(self._decks),
+            'ids': sum(len(deck) for deck, _ in list(self._decks.values())),
+            }
+
+
+class RedisQuizStore:
+    """Decks kept as Redis lists, so every worker serves the same sessions.
+
+    A script draws the next id and puts the end marker back in one atomic
+    step, so concurrent draws at the end of a deck all see the marker, and
+    the key expires ttl seconds after the last draw.
+    """
+
+    DRAW_SCRIPT = """
+        local question_id = redis.call('RPOP', KEYS[1])
+        if question_id == '0' then
+            redis.call('RPUSH', KEYS[1], 0)
+        end
+        if question_id then
+            redis.call('EXPIRE', KEYS[1], ARGV[1])
+        end
+        return question_id
+        """
+
+    name = 'redis'
+
+    def __init__(self, url=QUIZ_SESSION_URL, ttl=QUIZ_SESSION_TTL, prefix='trivia:quiz'):
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError('the redis package is required by the redis quiz sessions') from exc
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self._draw = self.client.register_script(self.DRAW_SCRIPT)
+
+    def _key(self, session_id):
+        return '{}:{}'.format(self.prefix, session_id)
+
+    def create(self, session_id, deck):
+        key = self._key(session_id)
+        pipeline = self.client.pipeline()
+        # The empty marker keeps the key alive once every id has been drawn.
+        pipeline.rpush(key, 0, *deck)
+        pipeline.expire(key, self.ttl)
+        pipeline.execute()
+
+    def draw(self, session_id):
+        question_id = self._draw(keys=[self._key(session_id)], args=[self.ttl])
+        return int(question_id) if question_id is not None else None
+
+    def remaining(self, session_id):
+        return max(self.client.llen(self._key(session_id)) - 1, 0)
+
+    def delete(self, session_id):
+        return self.client.delete(self._key(session_id)) > 0
+
+    def stats(self):
+        return {'backend': self.name}
+
+
+def create_store(app):
+    backend = app.config['QUIZ_SESSION_BACKEND']
+
+    if backend == 'memory':
+        return MemoryQuizStore(app.config['QUIZ_SESSION_TTL'], app.config['QUIZ_SESSION_MAX'])
+    elif backend == 'redis':
+        return RedisQuizStore(app.config['QUIZ_SESSION_URL'], app.config['QUIZ_SESSION_TTL'])
+    else:
+        raise ValueError('unknown quiz session backend {}'.format(backend))
+
+def init_quiz_sessions(app):
+    """Creates the quiz session store of the app"""
+    app.config.setdefault('QUIZ_SESSION_BACKEND', QUIZ_SESSION_BACKEND)
+    app.config.setdefault('QUIZ_SESSION_URL', QUIZ_SESSION_URL)
+    app.config.setdefault('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL)
+    app.config.setdefault('QUIZ_SESSION_MAX', QUIZ_SESSION_MAX)
+    app.config.setdefault('QUIZ_DECK_SIZE', QUIZ_DECK_SIZE)
+
+    app.extensions[QUIZ_SESSIONS] = create_store(app)
+
+def start_quiz_session(category_id=None, previous_questions=()):
+    """Shuffles a deck of at most QUIZ_DECK_SIZE questions and returns (session id, deck size).
+
+    The deck is drawn from random positions of the category deck, in
+    random order, so the cost depends on the deck size rather than on the
+    number of questions of the category.
+    """
+    deck = get_category_decks().random_ids(category_id, set(previous_questions or ()), current_app.config['QUIZ_DECK_SIZE'])
+    session_id = uuid.uuid4().hex
+
+    current_app.extensions[QUIZ_SESSIONS].create(session_id, deck)
+
+    return session_id, len(deck)
+
+def next_session_question(session_id):
+    """Returns (question, remaining) for the session, question being None once the deck is exhausted.
+
+    Questions deleted since the deck was shuffled are skipped. None is
+    returned when the session is unknown or expired.
+    """
+    store = current_app.extensions[QUIZ_SESSIONS]
+
+    while True:
+        question_id = store.draw(session_id)
+
+        if question_id is None:
+            return None
+
+        if question_id == 0:
+            return None, 0
+
+        question = Question.query.get(question_id)
+
+        if question is not None:
+            return question, store.remaining(session_id)
+
+def end_quiz_session(session_id):
+    return current_app.extensions[QUIZ_SESSIONS].delete(session_id)
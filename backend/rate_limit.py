@@ -0,0 +1,233 @@
+"""Token bucket rate limiting and load shedding of the write and quiz endpoints"""
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from flask import abort, g, request
+from models import pool_stats
+
+RATE_LIMIT_BACKEND = os.environ.get('TRIVIA_RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_URL = os.environ.get('TRIVIA_RATE_LIMIT_URL', 'redis://localhost:6379/0')
+RATE_LIMIT_CLIENT_HEADER = os.environ.get('TRIVIA_RATE_LIMIT_CLIENT_HEADER')
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get('TRIVIA_RATE_LIMIT_MAX_CLIENTS', 100000))
+LOAD_SHED_WAIT_MS = float(os.environ.get('TRIVIA_LOAD_SHED_WAIT_MS', 250))
+
+# Requests per second and burst of every limited route, by method and URL rule.
+DEFAULT_RATE_LIMITS = {
+    'POST /questions': '10/30',
+    'PATCH /questions': '1/5',
+    'DELETE /questions/<int:id>': '2/10',
+    'POST /questions/import': '0.1/2',
+    'GET /questions/export': '0.1/2',
+    'POST /quizzes': '10/30',
+    'POST /quizzes/sessions': '1/10',
+    }
+
+RATE_LIMITER = 'trivia_rate_limiter'
+
+
+def parse_rate_limits(value):
+    """Parses 'METHOD rule=rate/burst' pairs separated by commas"""
+    limits = {}
+
+    for item in value.split(','):
+        if item.strip():
+            route, _, limit = item.rpartition('=')
+            limits[route.strip()] = limit.strip()
+
+    return limits
+
+def parse_limit(limit):
+    """Returns (rate, burst) from 'rate/burst', the burst defaulting to the rate"""
+    rate, _, burst = str(limit).partition('/')
+    rate = float(rate)
+    burst = float(burst) if burst else max(rate, 1.0)
+
+    if rate <= 0 or burst < 1:
+        raise ValueError('invalid rate limit {}'.format(limit))
+
+    return rate, burst
+
+RATE_LIMITS = parse_rate_limits(os.environ['TRIVIA_RATE_LIMITS']) if os.environ.get('TRIVIA_RATE_LIMITS') else DEFAULT_RATE_LIMITS
+
+
+class MemoryBuckets:
+    """Token buckets of this process, the least recently used dropped beyond max_clients"""
+
+    name = 'memory'
+
+    def __init__(self, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Takes a token, returning (allowed, seconds until the next token)"""
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+
+            if allowed:
+                tokens -= 1
+
+            self._buckets[key] = (tokens, now)
+
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+        return allowed, (1 - tokens) / rate if not allowed else 0.0
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker through a Redis compatible server.
+
+    The refill and the take run in one Lua script, so concurrent workers
+    cannot both spend the last token.
+    """
+
+    name = 'redis'
+
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, url=RATE_LIMIT_URL, prefix='trivia:ratelimit'):
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError('the redis package is required by the redis rate limiter') from exc
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst):
+        allowed, tokens = self.script(keys=['{}:{}'.format(self.prefix, key)], args=[rate, burst, time.time()])
+        tokens = float(tokens)
+        return bool(allowed), (1 - tokens) / rate if not allowed else 0.0
+
+
+class RateLimiter:
+    """Admission control of the limited routes, with its counters"""
+
+    def __init__(self, buckets, limits, shed_wait_seconds):
+        self.buckets = buckets
+        self.limits = { route: parse_limit(limit) for route, limit in limits.items() }
+        self.shed_wait_seconds = shed_wait_seconds
+        self.allowed = Counter()
+        self.limited = Counter()
+        self.shed = Counter()
+
+    def is_overloaded(self, app):
+        """True when the connection pool is exhausted or its recent checkouts waited too long"""
+        if self.shed_wait_seconds <= 0:
+            return False
+
+        stats = pool_stats(app)
+
+        if 'checked_out' not in stats:
+            return False
+
+        exhausted = stats['checked_out'] >= stats['size'] + max(app.config['DB_MAX_OVERFLOW'], 0)
+        return exhausted or stats['wait_seconds_recent'] > self.shed_wait_seconds
+
+    def stats(self):
+        return {
+            'backend': self.buckets.name,
+            'allowed': dict(self.allowed),
+            'limited': dict(self.limited),
+            'shed': dict(self.shed),
+            }
+
+
+def create_buckets(app):
+    backend = app.config['RATE_LIMIT_BACKEND']
+
+    if backend == 'memory':
+        return MemoryBuckets(app.config['RATE_LIMIT_MAX_CLIENTS'])
+    elif backend == 'redis':
+        return RedisBuckets(app.config['RATE_LIMIT_URL'])
+    elif backend == 'none':
+        return None
+    else:
+        raise ValueError('unknown rate limit backend {}'.format(backend))
+
+def client_id(header_name=None):
+    """Identifies the client by header_name, for example X-Forwarded-For behind a proxy, or by its address"""
+    header = request.headers.get(header_name) if header_name else None
+
+    if header:
+        return header.split(',')[0].strip()
+
+    return request.remote_addr or 'unknown'
+
+def init_rate_limit(app):
+    """Answers 429 to the clients over the limit of a route and 503 to the limited routes while the pool is overloaded"""
+    app.config.setdefault('RATE_LIMIT_BACKEND', RATE_LIMIT_BACKEND)
+    app.config.setdefault('RATE_LIMIT_URL', RATE_LIMIT_URL)
+    app.config.setdefault('RATE_LIMIT_CLIENT_HEADER', RATE_LIMIT_CLIENT_HEADER)
+    app.config.setdefault('RATE_LIMIT_MAX_CLIENTS', RATE_LIMIT_MAX_CLIENTS)
+    app.config.setdefault('RATE_LIMITS', RATE_LIMITS)
+    app.config.setdefault('LOAD_SHED_WAIT_MS', LOAD_SHED_WAIT_MS)
+
+    buckets = create_buckets(app)
+
+    if buckets is None:
+        app.extensions[RATE_LIMITER] = None
+        return
+
+    limiter = RateLimiter(buckets, app.config['RATE_LIMITS'], app.config['LOAD_SHED_WAIT_MS'] / 1000)
+    app.extensions[RATE_LIMITER] = limiter
+
+    @app.before_request
+    def admit_request():
+        if request.url_rule is None:
+            return
+
+        route = '{} {}'.format(request.method, request.url_rule.rule)
+        limit = limiter.limits.get(route)
+
+        if limit is None:
+            return
+
+        if limiter.is_overloaded(app):
+            limiter.shed[route] += 1
+            g.trivia_retry_after = 1
+            abort(503)
+
+        key = '{}:{}'.format(route, client_id(app.config['RATE_LIMIT_CLIENT_HEADER']))
+        allowed, retry_after = buckets.take(key, *limit)
+
+        if not allowed:
+            limiter.limited[route] += 1
+            g.trivia_retry_after = max(1, math.ceil(retry_after))
+            abort(429)
+
+        limiter.allowed[route] += 1
+
+def set_retry_after(response):
+    """Adds the Retry-After header computed by the limiter to an error response"""
+    retry_after = g.get('trivia_retry_after')
+
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+
+    return response
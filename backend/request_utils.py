@@ -1,59 +1,288 @@
 
-from operator import is_not
-from flask import abort, jsonify
-from models import Category
+import base64
+import binascii
+import random
+from flask import abort
+from sqlalchemy import func
+from instrumentation import timed_phase
+from models import Question, get_category_cache, get_read_bind, primary_reads
+from serialization import RESPONSE_FORMATS, format_question_rows, json_response, parse_fields, question_rows
 
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+MAX_QUIZ_QUESTIONS = 50
 
-def is_valid_category_id(category_id, categories):
-    return category_id and category_id in map(lambda category: category.id, categories)
+def is_valid_category_id(category_id, category_ids):
+    return category_id and category_id in category_ids
+
+def is_question_id(value):
+    """Returns whether value is an integer question id, JSON booleans excluded"""
+    return isinstance(value, int) and not isinstance(value, bool)
 
 def get_categories_or_none(category_id = None):
-        categories = Category.query.all()
-        
-        if is_not(None, categories):
-            is_valid_category =  is_valid_category_id(category_id, categories) if category_id else True 
-
-            if is_valid_category:
-                return { str(category.id): category.type for category in categories }
-            else:
-                return None
+        categories, category_ids = get_category_cache().get()
+
+        is_valid_category =  is_valid_category_id(category_id, category_ids) if category_id else True
+
+        if is_valid_category:
+            return categories
         else:
             return None
 
-def paginate_questions_or_none(request, query, category_id = None):
-    page = request.args.get('page', 1, type=int)
+def encode_cursor(question_id):
+    """Encodes the id of the last question of a page as an opaque cursor"""
+    return base64.urlsafe_b64encode(str(question_id).encode()).decode().rstrip('=')
+
+def parse_cursor(cursor):
+    """Decodes a cursor created by encode_cursor, raising ValueError when malformed"""
+    if not cursor:
+        return 0
+
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(cursor + padding).decode())
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError('malformed cursor') from e
+
+def decode_cursor(cursor):
+    """Decodes a cursor created by encode_cursor, aborting with 400 when malformed"""
+    try:
+        return parse_cursor(cursor)
+    except ValueError:
+        abort(400)
+
+def is_cursor_request(request):
+    return 'cursor' in request.args or 'after_id' in request.args
+
+def get_response_format(request):
+    """Returns the format of the question list, 'objects' (the default) or 'columns'"""
+    response_format = request.args.get('format', 'objects')
+
+    if response_format not in RESPONSE_FORMATS:
+        abort(400)
+
+    return response_format
+
+def get_response_fields(request):
+    """Returns the question fields selected by the fields argument, all of them by default"""
+    try:
+        return parse_fields(request.args.get('fields'))
+    except ValueError:
+        abort(400)
+
+def includes_categories(request):
+    return request.args.get('include_categories', 'true').lower() != 'false'
 
-    categories = get_categories_or_none(category_id)
+def question_list_response(request, questions, categories, category_id, response_format, fields, **extra):
+    """Serializes a page of question rows, with the categories unless include_categories=false"""
+    with timed_phase('format'):
+        response = dict(extra, success=True, current_category=category_id if category_id else 0)
+        response['questions'] = format_question_rows(questions, response_format, fields)
+
+        if includes_categories(request):
+            response['categories'] = categories
+
+    with timed_phase('serialize'):
+        return json_response(response)
+
+def question_rows_by_id(query, question_ids, fields):
+    """Returns the rows of query with the given ids, in the order of the ids, leaving out the missing ones.
+
+    The ids come from the decks, which follow the primary. The ids missing
+    from a snapshot or a replica, which lag the writes, are read again from
+    the primary.
+    """
+    rows = { row[0]: row for row in question_rows(query.filter(Question.id.in_(question_ids)), fields) } if question_ids else {}
+    missing_ids = [question_id for question_id in question_ids if question_id not in rows]
+
+    if missing_ids and get_read_bind() is not None:
+        with primary_reads():
+            rows.update((row[0], row) for row in question_rows(query.filter(Question.id.in_(missing_ids)), fields))
+
+    return [rows[question_id] for question_id in question_ids if question_id in rows]
+
+def paginate_questions_or_none(request, query, category_id = None, decks = None):
+    """Returns a page of the questions of query, or None when the page is empty.
+
+    When the CategoryDecks of the listing, or the SearchResults of a search,
+    are given, the ids of the page and the total come from them instead of
+    OFFSET and COUNT queries, and the rows keep the order of the ids.
+    """
+    with timed_phase('categories'):
+        categories = get_categories_or_none(category_id)
 
     if categories is None:
         abort(400)
 
-    questions = []
+    if is_cursor_request(request):
+        return seek_questions_or_none(request, query, categories, category_id, decks)
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    response_format = get_response_format(request)
+    fields = get_response_fields(request)
 
     total_questions = 0
-    
+
     try:
-        questions = query.paginate(page, QUESTIONS_PER_PAGE, False).items
-        total_questions = query.count()
+        if decks is not None:
+            with timed_phase('paginate'):
+                page_ids, total_questions = decks.page(category_id, (page - 1) * QUESTIONS_PER_PAGE, QUESTIONS_PER_PAGE)
+                questions = question_rows_by_id(query, page_ids, fields)
+        else:
+            with timed_phase('paginate'):
+                questions = question_rows(query, fields).limit(QUESTIONS_PER_PAGE).offset((page - 1) * QUESTIONS_PER_PAGE).all()
+        if questions and decks is None:
+            with timed_phase('count'):
+                # A first page which is not full is the whole result.
+                if page == 1 and len(questions) < QUESTIONS_PER_PAGE:
+                    total_questions = len(questions)
+                else:
+                    total_questions = query.order_by(None).count()
     except Exception as e:
         print('🧨 error: {}'.format(e))
         abort(500)
 
-    if questions is None:
+    if len(questions) > 0:
+        return question_list_response(
+            request, questions, categories, category_id, response_format, fields, total_questions=total_questions
+            )
+    else:
+        return None
+
+def seek_questions_or_none(request, query, categories, category_id = None, decks = None):
+    """Keyset pagination over a query ordered by Question.id.
+
+    Rather than OFFSET/LIMIT the page starts right after the id carried by the
+    cursor (or after_id), so deep pages cost the same as the first one. The
+    total count is only computed when include_total=true is requested.
+    """
+    if 'cursor' in request.args:
+        after_id = decode_cursor(request.args.get('cursor'))
+    else:
+        after_id = request.args.get('after_id', 0, type=int)
+
+    limit = request.args.get('limit', QUESTIONS_PER_PAGE, type=int)
+
+    if limit < 1 or limit > MAX_QUESTIONS_PER_PAGE:
         abort(400)
 
-    questions = map(lambda  question: question.format(), questions)
-    questions = list(questions)
+    include_total = request.args.get('include_total', 'false').lower() == 'true'
+    response_format = get_response_format(request)
+    fields = get_response_fields(request)
 
+    total_questions = None
+    next_cursor = None
 
-    if len(questions) > 0:
-        return jsonify({
-            'success': True,
-            'questions': questions,
-            'total_questions': total_questions,
-            'categories': categories,
-            'current_category': category_id if category_id else 0
-            })
-    else:
-        return None
\ No newline at end of file
+    try:
+        if decks is not None:
+            with timed_phase('seek'):
+                page_ids, total_questions = decks.after(category_id, after_id, limit + 1)
+                # The cursor follows the ids of the deck, so a question deleted
+                # since the deck was built shortens the page, not the listing.
+                if len(page_ids) > limit:
+                    next_cursor = encode_cursor(page_ids[limit - 1])
+                questions = question_rows_by_id(query, page_ids[:limit], fields)
+        else:
+            with timed_phase('seek'):
+                questions = question_rows(query, fields).filter(Question.id > after_id).limit(limit + 1).all()
+            if len(questions) > limit:
+                next_cursor = encode_cursor(questions[limit - 1].id)
+        if include_total and decks is None:
+            with timed_phase('count'):
+                total_questions = query.order_by(None).count()
+    except Exception as e:
+        print('🧨 error: {}'.format(e))
+        abort(500)
+
+    if len(questions) == 0 and next_cursor is None:
+        return None
+
+    extra = {'total_questions': total_questions} if include_total else {}
+
+    return question_list_response(
+        request, questions[:limit], categories, category_id, response_format, fields, next_cursor=next_cursor, **extra
+        )
+
+def random_question_or_none(previous_questions, category_id = None, decks = None):
+    """Picks a random question which is not in previous_questions.
+
+    With CategoryDecks the id is drawn from the deck of the category and only
+    that question is read. Otherwise, instead of loading every candidate row,
+    a random id is drawn between the smallest and the largest id of the
+    category and the first eligible question at or after it is read,
+    wrapping around to the first one. The bounds and the question are both
+    read from the (category, id) index, so the cost does not grow with the
+    number of questions.
+    """
+    if decks is not None:
+        with timed_phase('pick'):
+            question_id = decks.random_id(category_id, set(previous_questions or ()))
+            question = Question.query.get(question_id) if question_id is not None else None
+
+        # A question deleted by another process is still in the deck until
+        # it is rebuilt, the database is asked instead.
+        if question is not None or question_id is None:
+            return question
+
+    query = Question.query
+
+    if category_id:
+        query = query.filter(Question.category == category_id)
+
+    with timed_phase('bounds'):
+        min_id, max_id = query.with_entities(func.min(Question.id), func.max(Question.id)).one()
+
+    if min_id is None:
+        return None
+
+    if previous_questions:
+        query = query.filter(Question.id.notin_(previous_questions))
+
+    with timed_phase('pick'):
+        pivot = random.randint(min_id, max_id)
+        question = query.filter(Question.id >= pivot).order_by(Question.id).first()
+
+        if question is None:
+            question = query.filter(Question.id < pivot).order_by(Question.id).first()
+
+    return question
+
+def parse_question_count(value):
+    """Returns the number of quiz questions asked for, raising ValueError unless it is between 1 and MAX_QUIZ_QUESTIONS"""
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= MAX_QUIZ_QUESTIONS:
+        raise ValueError('count must be an integer between 1 and {}'.format(MAX_QUIZ_QUESTIONS))
+
+    return value
+
+def random_questions(previous_questions, count, category_id = None, decks = None):
+    """Picks at most count distinct random questions which are not in previous_questions.
+
+    With CategoryDecks the ids are drawn from the deck of the category and
+    read with one IN query. Otherwise, or for the questions deleted by
+    another process since the deck was built, the database draws them with
+    one ORDER BY random() query over the eligible rows.
+    """
+    excluded = set(previous_questions or ())
+    questions = []
+
+    if decks is not None:
+        with timed_phase('pick'):
+            question_ids = decks.random_ids(category_id, excluded, count)
+            found = { question.id: question for question in Question.query.filter(Question.id.in_(question_ids)) } if question_ids else {}
+            questions = [found[question_id] for question_id in question_ids if question_id in found]
+
+        if len(questions) == len(question_ids):
+            return questions
+
+        excluded.update(question_ids)
+
+    query = Question.query
+
+    if category_id:
+        query = query.filter(Question.category == category_id)
+
+    if excluded:
+        query = query.filter(Question.id.notin_(excluded))
+
+    with timed_phase('pick'):
+        return questions + query.order_by(func.random()).limit(count - len(questions)).all()
@@ -0,0 +1,405 @@
+"""Server-side cache of serialized responses"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request
+from data_version import current_data_version
+from models import notify_remote_questions_changed, on_categories_changed, on_questions_changed
+
+RESPONSE_CACHE_BACKEND = os.environ.get('TRIVIA_RESPONSE_CACHE_BACKEND', 'memory')
+RESPONSE_CACHE_URL = os.environ.get('TRIVIA_RESPONSE_CACHE_URL', 'redis://localhost:6379/0')
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('TRIVIA_RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RESPONSE_CACHE_TTL = int(os.environ.get('TRIVIA_RESPONSE_CACHE_TTL', 300))
+RESPONSE_CACHE_PATH = os.environ.get('TRIVIA_RESPONSE_CACHE_PATH')
+RESPONSE_CACHE_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+RESPONSE_CACHE = 'trivia_response_cache'
+
+
+class CacheStats:
+    """Hit and miss counters shared by the backends"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class MemoryBackend:
+    """LRU of serialized bodies bounded by their total size in bytes"""
+
+    name = 'memory'
+    shared = False
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._generation = 0
+        self.counters = CacheStats()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def generation(self):
+        return self._generation
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[1] < time.monotonic():
+                self._discard(key)
+                entry = None
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+            self.counters.record(entry is not None)
+
+        return entry[0] if entry is not None else None
+
+    def set(self, key, body, generation):
+        if len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            if generation != self._generation:
+                return
+
+            self._discard(key)
+            self._entries[key] = (body, time.monotonic() + self.ttl)
+            self.size += len(body)
+
+            while self.size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self.size = 0
+            return self._generation
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'hits': self.counters.hits,
+            'misses': self.counters.misses,
+            'hit_ratio': self.counters.hit_ratio(),
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            }
+
+
+class RedisBackend:
+    """Stores the bodies in a Redis compatible server.
+
+    Keys are namespaced by a generation counter kept in the server, so an
+    invalidation is a single INCR seen by every process using the server and
+    the old entries simply expire.
+    """
+
+    name = 'redis'
+    shared = True
+
+    def __init__(self, url=RESPONSE_CACHE_URL, ttl=RESPONSE_CACHE_TTL, prefix='trivia:responses'):
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError('the redis package is required by the redis response cache') from exc
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.counters = CacheStats()
+        self.seen_generation = None
+
+    def generation(self):
+        return int(self.client.get(self.prefix + ':generation') or 0)
+
+    def _key(self, key, generation):
+        return '{}:{}:{}'.format(self.prefix, generation, key)
+
+    def get(self, key, generation):
+        body = self.client.get(self._key(key, generation))
+        self.counters.record(body is not None)
+        return body
+
+    def set(self, key, body, generation):
+        self.client.set(self._key(key, generation), body, ex=self.ttl)
+
+    def invalidate(self):
+        return self.client.incr(self.prefix + ':generation')
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'hits': self.counters.hits,
+            'misses': self.counters.misses,
+            'hit_ratio': self.counters.hit_ratio(),
+            'bytes': self.client.info('memory').get('used_memory', 0),
+            }
+
+
+class SharedBackend:
+    """Stores the bodies in a SQLite database shared by the workers of a host.
+
+    The database sits in /dev/shm by default, so it is kept in memory, and
+    every process opens its own connections to it. The generation counter
+    is a row of the database: an invalidation bumps it and drops the
+    entries in one transaction, and an entry is only stored if its
+    generation is still current, so every worker sees the same entries.
+    """
+
+    name = 'shared'
+    shared = True
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, generation INTEGER, body BLOB, expires_at REAL);
+        CREATE INDEX IF NOT EXISTS ix_responses_expires_at ON responses (expires_at);
+        CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        INSERT OR IGNORE INTO counters (name, value) VALUES ('generation', 0), ('bytes', 0);
+        '''
+
+    def __init__(self, path, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.counters = CacheStats()
+        self.seen_generation = None
+        self._local = threading.local()
+
+    def _connection(self):
+        """Returns the connection of the thread, opened again after a fork"""
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.executescript(self.SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return connection
+
+    def _counter(self, connection, name):
+        return connection.execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()[0]
+
+    def generation(self):
+        return self._counter(self._connection(), 'generation')
+
+    def get(self, key, generation):
+        row = self._connection().execute(
+            'SELECT body FROM responses WHERE key = ? AND generation = ? AND expires_at > ?',
+            (key, generation, time.time()),
+            ).fetchone()
+        self.counters.record(row is not None)
+        return row[0] if row is not None else None
+
+    def set(self, key, body, generation):
+        if len(body) > self.max_bytes:
+            return
+
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            if self._counter(connection, 'generation') != generation:
+                return
+
+            previous = connection.execute('SELECT length(body) FROM responses WHERE key = ?', (key,)).fetchone()
+            connection.execute(
+                'INSERT OR REPLACE INTO responses (key, generation, body, expires_at) VALUES (?, ?, ?, ?)',
+                (key, generation, body, time.time() + self.ttl),
+                )
+            self._add_bytes(connection, len(body) - (previous[0] if previous else 0))
+            self._evict(connection)
+        finally:
+            connection.execute('COMMIT')
+
+    def _add_bytes(self, connection, size):
+        connection.execute("UPDATE counters SET value = value + ? WHERE name = 'bytes'", (size,))
+
+    def _evict(self, connection):
+        """Drops the entries closest to expiry until the bodies fit in max_bytes"""
+        while self._counter(connection, 'bytes') > self.max_bytes:
+            rows = connection.execute('SELECT key, length(body) FROM responses ORDER BY expires_at LIMIT 16').fetchall()
+            connection.executemany('DELETE FROM responses WHERE key = ?', [(key,) for key, _ in rows])
+            self._add_bytes(connection, -sum(size for _, size in rows))
+
+    def invalidate(self):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            connection.execute("UPDATE counters SET value = value + 1 WHERE name = 'generation'")
+            connection.execute("UPDATE counters SET value = 0 WHERE name = 'bytes'")
+            connection.execute('DELETE FROM responses')
+            return self._counter(connection, 'generation')
+        finally:
+            connection.execute('COMMIT')
+
+    def stats(self):
+        connection = self._connection()
+        return {
+            'backend': self.name,
+            'hits': self.counters.hits,
+            'misses': self.counters.misses,
+            'hit_ratio': self.counters.hit_ratio(),
+            'entries': connection.execute('SELECT count(*) FROM responses').fetchone()[0],
+            'bytes': self._counter(connection, 'bytes'),
+            'max_bytes': self.max_bytes,
+            }
+
+
+def database_namespace(app):
+    """Returns a short name of the app database, so the caches of apps on other databases never mix"""
+    return hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+
+def create_backend(app):
+    backend = app.config['RESPONSE_CACHE_BACKEND']
+
+    if backend == 'memory':
+        return MemoryBackend(app.config['RESPONSE_CACHE_MAX_BYTES'], app.config['RESPONSE_CACHE_TTL'])
+    elif backend == 'redis':
+        prefix = 'trivia:responses:{}'.format(database_namespace(app))
+        return RedisBackend(app.config['RESPONSE_CACHE_URL'], app.config['RESPONSE_CACHE_TTL'], prefix)
+    elif backend == 'shared':
+        path = app.config['RESPONSE_CACHE_PATH'] or os.path.join(
+            RESPONSE_CACHE_DIR, 'trivia_response_cache_{}.db'.format(database_namespace(app))
+            )
+        return SharedBackend(path, app.config['RESPONSE_CACHE_MAX_BYTES'], app.config['RESPONSE_CACHE_TTL'])
+    elif backend == 'none':
+        return None
+    else:
+        raise ValueError('unknown response cache backend {}'.format(backend))
+
+def init_response_cache(app):
+    """Creates the response cache of the app and invalidates it on question writes.
+
+    With a backend shared by the workers, every request first compares the
+    generation to the last one the worker saw, so the writes of the other
+    workers also reset the decks and the indexes of this one.
+    """
+    app.config.setdefault('RESPONSE_CACHE_BACKEND', RESPONSE_CACHE_BACKEND)
+    app.config.setdefault('RESPONSE_CACHE_URL', RESPONSE_CACHE_URL)
+    app.config.setdefault('RESPONSE_CACHE_PATH', RESPONSE_CACHE_PATH)
+    app.config.setdefault('RESPONSE_CACHE_MAX_BYTES', RESPONSE_CACHE_MAX_BYTES)
+    app.config.setdefault('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL)
+
+    cache = create_backend(app)
+    app.extensions[RESPONSE_CACHE] = cache
+
+    if cache is None:
+        return
+
+    if not cache.shared:
+        on_questions_changed(app, lambda action, rows: cache.invalidate())
+        on_categories_changed(app, cache.invalidate)
+        return
+
+    on_questions_changed(app, lambda action, rows: invalidate_shared_cache(cache))
+    on_categories_changed(app, lambda: invalidate_shared_cache(cache))
+
+    @app.before_request
+    def follow_shared_generation():
+        try:
+            generation = cache.generation()
+        except Exception as e:
+            print(f"🧨 response cache generation error: {e}")
+            return
+
+        if cache.seen_generation is not None and generation != cache.seen_generation:
+            notify_remote_questions_changed(app)
+
+        cache.seen_generation = generation
+
+def invalidate_shared_cache(cache):
+    """Invalidates a shared cache after a write of this worker.
+
+    The generation only counts as seen when no other worker bumped it in
+    between, otherwise the next request resets what this worker derived.
+    """
+    previous = cache.seen_generation
+    generation = cache.invalidate()
+
+    if previous is not None and generation == previous + 1:
+        cache.seen_generation = generation
+
+def response_cache_key():
+    """Returns the cache key of the request, or None when it must not be cached.
+
+    GET requests are keyed by endpoint, view arguments and query string and
+    POST requests only when they are searches, by the search fields. The
+    key starts with the data version, which any writer bumps, so a worker
+    never serves a body computed before the writes of another worker under
+    the validators of the data after them.
+    """
+    if request.method == 'GET':
+        body_key = ''
+    elif request.method == 'POST' and request.is_json:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get('searchTerm'), str):
+            return None
+        body_key = '{}:{}'.format(body['searchTerm'], body.get('searchAnswers') is True)
+    else:
+        return None
+
+    key = '{}:{}:{}:{}:{}'.format(
+        current_data_version()[0],
+        request.endpoint,
+        sorted(request.view_args.items()),
+        sorted(request.args.items(multi=True)),
+        body_key,
+        )
+
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def cached_response(view):
+    """Serves the view from the response cache and stores its successful responses"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions.get(RESPONSE_CACHE)
+        key = response_cache_key() if cache is not None else None
+
+        if key is None:
+            return view(*args, **kwargs)
+
+        # The generation is read before the view runs, so a body computed
+        # while a write invalidates the cache is never stored as current.
+        generation = cache.generation()
+        body = cache.get(key, generation)
+
+        if body is not None:
+            return current_app.response_class(body, mimetype='application/json')
+
+        response = current_app.make_response(view(*args, **kwargs))
+
+        if response.status_code == 200 and response.mimetype == 'application/json':
+            cache.set(key, response.get_data(), generation)
+
+        return response
+
+    return wrapper
@@ -1,7 +1,7 @@
 #!/usr/bin/env bash
 
-dropdb trivia_test
+dropdb --if-exists trivia_test
 createdb trivia_test
 psql trivia_test < trivia.psql
-python test_flaskr.py
-dropdb trivia_test
\ No newline at end of file
+export TRIVIA_TEST_DB_PATH=${TRIVIA_TEST_DB_PATH:-postgresql://localhost:5432/trivia_test}
+python -m pytest -n auto test_flaskr.py test_api.py
@@ -0,0 +1,366 @@
+"""Full-text search over the questions"""
+import bisect
+import os
+import re
+import threading
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import func, literal_column
+from models import Question, db, on_questions_changed, on_remote_questions_changed, primary_reads
+
+SEARCH_BACKEND = os.environ.get('TRIVIA_SEARCH_BACKEND', 'auto')
+SEARCH_INDEX = 'trivia_search_index'
+AUTOCOMPLETE_INDEX = 'trivia_autocomplete_index'
+
+AUTOCOMPLETE_LIMIT = 5
+MAX_AUTOCOMPLETE_LIMIT = 20
+SNIPPET_LENGTH = 80
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+class InvertedIndex:
+    """Pure-Python inverted index used when the database is not PostgreSQL.
+
+    Every field keeps a posting set per token plus the sorted list of tokens,
+    so a prefix is resolved with a binary search instead of a scan of the
+    questions. The texts are kept too, for the snippets of the autocomplete.
+    """
+
+    FIELDS = ('question', 'answer')
+    FIELD_WEIGHTS = {'question': 2, 'answer': 1}
+
+    def __init__(self):
+        self.ready = False
+        self._postings = {field: defaultdict(set) for field in self.FIELDS}
+        self._tokens = {field: [] for field in self.FIELDS}
+        self._documents = {}
+        self._texts = {}
+        self._lock = threading.RLock()
+
+    def build(self, rows):
+        """Indexes (id, question, answer) rows, replacing the current content"""
+        with self._lock:
+            self._postings = {field: defaultdict(set) for field in self.FIELDS}
+            self._tokens = {field: [] for field in self.FIELDS}
+            self._documents = {}
+            self._texts = {}
+
+            for question_id, question, answer in rows:
+                document = {'question': set(tokenize(question)), 'answer': set(tokenize(answer))}
+                self._documents[question_id] = document
+                self._texts[question_id] = {'question': question, 'answer': answer}
+                for field in self.FIELDS:
+                    for token in document[field]:
+                        self._postings[field][token].add(question_id)
+
+            for field in self.FIELDS:
+                self._tokens[field] = sorted(self._postings[field])
+
+            self.ready = True
+
+    def build_once(self, load_rows):
+        """Builds the index from load_rows() unless another thread already did"""
+        with self._lock:
+            if not self.ready:
+                self.build(load_rows())
+
+    def expire(self):
+        """Rebuilds the index on its next use"""
+        self.ready = False
+
+    def add(self, question_id, question, answer):
+        with self._lock:
+            self.remove(question_id)
+            document = {'question': set(tokenize(question)), 'answer': set(tokenize(answer))}
+            self._documents[question_id] = document
+            self._texts[question_id] = {'question': question, 'answer': answer}
+
+            for field in self.FIELDS:
+                for token in document[field]:
+                    postings = self._postings[field]
+                    if token not in postings:
+                        bisect.insort(self._tokens[field], token)
+                    postings[token].add(question_id)
+
+    def remove(self, question_id):
+        with self._lock:
+            document = self._documents.pop(question_id, None)
+            self._texts.pop(question_id, None)
+
+            if document is None:
+                return
+
+            for field in self.FIELDS:
+                for token in document[field]:
+                    postings = self._postings[field]
+                    postings[token].discard(question_id)
+                    if not postings[token]:
+                        del postings[token]
+                        tokens = self._tokens[field]
+                        del tokens[bisect.bisect_left(tokens, token)]
+
+    def _prefix_matches(self, field, prefix):
+        """Returns {id: score} for the ids having a token starting with prefix"""
+        matches = {}
+        tokens = self._tokens[field]
+        position = bisect.bisect_left(tokens, prefix)
+
+        while position < len(tokens) and tokens[position].startswith(prefix):
+            token = tokens[position]
+            score = 2 if token == prefix else 1
+            for question_id in self._postings[field][token]:
+                if matches.get(question_id, 0) < score:
+                    matches[question_id] = score
+            position += 1
+
+        return matches
+
+    def search(self, term, include_answers=False):
+        """Returns the ids matching every token of term, best matches first"""
+        fields = self.FIELDS if include_answers else ('question',)
+        scores = None
+
+        with self._lock:
+            for prefix in set(tokenize(term)):
+                token_scores = {}
+                for field in fields:
+                    weight = self.FIELD_WEIGHTS[field]
+                    for question_id, score in self._prefix_matches(field, prefix).items():
+                        token_scores[question_id] = max(token_scores.get(question_id, 0), score * weight)
+
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {
+                        question_id: score + token_scores[question_id]
+                        for question_id, score in scores.items()
+                        if question_id in token_scores
+                        }
+
+                if not scores:
+                    return []
+
+        return sorted(scores, key=lambda question_id: (-scores[question_id], question_id))
+
+    def complete(self, term, limit=AUTOCOMPLETE_LIMIT, include_answers=False):
+        """Returns at most limit (id, field, text) completions of term, the last word being a prefix.
+
+        The tokens starting with the last word are walked in order from the
+        binary search position and the walk stops at limit matches, so the
+        cost depends on limit rather than on the number of questions. The
+        previous words only narrow the matches down. Questions match before
+        answers, then in the alphabetical order of the matching tokens, which
+        puts a whole word before the longer words it is a prefix of.
+        """
+        tokens = tokenize(term)
+
+        if not tokens:
+            return []
+
+        fields = self.FIELDS if include_answers else ('question',)
+        completions = []
+        seen = set()
+
+        with self._lock:
+            candidates = None
+
+            for word in set(tokens[:-1]):
+                matches = set()
+                for field in fields:
+                    matches.update(self._prefix_matches(field, word))
+                candidates = matches if candidates is None else candidates & matches
+                if not candidates:
+                    return []
+
+            prefix = tokens[-1]
+
+            for field in fields:
+                field_tokens = self._tokens[field]
+                position = bisect.bisect_left(field_tokens, prefix)
+
+                while position < len(field_tokens) and field_tokens[position].startswith(prefix) and len(completions) < limit:
+                    for question_id in self._postings[field][field_tokens[position]]:
+                        if question_id not in seen and (candidates is None or question_id in candidates):
+                            seen.add(question_id)
+                            completions.append((question_id, field, self._texts[question_id][field]))
+                            if len(completions) == limit:
+                                break
+                    position += 1
+
+        return completions
+
+
+def init_search(app):
+    """Configures the search backend of the app"""
+    app.config.setdefault('SEARCH_BACKEND', SEARCH_BACKEND)
+
+    # The GIN indexes of PostgreSQL are created by migration 0003.
+    if is_postgres_search(app):
+        app.extensions[SEARCH_INDEX] = None
+    else:
+        index = InvertedIndex()
+        app.extensions[SEARCH_INDEX] = index
+        on_questions_changed(app, lambda action, rows: update_search_index(index, action, rows))
+
+    # The autocomplete shares the index of the in-memory search.
+    if app.extensions[SEARCH_INDEX] is None:
+        index = InvertedIndex()
+        on_questions_changed(app, lambda action, rows: update_search_index(index, action, rows))
+
+    # Both indexes are expired whenever the data version moves, see init_data_version.
+    app.extensions[AUTOCOMPLETE_INDEX] = index
+    on_remote_questions_changed(app, index.expire)
+
+def is_postgres_search(app):
+    backend = app.config.get('SEARCH_BACKEND', SEARCH_BACKEND)
+
+    if backend == 'auto':
+        return db.get_engine(app).dialect.name == 'postgresql'
+    else:
+        return backend == 'postgres'
+
+def update_search_index(index, action, rows):
+    """Keeps the in-memory index in sync with the question writes"""
+    if not index.ready:
+        return
+
+    for row in rows:
+        if action == 'delete':
+            index.remove(row['id'])
+        else:
+            index.add(row['id'], row.get('question'), row.get('answer'))
+
+def load_index_rows():
+    return db.session.query(Question.id, Question.question, Question.answer).yield_per(1000)
+
+def get_search_index():
+    """Returns the in-memory index of the app, building it on first use or once expired.
+
+    None is returned when the app searches with PostgreSQL.
+    """
+    index = current_app.extensions[SEARCH_INDEX]
+
+    if index is not None and not index.ready:
+        with primary_reads():
+            index.build_once(load_index_rows)
+
+    return index
+
+def get_autocomplete_index():
+    """Returns the in-memory index of the autocomplete, building it on first use or once expired.
+
+    Like the category decks, the index follows the data version of the
+    primary, so it is loaded from the primary.
+    """
+    index = current_app.extensions[AUTOCOMPLETE_INDEX]
+
+    if not index.ready:
+        with primary_reads():
+            index.build_once(load_index_rows)
+
+    return index
+
+def autocomplete_questions(term, limit=AUTOCOMPLETE_LIMIT, include_answers=False):
+    """Returns the suggestions of term as dicts of the question id, the matched field and a snippet"""
+    prefix = (tokenize(term) or [''])[-1]
+
+    return [
+        {'id': question_id, 'field': field, 'snippet': snippet(text, prefix)}
+        for question_id, field, text in get_autocomplete_index().complete(term, limit, include_answers)
+        ]
+
+def snippet(text, prefix, length=SNIPPET_LENGTH):
+    """Returns at most length characters of text around the first word starting with prefix"""
+    text = text or ''
+
+    if len(text) <= length:
+        return text
+
+    match = re.search(r'\b' + re.escape(prefix), text, re.IGNORECASE) if prefix else None
+    start = max(0, min(match.start() - length // 4, len(text) - length)) if match else 0
+    end = start + length
+
+    return ('…' if start else '') + text[start:end].strip() + ('…' if end < len(text) else '')
+
+class SearchResults:
+    """Ids of the questions matching a search, paged like CategoryDecks.
+
+    The ids are ranked by the in-memory index, so a page only reads its own
+    rows and the total is the number of ids rather than a COUNT query.
+    """
+
+    def __init__(self, question_ids):
+        self.question_ids = question_ids
+        self._sorted_ids = None
+
+    def page(self, category_id, offset, limit):
+        """Returns the ids of a page, best matches first, and the number of matches"""
+        return self.question_ids[offset:offset + limit], len(self.question_ids)
+
+    def after(self, category_id, after_id, limit):
+        """Returns at most limit ids greater than after_id and the number of matches"""
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.question_ids)
+
+        position = bisect.bisect_right(self._sorted_ids, after_id)
+        return self._sorted_ids[position:position + limit], len(self._sorted_ids)
+
+
+def search_results(term, include_answers=False):
+    """Returns the SearchResults of term from the in-memory index.
+
+    None is returned when the app searches with PostgreSQL, or when term
+    has no word and every question matches.
+    """
+    index = get_search_index()
+
+    if index is None or not tokenize(term):
+        return None
+
+    return SearchResults(index.search(term, include_answers))
+
+def search_questions_query(term, include_answers=False, ranked=True):
+    """Returns a query of the questions matching every word of term as a prefix, with PostgreSQL.
+
+    When ranked is False the questions are ordered by id, which is what the
+    cursor pagination expects. Without words every question matches.
+    """
+    tokens = tokenize(term)
+
+    if not tokens:
+        return Question.query.order_by(Question.id)
+
+    return postgres_search_query(tokens, include_answers, ranked)
+
+def postgres_search_clauses(tokens, include_answers):
+    """Returns the match condition and the rank of the GIN indexed tsvector against a prefix tsquery"""
+    # The constants are rendered inline so that the expression matches the
+    # one of the index even when the statement is prepared server side. The
+    # simple configuration keeps the stop words, like the in-memory index.
+    empty = literal_column("''")
+    simple = literal_column("'simple'")
+
+    if include_answers:
+        document = func.coalesce(Question.question, empty) + literal_column("' '") + func.coalesce(Question.answer, empty)
+    else:
+        document = func.coalesce(Question.question, empty)
+
+    vector = func.to_tsvector(simple, document)
+    tsquery = func.to_tsquery(simple, ' & '.join('{}:*'.format(token) for token in tokens))
+
+    return vector.op('@@')(tsquery), func.ts_rank(vector, tsquery)
+
+def postgres_search_query(tokens, include_answers, ranked):
+    match, rank = postgres_search_clauses(tokens, include_answers)
+
+    query = Question.query.filter(match)
+
+    if ranked:
+        return query.order_by(rank.desc(), Question.id)
+    else:
+        return query.order_by(Question.id)
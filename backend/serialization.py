@@ -0,0 +1,79 @@
+"""Fast JSON encoding of the question lists, byte for byte identical to jsonify"""
+import json
+from flask import current_app, jsonify
+from models import Question
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+RESPONSE_FORMATS = ('objects', 'columns')
+
+
+def parse_fields(value):
+    """Parses a comma separated list of question fields, raising ValueError for an unknown one"""
+    if not value:
+        return QUESTION_FIELDS
+
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',')))
+
+    if any(field not in QUESTION_FIELDS for field in fields):
+        raise ValueError('unknown field in {}'.format(value))
+
+    return fields
+
+def selected_fields(fields):
+    """Returns the columns read for fields, the id always being the first one"""
+    return ('id',) + tuple(field for field in fields if field != 'id')
+
+def question_rows(query, fields=QUESTION_FIELDS):
+    """Selects only the question columns of query, as plain tuples without ORM instances"""
+    return query.with_entities(*(getattr(Question, field) for field in selected_fields(fields)))
+
+def format_question_rows(rows, format='objects', fields=QUESTION_FIELDS):
+    """Returns the rows as a list of question objects, or as columns and rows when format is 'columns'.
+
+    rows hold the selected_fields(fields) columns, the id is left out when it
+    was not requested.
+    """
+    selected = selected_fields(fields)
+
+    if 'id' not in fields:
+        rows = [row[1:] for row in rows]
+        selected = selected[1:]
+
+    if format == 'columns':
+        return {'columns': list(selected), 'rows': [list(row) for row in rows]}
+    else:
+        return [dict(zip(selected, row)) for row in rows]
+
+def dumps_json(payload, as_ascii=True):
+    """Encodes payload like jsonify outside of debug mode: sorted keys, compact separators and a final newline.
+
+    orjson is used when installed. It writes UTF-8 and a raw DEL character
+    where the standard encoder escapes them, so those rare bodies are encoded
+    again with the standard encoder when ASCII output is required.
+    """
+    if orjson is not None:
+        try:
+            body = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            body = None
+
+        if body is not None and (not as_ascii or (body.isascii() and b'\x7f' not in body)):
+            return body
+
+    return (json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=as_ascii) + '\n').encode('utf-8')
+
+def json_response(payload):
+    """Returns payload as a JSON response with the same body as jsonify(payload)"""
+    config = current_app.config
+
+    # Pretty printed output stays with jsonify.
+    if config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug or not config['JSON_SORT_KEYS']:
+        return jsonify(payload)
+
+    return current_app.response_class(dumps_json(payload, config['JSON_AS_ASCII']), mimetype=config['JSONIFY_MIMETYPE'])
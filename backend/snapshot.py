@@ -0,0 +1,179 @@
+"""Read-only local snapshot of the questions and categories in a SQLite file"""
+import os
+import threading
+import time
+from flask import g
+from sqlalchemy import create_engine, event
+from models import SNAPSHOT_BIND, db, is_read_only_request, on_questions_changed
+
+SNAPSHOT_PATH = os.environ.get('TRIVIA_SNAPSHOT_PATH')
+SNAPSHOT_MAX_AGE = float(os.environ.get('TRIVIA_SNAPSHOT_MAX_AGE', 300))
+SNAPSHOT_REBUILD_DELAY = float(os.environ.get('TRIVIA_SNAPSHOT_REBUILD_DELAY', 1))
+SNAPSHOT_MMAP_SIZE = int(os.environ.get('TRIVIA_SNAPSHOT_MMAP_SIZE', 256 * 1024 * 1024))
+
+SNAPSHOT = 'trivia_snapshot'
+
+SNAPSHOT_TABLES = ('categories', 'questions', 'data_versions')
+
+SNAPSHOT_CHUNK_SIZE = 10000
+
+
+def build_snapshot(app, path, chunk_size=SNAPSHOT_CHUNK_SIZE):
+    """Copies the snapshot tables of the primary database to a SQLite file at path.
+
+    The copy is written next to path and renamed over it once complete, so
+    readers either open the previous snapshot or the new one. Returns the
+    number of rows copied per table.
+    """
+    tables = [db.Model.metadata.tables[name] for name in SNAPSHOT_TABLES]
+    building_path = '{}.{}.tmp'.format(path, os.getpid())
+    counts = {}
+
+    if os.path.exists(building_path):
+        os.remove(building_path)
+
+    target = create_engine('sqlite:///' + building_path)
+
+    try:
+        with target.begin() as connection:
+            connection.execute('PRAGMA journal_mode = OFF')
+            connection.execute('PRAGMA synchronous = OFF')
+            db.Model.metadata.create_all(connection, tables=tables)
+
+            with db.get_engine(app).connect() as source:
+                for table in tables:
+                    result = source.execution_options(stream_results=True).execute(table.select().order_by(*table.primary_key))
+                    counts[table.name] = 0
+
+                    while True:
+                        rows = result.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        connection.execute(table.insert(), [dict(row) for row in rows])
+                        counts[table.name] += len(rows)
+    except Exception:
+        target.dispose()
+        os.remove(building_path)
+        raise
+
+    target.dispose()
+    os.replace(building_path, path)
+
+    return counts
+
+
+class Snapshot:
+    """SQLite snapshot file of a node, rebuilt after the writes of the process and every max_age seconds.
+
+    Rebuilds run on a background thread rebuild_delay seconds after they
+    are requested, so a burst of writes costs a single copy. The file is
+    only replaced once complete and every snapshot connection opens the
+    current file, so readers never wait for a rebuild.
+    """
+
+    def __init__(self, app, path, max_age=SNAPSHOT_MAX_AGE, rebuild_delay=SNAPSHOT_REBUILD_DELAY):
+        self.app = app
+        self.path = os.path.abspath(path)
+        self.max_age = max_age
+        self.rebuild_delay = rebuild_delay
+        self.rebuilds = 0
+        self.counts = None
+        self._timer = None
+        self._forced = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return os.path.exists(self.path)
+
+    def age(self):
+        """Returns the seconds since the snapshot file was written, None without snapshot"""
+        try:
+            return time.time() - os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def is_stale(self):
+        age = self.age()
+        return age is None or age > self.max_age
+
+    def build(self):
+        self.counts = build_snapshot(self.app, self.path)
+        self.rebuilds += 1
+        return self.counts
+
+    def request_rebuild(self, force=False):
+        """Schedules a rebuild, unless one is already scheduled.
+
+        A rebuild which is not forced is skipped when another process of
+        the node replaced the file in the meantime.
+        """
+        with self._lock:
+            self._forced = self._forced or force
+
+            if self._timer is None:
+                self._timer = threading.Timer(self.rebuild_delay, self._rebuild)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _rebuild(self):
+        with self._lock:
+            forced, self._forced, self._timer = self._forced, False, None
+
+        try:
+            if forced or self.is_stale():
+                self.build()
+        except Exception as e:
+            print(f"🧨 snapshot rebuild error: {e}")
+
+    def stats(self):
+        age = self.age()
+        return {
+            'age': round(age, 3) if age is not None else None,
+            'questions': self.counts.get('questions') if self.counts else None,
+            'rebuilds': self.rebuilds,
+            }
+
+
+def configure_snapshot_connection(dbapi_connection, connection_record, mmap_size):
+    """Reads the snapshot through a memory map and refuses any write to it"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA query_only = ON')
+    cursor.execute('PRAGMA mmap_size = {}'.format(int(mmap_size)))
+    cursor.close()
+
+def init_snapshot(app):
+    """Serves the reads of read-only requests from the snapshot at SNAPSHOT_PATH, when it is set"""
+    app.config.setdefault('SNAPSHOT_PATH', SNAPSHOT_PATH)
+    app.config.setdefault('SNAPSHOT_MAX_AGE', SNAPSHOT_MAX_AGE)
+    app.config.setdefault('SNAPSHOT_REBUILD_DELAY', SNAPSHOT_REBUILD_DELAY)
+    app.config.setdefault('SNAPSHOT_MMAP_SIZE', SNAPSHOT_MMAP_SIZE)
+
+    if not app.config['SNAPSHOT_PATH']:
+        app.extensions[SNAPSHOT] = None
+        return
+
+    snapshot = Snapshot(app, app.config['SNAPSHOT_PATH'], app.config['SNAPSHOT_MAX_AGE'], app.config['SNAPSHOT_REBUILD_DELAY'])
+    app.extensions[SNAPSHOT] = snapshot
+
+    # SQLite files get a NullPool, so every checkout opens the current file.
+    binds = app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds[SNAPSHOT_BIND] = 'sqlite:///' + snapshot.path
+    event.listen(
+        db.get_engine(app, bind=SNAPSHOT_BIND), 'connect',
+        lambda dbapi_connection, connection_record: configure_snapshot_connection(dbapi_connection, connection_record, app.config['SNAPSHOT_MMAP_SIZE'])
+        )
+
+    on_questions_changed(app, lambda action, rows: snapshot.request_rebuild(force=True))
+
+    @app.before_request
+    def route_reads_to_snapshot():
+        if not is_read_only_request():
+            return
+
+        if snapshot.is_stale():
+            snapshot.request_rebuild()
+
+        # Until the first snapshot is built the reads stay on the primary.
+        if snapshot.ready:
+            g.trivia_read_bind = SNAPSHOT_BIND
@@ -0,0 +1,338 @@
+"""Tests running the same API scenarios against the WSGI and the ASGI apps"""
+import asyncio
+import json
+import unittest
+from asgi import create_asgi_app
+from flaskr import create_app
+from fixtures import TransactionalTestCase, get_test_database_uri
+
+
+class AsgiResponse:
+    """The parts of a flask test response used by the tests"""
+
+    def __init__(self, messages):
+        start = messages[0]
+        self.status_code = start['status']
+        self.headers = { name.decode(): value.decode() for name, value in start['headers'] }
+        self.data = b''.join(message.get('body', b'') for message in messages[1:])
+
+    def get_json(self):
+        return json.loads(self.data.decode())
+
+
+class AsgiTestClient:
+    """Drives an ASGI app on an event loop with the interface of the flask test client"""
+
+    def __init__(self, app, loop):
+        self.app = app
+        self.loop = loop
+
+    def open(self, method, path, data=None, content_type=None):
+        path, _, query_string = path.partition('?')
+        headers = [(b'content-type', content_type.encode())] if content_type else []
+        body = data.encode() if isinstance(data, str) else (data or b'')
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query_string.encode(),
+            'headers': headers,
+            }
+        self.loop.run_until_complete(self.app(scope, receive, send))
+
+        return AsgiResponse(messages)
+
+    def get(self, path, **kwargs):
+        return self.open('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open('POST', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open('DELETE', path, **kwargs)
+
+
+class TriviaApiTests:
+    """Scenarios of test_flaskr.py written to leave the database as they found it"""
+
+    def test_get_categories_success(self):
+        """Test get categories success"""
+        res = self.client().get('/categories')
+
+        self.assertEqual(200, res.status_code)
+        self.assert_categories_equal(res.get_json())
+        self.assertTrue(res.get_json().get('success'))
+
+    def test_get_questions_success(self):
+        """Test get questions success"""
+        res = self.client().get('/questions?page=1')
+
+        self.assertEqual(200, res.status_code)
+        json = res.get_json()
+
+        self.assertTrue(json.get('success'))
+        self.assert_categories_equal(json)
+        self.assertEqual(10, len(json.get('questions')))
+        self.assertEqual(0, json.get('current_category'))
+
+    def test_get_questions_404_due_to_page_100_not_found(self):
+        """Test get questions 404 due to page 100 not found"""
+        self.assert_404_true(self.client().get('/questions?page=100'))
+
+    def test_get_questions_columns_format(self):
+        """Test get questions by category in the compact columns format"""
+        res = self.client().get('/categories/6/questions?format=columns')
+
+        self.assertEqual(200, res.status_code)
+        questions = res.get_json().get('questions')
+
+        self.assertEqual(['id', 'question', 'answer', 'category', 'difficulty'], questions['columns'])
+        self.assertEqual([10, 11], [row[0] for row in questions['rows']])
+        self.assertEqual([6, 6], [row[3] for row in questions['rows']])
+
+    def test_get_questions_selected_fields_without_categories(self):
+        """Test get questions with the selected fields only and without the categories"""
+        res = self.client().get('/questions?fields=question,category&include_categories=false')
+
+        self.assertEqual(200, res.status_code)
+        json = res.get_json()
+
+        self.assertNotIn('categories', json)
+        self.assertEqual(19, json['total_questions'])
+        self.assertEqual({'question', 'category'}, set(json['questions'][0]))
+
+    def test_get_questions_400_due_to_unknown_field(self):
+        """Test get questions 400 due to unknown field"""
+        self.assert_400_true(self.client().get('/questions?fields=id,secret'))
+
+    def test_get_questions_400_due_to_unknown_format(self):
+        """Test get questions 400 due to unknown format"""
+        self.assert_400_true(self.client().get('/questions?format=xml'))
+
+    def test_get_questions_after_id(self):
+        """Test get questions after an id returns the next questions with a cursor"""
+        res_json = self.client().get('/questions?after_id=15').get_json()
+
+        self.assertEqual([16, 17, 18, 19, 20, 21, 22, 23], [question['id'] for question in res_json['questions']])
+        self.assertIsNone(res_json['next_cursor'])
+
+    def test_get_questions_by_category_success(self):
+        """Test get questions by category success"""
+        res = self.client().get('/categories/6/questions')
+
+        self.assertEqual(200, res.status_code)
+        json = res.get_json()
+
+        self.assertTrue(json.get('success'))
+        self.assert_categories_equal(json)
+        self.assertEqual([10, 11], [question['id'] for question in json.get('questions')])
+        self.assertEqual(2, json.get('total_questions'))
+        self.assertEqual(6, json.get('current_category'))
+
+    def test_get_questions_by_category_400_due_to_non_existing_category(self):
+        """Test get questions by category 400 due to non existing category"""
+        self.assert_400_true(self.client().get('/categories/20/questions'))
+
+    def test_search_questions_success(self):
+        """Test search questions success"""
+        res = self.client().post('/questions', data='{"searchTerm": "tom"}', content_type='application/json')
+
+        self.assertEqual(200, res.status_code)
+        json = res.get_json()
+
+        self.assertTrue(json.get('success'))
+        self.assert_categories_equal(json)
+        self.assertEqual([2], [question['id'] for question in json.get('questions')])
+        self.assertEqual(1, json.get('total_questions'))
+        self.assertEqual(0, json.get('current_category'))
+
+    def test_search_questions_400_missing_content_type_application_json(self):
+        """Test search questions 400 missing content type application json"""
+        self.assert_400_true(self.client().post('/questions', data='{"searchTerm": "tom"}'))
+
+    def test_search_questions_404_questions_not_found_for_given_search_term(self):
+        """Test search questions 404 questions not found for given search term"""
+        res = self.client().post('/questions', data='{"searchTerm": "noSearchTermMatches"}', content_type='application/json')
+        self.assert_404_true(res)
+
+    def test_add_and_delete_question_success(self):
+        """Test add question success, then delete it"""
+        data = '{"question": "Which mode answers this Qwzxv question?", "answer": "Both", "difficulty": "3", "category": "2"}'
+        res = self.client().post('/questions', data=data, content_type='application/json')
+
+        self.assertEqual(200, res.status_code)
+        self.assertTrue(res.get_json().get('success'))
+
+        res = self.client().post('/questions', data='{"searchTerm": "qwzxv"}', content_type='application/json')
+        question = res.get_json()['questions'][0]
+
+        self.assertEqual('Both', question['answer'])
+
+        res = self.client().delete('/questions/{}'.format(question['id']))
+
+        self.assertEqual(200, res.status_code)
+        self.assertTrue(res.get_json().get('success'))
+        self.assert_404_true(self.client().delete('/questions/{}'.format(question['id'])))
+        self.assert_404_true(self.client().post('/questions', data='{"searchTerm": "qwzxv"}', content_type='application/json'))
+
+    def test_add_question_422_difficult_or_category_are_not_int(self):
+        """Test add question 422 difficulty or category are not int"""
+        data = '{"question": "Test question?", "answer": "Test", "difficulty": "3", "category": "notInt"}'
+        self.assert_422_true(self.client().post('/questions', data=data, content_type='application/json'))
+
+        data = '{"question": "Test question?", "answer": "Test", "difficulty": "notInt", "category": "2"}'
+        self.assert_422_true(self.client().post('/questions', data=data, content_type='application/json'))
+
+    def test_delete_question_404_not_found_for_id(self):
+        """Test delete question 404 not found for id"""
+        self.assert_404_true(self.client().delete('/questions/999999'))
+
+    def test_post_quizzes_success(self):
+        """Test post quizzes success"""
+        data = json.dumps({"previous_questions": [13], "quiz_category": {"id": 3}})
+        res = self.client().post('/quizzes', data=data, content_type='application/json')
+
+        self.assertEqual(200, res.status_code)
+        json_response = res.get_json()
+
+        self.assertTrue(json_response['success'])
+        self.assertEqual([13], json_response['previousQuestions'])
+        self.assertIn(json_response['question']['id'], [14, 15])
+        self.assertEqual(3, json_response['question']['category'])
+
+    def test_post_quizzes_sport_category_returns_no_question_after_answer_all_questions(self):
+        """Test post quizzes sport category returns no question after answer all questions"""
+        data = json.dumps({"previous_questions": [10, 11], "quiz_category": {"id": 6}})
+        res = self.client().post('/quizzes', data=data, content_type='application/json')
+
+        self.assertEqual(200, res.status_code)
+        self.assertIsNone(res.get_json()['question'])
+
+    def test_post_quizzes_round_of_distinct_questions(self):
+        """Test post quizzes with a count returns that many distinct questions"""
+        data = json.dumps({"previous_questions": [], "quiz_category": {"id": 0}, "count": 5})
+        res_json = self.client().post('/quizzes', data=data, content_type='application/json').get_json()
+        question_ids = [question['id'] for question in res_json['questions']]
+
+        self.assertTrue(res_json['success'])
+        self.assertEqual(5, len(set(question_ids)))
+        self.assertEqual(question_ids[0], res_json['question']['id'])
+
+    def test_post_quizzes_round_respects_category_and_previous_questions(self):
+        """Test post quizzes with a count larger than the eligible questions returns all of them"""
+        data = json.dumps({"previous_questions": [10], "quiz_category": {"id": 6}, "count": 10})
+        res_json = self.client().post('/quizzes', data=data, content_type='application/json').get_json()
+
+        self.assertEqual([11], [question['id'] for question in res_json['questions']])
+
+    def test_post_quizzes_422_invalid_count(self):
+        """Test post quizzes 422 when the count is not a positive integer"""
+        for count in (0, "3", 1000):
+            data = json.dumps({"previous_questions": [], "quiz_category": {"id": 0}, "count": count})
+            self.assert_422_true(self.client().post('/quizzes', data=data, content_type='application/json'))
+
+    def test_post_quizzes__400_missing_content_type_application_json(self):
+        """Test post quizzes 400 missing content type application json"""
+        res = self.client().post('/quizzes', data='{"previous_questions": [1, 2, 3], "quiz_category": {"id": 1}}')
+        self.assert_400_true(res)
+
+    def test_post_quizzes_422_malformed_json(self):
+        """Test post quizzes 422 malformed json"""
+        res = self.client().post('/quizzes', data='{"malformed": "json"}', content_type='application/json')
+        self.assert_422_true(res)
+
+    def test_post_quizzes__422_missing_previous_questions(self):
+        """Test post quizzes 422 missing previous questions"""
+        res = self.client().post('/quizzes', data='{"quiz_category": {"id": 1}}', content_type='application/json')
+        self.assert_422_true(res)
+
+    def assert_categories_equal(self, res_json):
+        """Assert all categories are in the json response."""
+        expected_categories = {
+            "1": "Science",
+            "2": "Art",
+            "3": "Geography",
+            "4": "History",
+            "5": "Entertainment",
+            "6": "Sports"
+            }
+
+        self.assertEqual(expected_categories, res_json.get('categories'))
+
+    def assert_error_true(self, res, status, message):
+        self.assertEqual(status, res.status_code)
+        res_json = res.get_json()
+        self.assertFalse(res_json.get('success'))
+        self.assertEqual(message, res_json.get('message'))
+
+    def assert_404_true(self, res):
+        self.assert_error_true(res, 404, 'Not found')
+
+    def assert_400_true(self, res):
+        self.assert_error_true(res, 400, 'Bad request')
+
+    def assert_422_true(self, res):
+        self.assert_error_true(res, 422, 'Unprocessable Content')
+
+
+class WsgiTriviaTestCase(TriviaApiTests, TransactionalTestCase):
+    """Runs the scenarios against the flask app"""
+
+    def setUp(self):
+        TransactionalTestCase.setUp(self)
+        self.app = create_app({"SQLALCHEMY_DATABASE_URI": self.database_path})
+        self.client = self.app.test_client
+
+
+class AsgiTriviaTestCase(TriviaApiTests, unittest.TestCase):
+    """Runs the scenarios against the ASGI app"""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.app = create_asgi_app({"SQLALCHEMY_DATABASE_URI": get_test_database_uri()})
+        self.loop.run_until_complete(self.app.startup())
+        self.client = lambda: AsgiTestClient(self.app, self.loop)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.app.shutdown())
+        self.loop.close()
+
+    def test_random_question_is_uniform(self):
+        """Test the random question is uniform over the eligible questions of a sparse category"""
+        draws = [self.loop.run_until_complete(self.app.random_question_or_none([], 6))['id'] for _ in range(300)]
+
+        self.assertGreater(draws.count(10), 100)
+        self.assertGreater(draws.count(11), 100)
+
+    def test_responses_are_byte_compatible_with_flask(self):
+        """Test the ASGI responses have the same bytes as the flask ones"""
+        flask_client = create_app({"SQLALCHEMY_DATABASE_URI": get_test_database_uri()}).test_client()
+
+        paths = [
+            '/categories', '/questions?page=2', '/categories/3/questions', '/questions?page=100', '/questions?page=0',
+            '/questions?after_id=15', '/questions?cursor=MTU&limit=3&include_total=true', '/categories/3/questions?after_id=13',
+            '/questions?cursor=!', '/questions?after_id=0&limit=500',
+            ]
+
+        for path in paths:
+            self.assertEqual(flask_client.get(path).data, self.client().get(path).data, path)
+
+        for path, data in [('/questions?page=2', '{"searchTerm": "w"}'), ('/questions?after_id=10&limit=2', '{"searchTerm": "w"}')]:
+            self.assertEqual(
+                flask_client.post(path, data=data, content_type='application/json').data,
+                self.client().post(path, data=data, content_type='application/json').data,
+                path,
+                )
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
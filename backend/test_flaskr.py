@@ -2,21 +2,27 @@
 import unittest
 import os
 import json
-from models import db, Question
+import gzip
+import io
+import sqlite3
+import tempfile
+from contextlib import redirect_stdout
+from unittest import mock
+from flask import jsonify
+from models import db, Category, Question, TimedQueuePool, get_category_cache, on_questions_changed
+from fixtures import TransactionalTestCase, read_psql
 from flaskr import create_app
+from serialization import json_response
+from request_utils import random_question_or_none
+from category_decks import CategoryDecks
 
 
-database_name = os.environ['TRIVIA_TEST_DB_NAME']
-database_path = os.environ['TRIVIA_TEST_DB_PATH']
-
-
-class TriviaTestCase(unittest.TestCase):
+class TriviaTestCase(TransactionalTestCase):
     """This class represents the trivia test case"""
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.database_name = database_name
-        self.database_path = database_path
+        TransactionalTestCase.setUp(self)
 
         self.app = create_app({
             "SQLALCHEMY_DATABASE_URI": self.database_path
@@ -24,10 +30,6 @@ class TriviaTestCase(unittest.TestCase):
 
         self.client = self.app.test_client
 
-    def tearDown(self):
-        """Executed after reach test"""
-        pass
-
 
     # Write at least one test for each test for successful operation and for expected errors.
     def test_get_categories_success(self):
@@ -40,6 +42,486 @@ class TriviaTestCase(unittest.TestCase):
         self.assert_categories_equal(json)
         self.assertTrue(json.get('success'))
 
+    def test_get_categories_served_from_cache(self):
+        """Test get categories is served from the category cache"""
+        category_cache = get_category_cache(self.app)
+        self.client().get('/categories')
+        hits = category_cache.hits
+        misses = category_cache.misses
+
+        res = self.client().get('/categories')
+
+        self.assertEqual(200, res.status_code)
+        self.assertEqual(hits + 1, category_cache.hits)
+        self.assertEqual(misses, category_cache.misses)
+
+    def test_get_categories_cache_invalidated_on_category_write(self):
+        """Test get categories cache is invalidated when a category is written"""
+        self.client().get('/categories')
+
+        category = Category(type='Music')
+        db.session.add(category)
+        db.session.commit()
+        category_id = str(category.id)
+
+        res_json = self.client().get('/categories').get_json()
+
+        db.session.delete(category)
+        db.session.commit()
+
+        self.assertEqual('Music', res_json['categories'][category_id])
+        self.assertNotIn(category_id, self.client().get('/categories').get_json()['categories'])
+
+    def test_get_categories_cache_is_per_app(self):
+        """Test get categories does not serve the categories cached by another app"""
+        self.client().get('/categories')
+        other = create_app({"SQLALCHEMY_DATABASE_URI": self.database_path})
+
+        other.test_client().get('/categories')
+
+        self.assertIsNot(get_category_cache(self.app), get_category_cache(other))
+        self.assertEqual(1, get_category_cache(self.app).misses)
+        self.assertEqual(1, get_category_cache(other).misses)
+
+    def test_get_questions_304_not_modified_for_current_etag(self):
+        """Test get questions 304 not modified when the client etag is current"""
+        res = self.client().get('/questions?page=2')
+        etag = res.headers['ETag']
+
+        self.assertEqual(200, res.status_code)
+        self.assertIn('max-age', res.headers['Cache-Control'])
+        self.assertIsNotNone(res.headers.get('Last-Modified'))
+
+        res = self.client().get('/questions?page=2', headers={'If-None-Match': etag})
+
+        self.assertEqual(304, res.status_code)
+        self.assertEqual(etag, res.headers['ETag'])
+        self.assertEqual(b'', res.data)
+
+        res = self.client().get('/questions?page=1', headers={'If-None-Match': etag})
+
+        self.assertEqual(200, res.status_code)
+
+    def test_get_questions_etag_changes_after_question_write(self):
+        """Test get questions etag changes after a question is written"""
+        etag = self.client().get('/questions').headers['ETag']
+
+        question = Question(question='Etag question?', answer='Etag', category=1, difficulty=1)
+        question.insert()
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+        question.delete()
+
+        self.assertEqual(200, res.status_code)
+        self.assertNotEqual(etag, res.headers['ETag'])
+
+    def test_get_questions_etag_shared_between_apps(self):
+        """Test get questions etag is the same for two apps on the database and follows writes of either"""
+        other = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path
+        }).test_client
+        res = self.client().get('/questions?page=2')
+        etag = res.headers['ETag']
+
+        self.assertEqual(etag, other().get('/questions?page=2').headers['ETag'])
+        self.assertEqual(304, other().get('/questions?page=2', headers={'If-None-Match': etag}).status_code)
+        self.assertEqual(304, other().get('/questions?page=2', headers={'If-Modified-Since': res.headers['Last-Modified']}).status_code)
+
+        question = Question(question='Shared etag question?', answer='Shared', category=1, difficulty=1)
+        question.insert()
+        res = other().get('/questions?page=2', headers={'If-None-Match': etag})
+        question.delete()
+
+        self.assertEqual(200, res.status_code)
+        self.assertNotEqual(etag, res.headers['ETag'])
+
+    def test_data_version_read_once_per_ttl(self):
+        """Test conditional gets reuse the data version read by the worker until a write of the worker"""
+        etag = self.client().get('/questions').headers['ETag']
+        for _ in range(3):
+            self.assertEqual(304, self.client().get('/questions', headers={'If-None-Match': etag}).status_code)
+        reads = self.client().get('/cache/stats').get_json()['data_version']['reads']
+
+        question = Question(question='Version question?', answer='Version', category=1, difficulty=1)
+        question.insert()
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+        question.delete()
+
+        self.assertEqual(1, reads)
+        self.assertEqual(200, res.status_code)
+
+    def test_get_categories_304_not_modified_since(self):
+        """Test get categories 304 when not modified since the given date"""
+        last_modified = self.client().get('/categories').headers['Last-Modified']
+        res = self.client().get('/categories', headers={'If-Modified-Since': last_modified})
+
+        self.assertEqual(304, res.status_code)
+
+    def test_get_questions_served_from_response_cache(self):
+        """Test get questions page is served from the response cache until a question is written"""
+        first = self.client().get('/questions?page=2')
+        second = self.client().get('/questions?page=2')
+        stats = self.client().get('/cache/stats').get_json()['responses']
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(len(first.data), stats['bytes'])
+
+        question = Question(question='Cached question?', answer='Cached', category=1, difficulty=1)
+        question.insert()
+        third = self.client().get('/questions?page=2').get_json()
+        question.delete()
+
+        self.assertEqual(first.get_json()['total_questions'] + 1, third['total_questions'])
+
+    def test_memory_response_cache_follows_writes_of_other_workers(self):
+        """Test a worker does not serve a body cached before the write of another worker under the new etag"""
+        first_worker = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "DATA_VERSION_TTL": 0
+        }).test_client()
+        second_worker = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path
+        }).test_client()
+
+        before = first_worker.get('/questions?page=2')
+
+        data = '{"question": "Other worker question?", "answer": "Test", "difficulty": "1", "category": "1"}'
+        second_worker.post('/questions', data=data, content_type='application/json')
+        after = first_worker.get('/questions?page=2')
+        stats = first_worker.get('/cache/stats').get_json()['responses']
+
+        self.assertNotEqual(before.headers['ETag'], after.headers['ETag'])
+        self.assertEqual((0, 2), (stats['hits'], stats['misses']))
+
+    def test_search_questions_served_from_response_cache(self):
+        """Test search questions is served from the response cache"""
+        self.client().post('/questions', data='{"searchTerm": "tom"}', content_type='application/json')
+        res = self.client().post('/questions', data='{"searchTerm": "tom"}', content_type='application/json')
+
+        self.assertEqual(200, res.status_code)
+        self.assertEqual(1, len(res.get_json()['questions']))
+        self.assertEqual(1, self.client().get('/cache/stats').get_json()['responses']['hits'])
+
+    def test_shared_response_cache_between_workers(self):
+        """Test two apps sharing a response cache serve each other's bodies and follow each other's writes"""
+        cache_file, cache_path = tempfile.mkstemp(suffix='.db')
+        os.close(cache_file)
+        config = {
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "RESPONSE_CACHE_BACKEND": 'shared',
+            "RESPONSE_CACHE_PATH": cache_path
+        }
+        first_worker = create_app(config).test_client()
+        second_worker = create_app(config).test_client()
+
+        try:
+            total_questions = first_worker.get('/questions?page=2').get_json()['total_questions']
+            second_worker.get('/questions?page=2')
+            first_stats = first_worker.get('/cache/stats').get_json()['responses']
+            second_stats = second_worker.get('/cache/stats').get_json()['responses']
+
+            data = '{"question": "Shared cache question?", "answer": "Test", "difficulty": "1", "category": "1"}'
+            second_worker.post('/questions', data=data, content_type='application/json')
+
+            first_page = first_worker.get('/questions?page=2').get_json()
+            decks = first_worker.get('/cache/stats').get_json()['decks']
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(cache_path + suffix):
+                    os.remove(cache_path + suffix)
+
+        self.assertEqual((0, 1), (first_stats['hits'], first_stats['misses']))
+        self.assertEqual((1, 0), (second_stats['hits'], second_stats['misses']))
+        self.assertEqual(1, first_stats['entries'])
+        self.assertEqual(total_questions + 1, first_page['total_questions'])
+        self.assertEqual(total_questions + 1, decks['questions'])
+
+    def test_shared_response_cache_follows_category_writes_and_database(self):
+        """Test a shared response cache is invalidated by category writes and is namespaced by the database"""
+        config = {
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "RESPONSE_CACHE_BACKEND": 'shared'
+        }
+        first_app = create_app(config)
+        second_worker = create_app(config).test_client()
+        other_database = create_app(dict(config, SQLALCHEMY_DATABASE_URI='sqlite:///other.db'))
+        cache = first_app.extensions['trivia_response_cache']
+        first_worker = first_app.test_client()
+
+        try:
+            first_worker.get('/questions?page=2')
+            generation = cache.generation()
+
+            with first_app.app_context():
+                category = Category(type='Shared cache')
+                db.session.add(category)
+                db.session.commit()
+            second_worker.get('/questions?page=2')
+            stats = second_worker.get('/cache/stats').get_json()['responses']
+
+            with first_app.app_context():
+                db.session.delete(category)
+                db.session.commit()
+            generations = cache.generation() - generation
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(cache.path + suffix):
+                    os.remove(cache.path + suffix)
+
+        self.assertEqual(2, generations)
+        self.assertEqual((0, 1), (stats['hits'], stats['misses']))
+        self.assertNotEqual(cache.path, other_database.extensions['trivia_response_cache'].path)
+
+    def test_get_requests_read_from_replica(self):
+        """Test get requests read from the replica when one is configured"""
+        replica_file, replica_path = tempfile.mkstemp(suffix='.db')
+        os.close(replica_file)
+        replica = sqlite3.connect(replica_path)
+        replica.execute('CREATE TABLE categories (id INTEGER PRIMARY KEY, type TEXT)')
+        replica.execute("INSERT INTO categories (id, type) VALUES (1, 'Replica')")
+        replica.execute('CREATE TABLE data_versions (id INTEGER PRIMARY KEY, version BIGINT, changed_at FLOAT)')
+        replica.execute('INSERT INTO data_versions (id, version, changed_at) VALUES (1, 0, 0)')
+        replica.commit()
+        replica.close()
+
+        try:
+            app = create_app({
+                "SQLALCHEMY_DATABASE_URI": self.database_path,
+                "DB_REPLICA_URI": 'sqlite:///' + replica_path
+            })
+            categories = app.test_client().get('/categories').get_json()['categories']
+            stats = app.test_client().get('/db/stats').get_json()
+            db.get_engine(app, bind='replica').dispose()
+        finally:
+            os.remove(replica_path)
+
+        self.assertEqual({'1': 'Replica'}, categories)
+        self.assertIsNotNone(stats['primary'])
+        self.assertIsNotNone(stats['replica'])
+
+    def test_read_only_requests_served_from_snapshot(self):
+        """Test get requests and quizzes read from the snapshot, while writes go to the primary and request a rebuild"""
+        snapshot_file, snapshot_path = tempfile.mkstemp(suffix='.db')
+        os.close(snapshot_file)
+        os.remove(snapshot_path)
+
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SNAPSHOT_PATH": snapshot_path
+        })
+        snapshot = app.extensions['trivia_snapshot']
+
+        try:
+            with mock.patch.object(snapshot, 'request_rebuild') as request_rebuild:
+                snapshot.build()
+
+                local = sqlite3.connect(snapshot_path)
+                local.execute("UPDATE categories SET type = 'Snapshot' WHERE id = 1")
+                local.execute('DELETE FROM questions WHERE id = 10')
+                local.commit()
+                local.close()
+
+                categories = app.test_client().get('/categories').get_json()['categories']
+                data = json.dumps({"previous_questions": [], "quiz_category": {"id": 6}, "count": 5})
+                quiz = app.test_client().post('/quizzes', data=data, content_type='application/json').get_json()
+                stats = app.test_client().get('/db/stats').get_json()['snapshot']
+
+                request_rebuild.assert_not_called()
+
+                data = '{"question": "Snapshot question?", "answer": "Test", "difficulty": "3", "category": "6"}'
+                self.assertEqual(200, app.test_client().post('/questions', data=data, content_type='application/json').status_code)
+                request_rebuild.assert_called_once_with(force=True)
+
+                # The snapshot is not rebuilt yet, the new question is read from the primary.
+                listing = app.test_client().get('/categories/6/questions').get_json()
+        finally:
+            db.get_engine(app, bind='snapshot').dispose()
+            os.remove(snapshot_path)
+
+        self.assertEqual('Snapshot', categories['1'])
+        self.assertEqual([11], [question['id'] for question in quiz['questions']])
+        self.assertEqual(19, stats['questions'])
+        self.assertEqual(1, stats['rebuilds'])
+        self.assertEqual(['Snapshot question?'], [question['question'] for question in listing['questions'] if question['id'] > 23])
+        self.assertEqual(3, listing['total_questions'])
+
+    def test_build_snapshot_command(self):
+        """Test the build-snapshot command copies the questions and categories to a SQLite file"""
+        snapshot_file, snapshot_path = tempfile.mkstemp(suffix='.db')
+        os.close(snapshot_file)
+
+        try:
+            output = self.app.test_cli_runner().invoke(args=['build-snapshot', snapshot_path]).output
+            local = sqlite3.connect(snapshot_path)
+            counts = [local.execute('SELECT count(*) FROM {}'.format(table)).fetchone()[0] for table in ('categories', 'questions')]
+            local.close()
+        finally:
+            os.remove(snapshot_path)
+
+        self.assertIn('6 categories, 19 questions', output)
+        self.assertEqual([6, 19], counts)
+
+    def test_get_questions_server_timing_header(self):
+        """Test get questions reports its queries and phases in the Server-Timing header"""
+        res = self.client().get('/questions?page=1')
+        server_timing = res.headers['Server-Timing']
+
+        self.assertEqual(200, res.status_code)
+        self.assertRegex(server_timing, r'^db;dur=[0-9.]+;desc="[1-9][0-9]* queries"')
+        for phase in ('paginate', 'format', 'serialize', 'total'):
+            self.assertIn(phase + ';dur=', server_timing)
+
+    def test_get_metrics_counts_requests_and_queries(self):
+        """Test get metrics exposes the request counters in the Prometheus format"""
+        self.client().get('/questions?page=1')
+        self.client().get('/questions?page=100')
+        res = self.client().get('/metrics')
+        metrics = res.get_data(as_text=True)
+
+        self.assertEqual(200, res.status_code)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        self.assertIn('trivia_requests_total{endpoint="/questions",method="GET",status="200"} 1', metrics)
+        self.assertIn('trivia_requests_total{endpoint="/questions",method="GET",status="404"} 1', metrics)
+        self.assertIn('trivia_request_duration_seconds_count{endpoint="/questions"} 2', metrics)
+        self.assertIn('trivia_db_queries_total{endpoint="/questions"}', metrics)
+        self.assertIn('trivia_cache_misses_total{cache="responses"} 2', metrics)
+
+    def test_slow_request_profiled(self):
+        """Test slow requests are logged with their sampled stacks when profiling is enabled"""
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "SLOW_REQUEST_MS": 0.001,
+            "PROFILE_SLOW_REQUESTS": True,
+            "PROFILE_INTERVAL_MS": 0.1,
+            "RESPONSE_CACHE_BACKEND": 'none'
+        })
+        output = io.StringIO()
+
+        with redirect_stdout(output):
+            for _ in range(20):
+                app.test_client().post('/questions', data='{"searchTerm": "a"}', content_type='application/json')
+
+        self.assertIn('🐢 slow request POST /questions', output.getvalue())
+        self.assertIn('app.py:', output.getvalue())
+
+    def test_migrations_convert_string_categories_to_foreign_key(self):
+        """Test the migrations turn string categories into an indexed integer foreign key"""
+        database_file, database_path = tempfile.mkstemp(suffix='.db')
+        os.close(database_file)
+        database = sqlite3.connect(database_path)
+        database.execute('CREATE TABLE categories (id INTEGER PRIMARY KEY, type VARCHAR)')
+        database.execute('CREATE TABLE questions (id INTEGER PRIMARY KEY, question VARCHAR, answer VARCHAR, category VARCHAR, difficulty INTEGER)')
+        database.execute("INSERT INTO categories (id, type) VALUES (1, 'Science')")
+        database.execute("INSERT INTO questions VALUES (1, 'Kept?', 'Kept', '1', 1), (2, 'Orphan?', 'Orphan', '7', 1)")
+        database.commit()
+        database.close()
+
+        try:
+            # The scoped session of the thread may still be bound to the app of another test.
+            db.session.remove()
+            app = create_app({"SQLALCHEMY_DATABASE_URI": 'sqlite:///' + database_path})
+            output = app.test_cli_runner().invoke(args=['migrate-db']).output
+
+            # The app reads the migrated database, not the test transaction.
+            test_session, db.session = db.session, self.session
+            try:
+                questions = app.test_client().get('/categories/1/questions').get_json()['questions']
+            finally:
+                db.session.remove()
+                db.session = test_session
+            db.get_engine(app).dispose()
+
+            database = sqlite3.connect(database_path)
+            categories = database.execute('SELECT id, category, typeof(category) FROM questions ORDER BY id').fetchall()
+            indexes = database.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'questions'").fetchall()
+            database.close()
+        finally:
+            os.remove(database_path)
+
+        self.assertEqual('Database upgraded to head\n', output)
+        self.assertEqual([1], [question['id'] for question in questions])
+        self.assertEqual(1, questions[0]['category'])
+        self.assertEqual([(1, 1, 'integer'), (2, None, 'null')], categories)
+        self.assertIn(('ix_questions_category_id',), indexes)
+
+    def test_create_app_opens_no_database_connection(self):
+        """Test creating the app neither connects nor migrates until the database is used"""
+        db.session.remove()
+        app = create_app({"SQLALCHEMY_DATABASE_URI": 'sqlite:////nonexistent/trivia.db'})
+
+        self.assertIn('/questions', [rule.rule for rule in app.url_map.iter_rules()])
+
+    def test_warm_up_fills_caches_and_pool(self):
+        """Test the warm-up builds the category decks and the search index before the first request"""
+        db.session.remove()
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "WARM_UP": True
+        })
+        decks = app.extensions['trivia_category_decks']
+        index = app.extensions['trivia_search_index']
+        output = app.test_cli_runner().invoke(args=['warm-up']).output
+
+        self.assertTrue(decks.ready)
+        self.assertTrue(index.ready)
+        self.assertEqual(['pool', 'categories', 'decks', 'search', 'autocomplete'], [line.split()[0] for line in output.splitlines()])
+
+    def test_writes_are_rolled_back_after_each_test(self):
+        """Test the questions written by a test are gone for the next one"""
+        total_questions = self.client().get('/questions').get_json()['total_questions']
+        self.client().post('/questions', data='{"question": "Rolled back?", "answer": "Yes", "category": 1, "difficulty": 1}', content_type='application/json')
+        written = self.client().get('/questions').get_json()['total_questions']
+
+        self.tearDown()
+        self.setUp()
+
+        self.assertEqual(total_questions + 1, written)
+        self.assertEqual(total_questions, self.client().get('/questions').get_json()['total_questions'])
+        self.assertEqual(19, len(dict(read_psql())['questions']))
+
+    def test_json_response_byte_compatible_with_jsonify(self):
+        """Test the fast JSON encoding produces the bytes of jsonify"""
+        payload = {
+            'questions': [{'id': 1, 'question': 'Qu\u00e9 \u2603 "quoted" \\ \x7f\x01?', 'answer': None, 'category': 6, 'difficulty': 5}],
+            'categories': {'2': 'Art', '10': 'Sports'},
+            'success': True
+            }
+
+        with self.app.test_request_context():
+            self.assertEqual(jsonify(payload).get_data(), json_response(payload).get_data())
+            self.app.config['JSON_AS_ASCII'] = False
+            self.assertEqual(jsonify(payload).get_data(), json_response(payload).get_data())
+
+    def test_get_questions_gzip_compressed(self):
+        """Test get questions is gzip compressed when accepted and large enough"""
+        plain = self.client().get('/questions?page=1')
+        res = self.client().get('/questions?page=1', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(200, res.status_code)
+        self.assertEqual('gzip', res.headers['Content-Encoding'])
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(plain.data, gzip.decompress(res.data))
+        self.assertLess(len(res.data), len(plain.data))
+
+    def test_get_categories_not_compressed_below_threshold(self):
+        """Test small responses are sent uncompressed"""
+        res = self.client().get('/categories', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(200, res.status_code)
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assert_categories_equal(res.get_json())
+
+    def test_search_questions_cursor_selected_fields(self):
+        """Test search with a cursor returns only the selected fields and a next cursor"""
+        res = self.client().post('/questions?after_id=0&limit=1&fields=answer&include_categories=false', data='{"searchTerm": "wor"}', content_type='application/json')
+        res_json = res.get_json()
+
+        self.assertEqual(200, res.status_code)
+        self.assertEqual([{'answer': 'Brazil'}], res_json['questions'])
+        self.assertIsNotNone(res_json['next_cursor'])
+        self.assertNotIn('categories', res_json)
+
     def test_get_questions_success(self):
         """Test get questions success"""
         res = self.client().get('/questions?page=1')
@@ -57,6 +539,81 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().get('/questions?page=100')
         self.assert_404_true(res)
 
+    def test_get_questions_cursor_pages_follow_each_other(self):
+        """Test get questions cursor pages follow each other"""
+        res = self.client().get('/questions?cursor=&limit=5&include_total=true')
+
+        self.assertEqual(200, res.status_code)
+        first_page = res.get_json()
+
+        self.assertTrue(first_page.get('success'))
+        self.assert_categories_equal(first_page)
+        self.assertEqual(5, len(first_page.get('questions')))
+        self.assertEqual(Question.query.count(), first_page.get('total_questions'))
+        self.assertIsNotNone(first_page.get('next_cursor'))
+
+        res = self.client().get('/questions?cursor={}&limit=5'.format(first_page['next_cursor']))
+
+        self.assertEqual(200, res.status_code)
+        second_page = res.get_json()
+
+        self.assertNotIn('total_questions', second_page)
+        self.assertLess(first_page['questions'][-1]['id'], second_page['questions'][0]['id'])
+
+    def test_get_questions_after_id_returns_last_page_without_cursor(self):
+        """Test get questions after id returns last page without next cursor"""
+        last_id = Question.query.order_by(Question.id.desc()).first().id
+        res = self.client().get('/questions?after_id={}'.format(last_id - 1))
+
+        self.assertEqual(200, res.status_code)
+        json = res.get_json()
+
+        self.assertEqual([last_id], [question['id'] for question in json['questions']])
+        self.assertIsNone(json.get('next_cursor'))
+
+    def test_get_questions_cursor_continues_past_question_deleted_by_another_worker(self):
+        """Test get questions cursor keeps its next cursor when a question of the page was deleted behind the decks"""
+        client = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "DATA_VERSION_TTL": 3600
+        }).test_client()
+        ids = [question['id'] for question in client.get('/questions?after_id=0&limit=3').get_json()['questions']]
+
+        # Deleted without the listeners of the app, like another worker would.
+        db.session.execute(Question.__table__.delete().where(Question.id == ids[1]))
+        res_json = client.get('/questions?after_id=0&limit=2').get_json()
+        db.session.rollback()
+
+        self.assertEqual([ids[0]], [question['id'] for question in res_json['questions']])
+        self.assertIsNotNone(res_json.get('next_cursor'))
+
+    def test_category_decks_follow_writes_of_other_workers(self):
+        """Test the pages and totals of a worker include the questions written by another worker"""
+        first_worker = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "DATA_VERSION_TTL": 0
+        }).test_client()
+        second_worker = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path
+        }).test_client()
+
+        before = first_worker.get('/categories/6/questions').get_json()
+        data = '{"question": "Other worker question?", "answer": "Test", "difficulty": "1", "category": "6"}'
+        second_worker.post('/questions', data=data, content_type='application/json')
+        question_id = Question.query.filter(Question.question == 'Other worker question?').one().id
+        inserted = first_worker.get('/categories/6/questions').get_json()
+        second_worker.delete('/questions/{}'.format(question_id))
+        deleted = first_worker.get('/categories/6/questions').get_json()
+
+        self.assertEqual(before['total_questions'] + 1, inserted['total_questions'])
+        self.assertIn(question_id, [question['id'] for question in inserted['questions']])
+        self.assertEqual(before, deleted)
+
+    def test_get_questions_400_due_to_malformed_cursor(self):
+        """Test get questions 400 due to malformed cursor"""
+        res = self.client().get('/questions?cursor=not-a-cursor')
+        self.assert_400_true(res)
+
     def test_get_questions_by_category_success(self):
         """Test get questions by category success"""
         expected_category_sport=6
@@ -71,6 +628,61 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(2, json.get('total_questions'))
         self.assertEqual(expected_category_sport, json.get('current_category'))
 
+    def test_get_questions_by_category_decks_follow_writes(self):
+        """Test the category decks answer the pages and totals after inserts, updates and deletes"""
+        stats = self.client().get('/cache/stats').get_json()['decks']
+        self.assertEqual(2, stats['categories']['6'])
+
+        question = Question(question='Deck question?', answer='Deck', category=6, difficulty=1)
+        question.insert()
+        question_id = question.id
+        inserted = self.client().get('/categories/6/questions').get_json()
+
+        self.client().patch('/questions', data=json.dumps({"update": [{"id": question_id, "category": 5}]}), content_type='application/json')
+        updated = self.client().get('/categories/6/questions').get_json()
+
+        self.client().delete('/questions/{}'.format(question_id))
+        deleted = self.client().get('/cache/stats').get_json()['decks']
+
+        self.assertEqual([10, 11, question_id], [question['id'] for question in inserted['questions']])
+        self.assertEqual(3, inserted['total_questions'])
+        self.assertEqual(2, updated['total_questions'])
+        self.assertEqual(stats, deleted)
+
+    def test_category_decks_keep_writes_applied_during_a_build(self):
+        """Test the category decks keep serving and keep the writes applied while the rows are loaded"""
+        decks = CategoryDecks()
+        decks.build([(1, 1), (2, 1), (3, 2)])
+
+        def rows():
+            yield 1, 1
+            self.assertEqual([1, 2], decks.ids(1))
+            decks.add(4, 2)
+            decks.remove(1)
+            yield 2, 1
+            yield 3, 2
+
+        decks.build(rows())
+
+        self.assertEqual([2], decks.ids(1))
+        self.assertEqual([3, 4], decks.ids(2))
+        self.assertEqual([2, 3, 4], decks.ids())
+
+    def test_category_decks_random_id_is_uniform(self):
+        """Test the random id of the decks is uniform over the ids which are not excluded"""
+        decks = CategoryDecks()
+        decks.build([(question_id, 1) for question_id in range(1, 11)])
+        drawn = {}
+
+        for _ in range(3000):
+            question_id = decks.random_id(1, {2, 3, 4, 5})
+            drawn[question_id] = drawn.get(question_id, 0) + 1
+
+        self.assertEqual({1, 6, 7, 8, 9, 10}, set(drawn))
+        for count in drawn.values():
+            self.assertGreater(count, 350)
+        self.assertIsNone(decks.random_id(1, set(range(1, 11))))
+
     def test_get_questions_by_category_400_due_to_non_existing_category(self):
         """Test get questions by category 400 due to non existing category"""
         res = self.client().get('/categories/{}/questions'.format(20))
@@ -106,6 +718,79 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(1, json.get('total_questions'))
         self.assertEqual(0, json.get('current_category'))
 
+    def test_search_questions_follows_questions_added_by_another_worker(self):
+        """Test the in-memory search of a worker matches a question added by another worker"""
+        first_worker = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "DATA_VERSION_TTL": 0
+        }).test_client()
+        second_worker = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path
+        }).test_client()
+
+        before = first_worker.post('/questions', data='{"searchTerm": "qxzvy"}', content_type='application/json')
+        data = '{"question": "Which planet is nicknamed the Qxzvy planet?", "answer": "Test", "difficulty": "3", "category": "1"}'
+        second_worker.post('/questions', data=data, content_type='application/json')
+        after = first_worker.post('/questions', data='{"searchTerm": "qxzvy"}', content_type='application/json').get_json()
+
+        self.assertEqual(404, before.status_code)
+        self.assertEqual(1, after['total_questions'])
+        self.assertEqual('Which planet is nicknamed the Qxzvy planet?', after['questions'][0]['question'])
+
+    def test_search_questions_matches_every_word_prefix(self):
+        """Test search questions matches every word of the search term as a prefix"""
+        res = self.client().post('/questions', data='{"searchTerm": "wor"}', content_type='application/json')
+
+        self.assertEqual(200, res.status_code)
+        json = res.get_json()
+
+        self.assertEqual([10, 11, 23], [question['id'] for question in json['questions']])
+
+        res = self.client().post('/questions', data='{"searchTerm": "soccer world cup 1930"}', content_type='application/json')
+
+        self.assertEqual([11], [question['id'] for question in res.get_json()['questions']])
+
+    def test_search_questions_pages_ranked_matches(self):
+        """Test search questions pages the matches of the index with their total"""
+        pages = [
+            self.client().post('/questions?page={}'.format(page), data='{"searchTerm": "w"}', content_type='application/json').get_json()
+            for page in (1, 2)
+            ]
+        first_ids = [question['id'] for question in pages[0]['questions']]
+        second_ids = [question['id'] for question in pages[1]['questions']]
+
+        self.assertEqual(10, len(first_ids))
+        self.assertEqual(pages[0]['total_questions'], pages[1]['total_questions'])
+        self.assertEqual(pages[0]['total_questions'], len(first_ids) + len(second_ids))
+        self.assertFalse(set(first_ids) & set(second_ids))
+
+    def test_search_questions_in_answers(self):
+        """Test search questions in answers when searchAnswers is true"""
+        data = '{"searchTerm": "apollo"}'
+        res = self.client().post('/questions', data=data, content_type='application/json')
+        self.assert_404_true(res)
+
+        data = '{"searchTerm": "apollo", "searchAnswers": true}'
+        res = self.client().post('/questions', data=data, content_type='application/json')
+
+        self.assertEqual(200, res.status_code)
+        self.assertEqual([2], [question['id'] for question in res.get_json()['questions']])
+
+    def test_search_questions_finds_added_question(self):
+        """Test search questions finds a question right after it is added"""
+        self.client().post('/questions', data='{"searchTerm": "tom"}', content_type='application/json')
+
+        data = '{"question": "Which planet is nicknamed the Zyxwv planet?", "answer": "Test", "difficulty": "3", "category": "1"}'
+        self.client().post('/questions', data=data, content_type='application/json')
+
+        res = self.client().post('/questions', data='{"searchTerm": "zyxwv"}', content_type='application/json')
+
+        self.assertEqual(200, res.status_code)
+        question = res.get_json()['questions'][0]
+        Question.query.get(question['id']).delete()
+
+        self.assertEqual('Which planet is nicknamed the Zyxwv planet?', question['question'])
+
     def test_search_questions_400_missing_content_type_application_json(self):
         """Test search questions 400 missing content type application json"""
         res = self.client().post('/questions', data='{"searchTerm": "tom"}')
@@ -121,6 +806,67 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().post('/questions', data='{"malformed": "json"}', content_type='application/json')
         self.assert_422_true(res)
 
+    def test_autocomplete_completes_last_word_as_prefix(self):
+        """Test autocomplete suggests the questions with a word starting with the last word typed"""
+        res = self.client().get('/questions/autocomplete?q=wor')
+
+        self.assertEqual(200, res.status_code)
+        suggestions = res.get_json()['suggestions']
+
+        self.assertEqual({10, 11, 23}, {suggestion['id'] for suggestion in suggestions})
+        self.assertIn('World Cup', suggestions[0]['snippet'])
+
+        res = self.client().get('/questions/autocomplete?q=first%20wor')
+
+        self.assertEqual([11], [suggestion['id'] for suggestion in res.get_json()['suggestions']])
+
+    def test_autocomplete_limit_and_answers(self):
+        """Test autocomplete returns at most limit suggestions and searches the answers when asked"""
+        res = self.client().get('/questions/autocomplete?q=w&limit=2')
+
+        self.assertEqual(2, len(res.get_json()['suggestions']))
+
+        res = self.client().get('/questions/autocomplete?q=apol')
+        self.assertEqual([], res.get_json()['suggestions'])
+
+        res = self.client().get('/questions/autocomplete?q=apol&answers=true')
+        self.assertEqual([{'id': 2, 'field': 'answer', 'snippet': 'Apollo 13'}], res.get_json()['suggestions'])
+
+    def test_autocomplete_follows_questions_deleted_by_another_worker(self):
+        """Test autocomplete stops suggesting a question once another worker deleted it"""
+        first_worker = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "DATA_VERSION_TTL": 0
+        }).test_client()
+        second_worker = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path
+        }).test_client()
+
+        before = first_worker.get('/questions/autocomplete?q=first%20wor').get_json()['suggestions']
+        second_worker.delete('/questions/11')
+        after = first_worker.get('/questions/autocomplete?q=first%20wor').get_json()['suggestions']
+
+        self.assertEqual([11], [suggestion['id'] for suggestion in before])
+        self.assertEqual([], after)
+
+    def test_autocomplete_follows_added_and_deleted_questions(self):
+        """Test autocomplete suggests a question right after it is added and not after it is deleted"""
+        self.client().get('/questions/autocomplete?q=tom')
+
+        data = '{"question": "Which planet is nicknamed the Qxzvy planet?", "answer": "Test", "difficulty": "3", "category": "1"}'
+        self.client().post('/questions', data=data, content_type='application/json')
+
+        suggestions = self.client().get('/questions/autocomplete?q=qxz').get_json()['suggestions']
+        self.assertEqual(['Which planet is nicknamed the Qxzvy planet?'], [suggestion['snippet'] for suggestion in suggestions])
+
+        self.client().delete('/questions/{}'.format(suggestions[0]['id']))
+        self.assertEqual([], self.client().get('/questions/autocomplete?q=qxz').get_json()['suggestions'])
+
+    def test_autocomplete_400_due_to_invalid_limit(self):
+        """Test autocomplete 400 due to a limit out of range"""
+        self.assert_400_true(self.client().get('/questions/autocomplete?q=wor&limit=0'))
+        self.assert_400_true(self.client().get('/questions/autocomplete?q=wor&limit=100'))
+
     def test_add_question_success(self):
         """Test add question success"""
         data = '{"question": "Test question?", "answer": "Test", "difficulty": "3", "category": "2"}'
@@ -140,6 +886,110 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assert_422_true(res)
 
+    def test_import_questions_ndjson_reports_invalid_rows(self):
+        """Test import questions from NDJSON inserts valid rows and reports invalid ones"""
+        data = '\n'.join([
+            '{"question": "Imported question one?", "answer": "One", "difficulty": 1, "category": 1}',
+            '{"question": "", "answer": "Two", "difficulty": 1, "category": 1}',
+            'not json',
+            '{"question": "Imported question two?", "answer": "Two", "difficulty": 2, "category": 2}',
+            ])
+        res = self.client().post('/questions/import?batch_size=1', data=data, content_type='application/x-ndjson')
+
+        imported = Question.query.filter(Question.question.like('Imported question%')).all()
+        for question in imported:
+            question.delete()
+
+        self.assertEqual(200, res.status_code)
+        json = res.get_json()
+
+        self.assertTrue(json['success'])
+        self.assertEqual(2, json['imported'])
+        self.assertEqual(2, json['failed'])
+        self.assertEqual([2, 3], [error['line'] for error in json['errors']])
+        self.assertEqual('question is required', json['errors'][0]['error'])
+        self.assertEqual(2, len(imported))
+
+    def test_import_questions_reports_inserted_rows_with_their_ids(self):
+        """Test import questions tells the question listeners about the inserted rows with their ids"""
+        inserted = []
+        on_questions_changed(self.app, lambda action, rows: inserted.extend(rows))
+        data = '\n'.join(
+            '{{"question": "Batch imported {}?", "answer": "Batch", "difficulty": 1, "category": 1}}'.format(number) for number in range(3)
+            )
+
+        self.client().post('/questions/import', data=data, content_type='application/x-ndjson')
+        imported = Question.query.filter(Question.question.like('Batch imported%')).order_by(Question.id).all()
+
+        self.assertEqual([question.format() for question in imported], inserted)
+
+    def test_import_questions_csv_with_cli(self):
+        """Test import questions command reads CSV files"""
+        path = os.path.join(os.path.dirname(__file__), 'test_import.csv')
+        with open(path, 'w') as csv_file:
+            csv_file.write('question,answer,difficulty,category\n')
+            csv_file.write('Imported CSV question?,Yes,3,4\n')
+            csv_file.write('Imported CSV question without difficulty?,No,,4\n')
+
+        try:
+            result = self.app.test_cli_runner().invoke(args=['import-questions', path])
+        finally:
+            os.remove(path)
+
+        imported = Question.query.filter(Question.question.like('Imported CSV question%')).all()
+        for question in imported:
+            question.delete()
+
+        self.assertEqual(0, result.exit_code)
+        self.assertIn('Imported 1 questions, 1 failed', result.output)
+        self.assertEqual(1, len(imported))
+
+    def test_export_questions_ndjson_in_chunks(self):
+        """Test export questions streams every question as NDJSON whatever the chunk size"""
+        res = self.client().get('/questions/export?chunk_size=4')
+        questions = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+
+        self.assertEqual(200, res.status_code)
+        self.assertNotIn('Content-Length', res.headers)
+        self.assertEqual('application/x-ndjson', res.mimetype)
+        self.assertEqual(19, len(questions))
+        self.assertEqual(sorted(question['id'] for question in questions), [question['id'] for question in questions])
+        self.assertEqual({'id', 'question', 'answer', 'category', 'difficulty'}, set(questions[0]))
+
+    def test_export_questions_csv_of_category_after_watermark(self):
+        """Test export questions as CSV of one category after the last exported id"""
+        res = self.client().get('/questions/export?format=csv&category=6&after_id=10&fields=id,answer')
+
+        self.assertEqual(200, res.status_code)
+        self.assertEqual('text/csv', res.mimetype)
+        self.assertEqual('id,answer\n11,Uruguay\n', res.get_data(as_text=True))
+
+    def test_export_questions_with_cli_imports_back(self):
+        """Test export questions command writes a file the import command reads"""
+        path = os.path.join(os.path.dirname(__file__), 'test_export.csv')
+
+        try:
+            exported = self.app.test_cli_runner().invoke(args=['export-questions', path, '--category', '6'])
+            with open(path) as csv_file:
+                lines = csv_file.read().splitlines()
+            imported = self.app.test_cli_runner().invoke(args=['import-questions', path])
+        finally:
+            os.remove(path)
+
+        self.assertEqual(0, exported.exit_code)
+        self.assertEqual('id,question,answer,category,difficulty', lines[0])
+        self.assertEqual(['10', '11'], [line.split(',')[0] for line in lines[1:]])
+        self.assertIn('Imported 2 questions, 0 failed', imported.output)
+
+    def test_export_questions_400_unsupported_format(self):
+        """Test export questions 400 unsupported format"""
+        self.assert_400_true(self.client().get('/questions/export?format=xml'))
+
+    def test_import_questions_400_unsupported_format(self):
+        """Test import questions 400 unsupported format"""
+        res = self.client().post('/questions/import', data='<questions/>', content_type='application/xml')
+        self.assert_400_true(res)
+
     def test_delete_question_success(self):
         """Test delete question success"""
         res = self.client().delete('/questions/5')
@@ -151,6 +1001,71 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().delete('/questions/100')
         self.assert_404_true(res)
 
+    def test_mutate_questions_deletes_and_updates_in_one_call(self):
+        """Test mutate questions deletes and updates many questions in one call"""
+        questions = [Question(question='Batch question?', answer='Batch', category=1, difficulty=1) for _ in range(3)]
+        for question in questions:
+            question.insert()
+        ids = [question.id for question in questions]
+
+        data = json.dumps({
+            "delete": [ids[0], ids[1], 1000],
+            "update": [{"id": ids[2], "difficulty": 5, "answer": "Updated"}, {"id": 1001, "difficulty": 1}]
+            })
+        res = self.client().patch('/questions', data=data, content_type='application/json')
+
+        updated = Question.query.get(ids[2])
+        updated_fields = (updated.difficulty, updated.answer)
+        updated.delete()
+
+        self.assertEqual(200, res.status_code)
+        json_response = res.get_json()
+
+        self.assertTrue(json_response['success'])
+        self.assertEqual(ids[:2], json_response['deleted'])
+        self.assertEqual([ids[2]], json_response['updated'])
+        self.assertEqual(0, Question.query.filter(Question.id.in_(ids[:2])).count())
+        self.assertEqual((5, 'Updated'), updated_fields)
+
+    def test_mutate_questions_422_invalid_update_rolls_back_deletes(self):
+        """Test mutate questions 422 invalid update rolls back the deletes"""
+        data = json.dumps({"delete": [2], "update": [{"id": 4, "difficulty": 6}]})
+        res = self.client().patch('/questions', data=data, content_type='application/json')
+
+        self.assert_422_true(res)
+        self.assertIsNotNone(Question.query.get(2))
+
+    def test_mutate_questions_422_unknown_field(self):
+        """Test mutate questions 422 unknown field"""
+        data = json.dumps({"update": [{"id": 4, "rating": 1}]})
+        res = self.client().patch('/questions', data=data, content_type='application/json')
+
+        self.assert_422_true(res)
+
+    def test_mutate_questions_400_body_not_an_object(self):
+        """Test mutate questions 400 when the body is not a JSON object"""
+        res = self.client().patch('/questions', data='[2, 4]', content_type='application/json')
+
+        self.assert_400_true(res)
+
+    def test_mutate_questions_422_boolean_id(self):
+        """Test mutate questions 422 when an id is a boolean"""
+        res = self.client().patch('/questions', data=json.dumps({"delete": [True]}), content_type='application/json')
+        self.assert_422_true(res)
+
+        res = self.client().patch('/questions', data=json.dumps({"update": [{"id": True, "difficulty": 1}]}), content_type='application/json')
+        self.assert_422_true(res)
+
+    def test_mutate_questions_422_missing_category(self):
+        """Test mutate questions 422 when an update moves a question to a category which does not exist"""
+        category = Question.query.get(4).category
+        data = json.dumps({"delete": [2], "update": [{"id": 4, "category": 100}]})
+        res = self.client().patch('/questions', data=data, content_type='application/json')
+
+        self.assert_422_true(res)
+        self.assertEqual(category, Question.query.get(4).category)
+        self.assertIsNotNone(Question.query.get(2))
+
     def test_post_quizzes_success(self):
         """Test post quizzes success"""
         previous_questions = list([5, 9, 2])
@@ -184,6 +1099,86 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(previous_questions, json_response['previousQuestions'])
         self.assertIsNone(json_response['question'])
 
+    def test_post_quizzes_all_categories_skips_previous_questions(self):
+        """Test post quizzes all categories skips previous questions"""
+        expected_question = Question.query.order_by(Question.id.desc()).first()
+        previous_questions = [question.id for question in Question.query.filter(Question.id != expected_question.id)]
+        data = json.dumps({"previous_questions": previous_questions, "quiz_category": {"id": 0}})
+        res = self.client().post('/quizzes', data=data, content_type='application/json')
+
+        self.assertEqual(200, res.status_code)
+        json_response = res.get_json()
+
+        self.assertTrue(json_response['success'])
+        self.assertEqual(expected_question.id, json_response['question']['id'])
+
+    def test_random_question_without_decks_wraps_around(self):
+        """Test the random question drawn without decks wraps around to the first eligible question of the category"""
+        with self.app.test_request_context():
+            draws = {random_question_or_none([], 6).id for _ in range(100)}
+            wrapped = {random_question_or_none([11], 6).id for _ in range(20)}
+            exhausted = random_question_or_none([10, 11], 6)
+
+        self.assertEqual({10, 11}, draws)
+        self.assertEqual({10}, wrapped)
+        self.assertIsNone(exhausted)
+
+    def test_quiz_session_serves_each_question_once(self):
+        """Test a quiz session serves every question of the category once without previous questions"""
+        res = self.client().post('/quizzes/sessions', data='{"quiz_category": {"id": 6}}', content_type='application/json')
+        session = res.get_json()
+
+        self.assertEqual(200, res.status_code)
+        self.assertEqual(2, session['total_questions'])
+
+        data = json.dumps({"session_id": session['session_id']})
+        turns = [self.client().post('/quizzes', data=data, content_type='application/json').get_json() for _ in range(3)]
+
+        self.assertEqual([10, 11], sorted(turn['question']['id'] for turn in turns[:2]))
+        self.assertEqual([1, 0, 0], [turn['remaining'] for turn in turns])
+        self.assertIsNone(turns[2]['question'])
+        self.assertNotIn('previousQuestions', turns[0])
+
+    def test_quiz_session_skips_previous_questions(self):
+        """Test a quiz session leaves out the previous questions given at its start"""
+        data = '{"quiz_category": {"id": 6}, "previous_questions": [10]}'
+        session_id = self.client().post('/quizzes/sessions', data=data, content_type='application/json').get_json()['session_id']
+
+        res_json = self.client().post('/quizzes', data=json.dumps({"session_id": session_id}), content_type='application/json').get_json()
+
+        self.assertEqual(11, res_json['question']['id'])
+
+    def test_quiz_session_deck_sampled_without_copying_the_category(self):
+        """Test a quiz session deck smaller than the category is sampled from it without copying its ids"""
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "QUIZ_DECK_SIZE": 3
+        })
+        data = '{"quiz_category": {"id": 0}, "previous_questions": [2, 4, 5]}'
+
+        with mock.patch.object(CategoryDecks, 'ids', side_effect=AssertionError('the deck copied the category')):
+            session = app.test_client().post('/quizzes/sessions', data=data, content_type='application/json').get_json()
+
+        data = json.dumps({"session_id": session['session_id']})
+        ids = [app.test_client().post('/quizzes', data=data, content_type='application/json').get_json()['question']['id'] for _ in range(3)]
+
+        self.assertEqual(3, session['total_questions'])
+        self.assertEqual(3, len(set(ids)))
+        self.assertFalse({2, 4, 5} & set(ids))
+
+    def test_quiz_session_404_after_end(self):
+        """Test post quizzes 404 for a session which was ended"""
+        session_id = self.client().post('/quizzes/sessions', data='{"quiz_category": {"id": 0}}', content_type='application/json').get_json()['session_id']
+
+        self.assertEqual(200, self.client().delete('/quizzes/sessions/' + session_id).status_code)
+        self.assert_404_true(self.client().post('/quizzes', data=json.dumps({"session_id": session_id}), content_type='application/json'))
+        self.assert_404_true(self.client().delete('/quizzes/sessions/' + session_id))
+
+    def test_quiz_session_400_due_to_non_existing_category(self):
+        """Test start quiz session 400 due to non existing category"""
+        res = self.client().post('/quizzes/sessions', data='{"quiz_category": {"id": 20}}', content_type='application/json')
+        self.assert_400_true(res)
+
     def test_post_quizzes__400_missing_content_type_application_json(self):
         """Test post quizzes 400 missing content type application json"""
         res = self.client().post('/quizzes', data='{"previous_questions": [1, 2, 3], "quiz_category": {"id": 1}}')
@@ -204,6 +1199,54 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().post('/quizzes', data='{"quiz_category": {"id": 1}}', content_type='application/json')
         self.assert_422_true(res)
 
+    def test_post_quizzes_429_over_rate_limit(self):
+        """Test post quizzes 429 once a client spent its burst, other clients being served"""
+        db.session.remove()
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": self.database_path,
+            "RATE_LIMITS": {'POST /quizzes': '0.01/2'}
+        })
+        client = app.test_client()
+        data = '{"previous_questions": [], "quiz_category": {"id": 0}}'
+
+        statuses = [client.post('/quizzes', data=data, content_type='application/json').status_code for _ in range(3)]
+        res = client.post('/quizzes', data=data, content_type='application/json')
+        other = client.post('/quizzes', data=data, content_type='application/json', environ_base={'REMOTE_ADDR': '10.0.0.2'})
+
+        self.assertEqual([200, 200, 429], statuses)
+        self.assertEqual({"success": False, "error": 429, "message": "Too many requests"}, res.get_json())
+        self.assertGreaterEqual(int(res.headers['Retry-After']), 99)
+        self.assertEqual(200, other.status_code)
+        self.assertIn('trivia_rate_limited_total{route="POST /quizzes"} 2', client.get('/metrics').get_data(as_text=True))
+
+    def test_add_question_503_while_pool_overloaded(self):
+        """Test limited routes answer 503 while the connection pool is exhausted, reads being served"""
+        overloaded = {'size': 5, 'checked_out': 15, 'overflow': 10, 'wait_seconds_recent': 0.0}
+
+        with mock.patch('rate_limit.pool_stats', return_value=overloaded):
+            res = self.client().post('/questions', data='{"question": "Shed?", "answer": "Shed", "category": 1, "difficulty": 1}', content_type='application/json')
+            read = self.client().get('/categories')
+
+        self.assertEqual(503, res.status_code)
+        self.assertFalse(res.get_json()['success'])
+        self.assertEqual('1', res.headers['Retry-After'])
+        self.assertEqual(200, read.status_code)
+
+    def test_add_question_stops_shedding_once_pool_idle(self):
+        """Test the recent checkout wait decays while the pool is idle, so limited routes are served again"""
+        pool = TimedQueuePool(lambda: None)
+        pool.recent_wait_time = 1.0
+        data = '{"question": "Shed?", "answer": "Shed", "category": 1, "difficulty": 1}'
+
+        with mock.patch('rate_limit.pool_stats', side_effect=lambda app: pool.stats()):
+            with mock.patch('models.time.perf_counter', return_value=pool.recent_wait_at):
+                shed = self.client().post('/questions', data=data, content_type='application/json')
+            with mock.patch('models.time.perf_counter', return_value=pool.recent_wait_at + 60):
+                served = self.client().post('/questions', data=data, content_type='application/json')
+
+        self.assertEqual(503, shed.status_code)
+        self.assertEqual(200, served.status_code)
+
     def assert_categories_equal(self, res_json):
         """Assert all categories are in the json response."""
         actual_categories = res_json.get('categories')
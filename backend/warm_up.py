@@ -0,0 +1,62 @@
+"""Warm-up of a worker: database connections and in-process caches"""
+import os
+import time
+from category_decks import get_category_decks
+from models import REPLICA_BIND, TimedQueuePool, db, get_category_cache
+from search import get_autocomplete_index, get_search_index
+from snapshot import SNAPSHOT
+
+WARM_UP = os.environ.get('TRIVIA_WARM_UP', 'false').lower() == 'true'
+
+
+def open_pool_connections(app, bind=None):
+    """Opens pool size connections of the bind at once and returns them to the pool"""
+    pool = db.get_engine(app, bind=bind).pool
+    size = pool.size() if isinstance(pool, TimedQueuePool) else 1
+    connections = []
+
+    try:
+        for _ in range(size):
+            connections.append(db.get_engine(app, bind=bind).connect())
+    finally:
+        for connection in connections:
+            connection.close()
+
+    return len(connections)
+
+def warm_up(app):
+    """Fills the pools, the snapshot, the category cache, the category decks and the search indexes of the app.
+
+    Returns the milliseconds spent on every step. Call it once per worker,
+    after the fork, since the connections must not be shared by processes.
+    """
+    steps = [('pool', lambda: open_pool_connections(app))]
+
+    if REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {}):
+        steps.append(('replica_pool', lambda: open_pool_connections(app, bind=REPLICA_BIND)))
+
+    snapshot = app.extensions[SNAPSHOT]
+    if snapshot is not None and snapshot.is_stale():
+        steps.append(('snapshot', snapshot.build))
+
+    steps.append(('categories', get_category_cache(app).get))
+    steps.append(('decks', get_category_decks))
+    steps.append(('search', get_search_index))
+    steps.append(('autocomplete', get_autocomplete_index))
+
+    timings = {}
+
+    with app.app_context():
+        for name, step in steps:
+            start = time.perf_counter()
+            step()
+            timings[name] = round((time.perf_counter() - start) * 1000, 3)
+
+    return timings
+
+def init_warm_up(app):
+    """Warms the app up when it is created if WARM_UP is set"""
+    app.config.setdefault('WARM_UP', WARM_UP)
+
+    if app.config['WARM_UP']:
+        warm_up(app)
@@ -10,6 +10,7 @@ class QuizView extends Component {
     this.state = {
       quizCategory: null,
       previousQuestions: [],
+      roundQuestions: [],
       showAnswer: false,
       categories: {},
       numCorrect: 0,
@@ -35,40 +36,31 @@ class QuizView extends Component {
   }
 
   selectCategory = ({ type, id = 0 }) => {
-    this.setState({ quizCategory: { type, id } }, this.getNextQuestion);
+    this.setState({ quizCategory: { type, id } }, this.getQuizRound);
   };
 
   handleChange = (event) => {
     this.setState({ [event.target.name]: event.target.value });
   };
 
-  getNextQuestion = () => {
-    const previousQuestions = [...this.state.previousQuestions];
-    if (this.state.currentQuestion.id) {
-      previousQuestions.push(this.state.currentQuestion.id);
-    }
-
+  // Fetches every question of the round at once, they are then played locally.
+  getQuizRound = () => {
     $.ajax({
       url: '/quizzes', //TODO: update request URL
       type: 'POST',
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
+        previous_questions: this.state.previousQuestions,
         quiz_category: this.state.quizCategory,
+        count: questionsPerPlay,
       }),
       xhrFields: {
         withCredentials: true,
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true,
-        });
+        this.setState({ roundQuestions: result.questions }, this.getNextQuestion);
         return;
       },
       error: (error) => {
@@ -78,6 +70,24 @@ class QuizView extends Component {
     });
   };
 
+  getNextQuestion = () => {
+    const previousQuestions = [...this.state.previousQuestions];
+    if (this.state.currentQuestion.id) {
+      previousQuestions.push(this.state.currentQuestion.id);
+    }
+
+    const [nextQuestion, ...roundQuestions] = this.state.roundQuestions;
+
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      roundQuestions: roundQuestions,
+      currentQuestion: nextQuestion || {},
+      guess: '',
+      forceEnd: nextQuestion ? false : true,
+    });
+  };
+
   submitGuess = (event) => {
     event.preventDefault();
     let evaluate = this.evaluateAnswer();
@@ -91,6 +101,7 @@ class QuizView extends Component {
     this.setState({
       quizCategory: null,
       previousQuestions: [],
+      roundQuestions: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
@@ -1,8 +1,10 @@
 import React, { Component } from 'react';
+import $ from 'jquery';
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   };
 
   getInfo = (event) => {
@@ -14,6 +16,30 @@ class Search extends Component {
     this.setState({
       query: this.search.value,
     });
+    this.getSuggestions(this.search.value);
+  };
+
+  getSuggestions = (query) => {
+    if (!query.trim()) {
+      this.setState({ suggestions: [] });
+      return;
+    }
+
+    $.ajax({
+      url: `/questions/autocomplete?q=${encodeURIComponent(query)}`,
+      type: 'GET',
+      success: (result) => {
+        // Typing may have gone on while the request was in flight.
+        if (query === this.state.query) {
+          this.setState({ suggestions: result.suggestions });
+        }
+        return;
+      },
+      error: (error) => {
+        this.setState({ suggestions: [] });
+        return;
+      },
+    });
   };
 
   render() {
@@ -23,7 +49,14 @@ class Search extends Component {
           placeholder='Search questions...'
           ref={(input) => (this.search = input)}
           onChange={this.handleInputChange}
+          list='search-suggestions'
+          autoComplete='off'
         />
+        <datalist id='search-suggestions'>
+          {this.state.suggestions.map((suggestion) => (
+            <option key={suggestion.id} value={suggestion.snippet} />
+          ))}
+        </datalist>
         <input type='submit' value='Submit' className='button' />
       </form>
     );